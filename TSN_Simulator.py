@@ -2,6 +2,8 @@
 Main TSN Simulator
 
 Specify file locations for neccesay files (Network Topo, Traffic Definition, GCL, Queue definition)
+Run this file to simulate with the USER SETTINGS, or import it and use Simulation to run simulations from another script
+Any USER SETTING can also be given on the command line (see --help), which runs without prompting for anything missing
 """
 
 ##################################################
@@ -11,9 +13,33 @@ Specify file locations for neccesay files (Network Topo, Traffic Definition, GCL
 # libraries
 import random
 import math
+import os
+import sys
+import io
+import contextlib
+import itertools
+import hashlib
+import statistics
+import argparse
+import json
+import pickle
+import signal
 import csv
+import heapq
+import struct
+import gzip
+import lzma
+import queue as queue_module  # thread-safe queues, the simulator has its own Queue class
+import threading
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from lxml import etree
+try:
+    import numpy as np  # optional, used for ST release calendars, the SCENARIO engine and load_packet_trace
+except ImportError:
+    np = None
 
 # scripts
 import generator_utilities as gen_utils
@@ -24,15 +50,8 @@ import crude_traffic_def_generator as traffic_def_gen  # traffic definition gene
 # Traffic Rules -> ES mapping is an optional file and if not provided the simulator asks for its own paramerters
 
 # global variables
-g_timestamp = 0
-g_generic_traffics_dict = {}  # dictionary of generic traffic rules from file - key is ID
-g_node_id_dict = {}  # key is node id, value is node object
-g_original_GCL = {}  # store original GCL for long simulations
-g_offline_GCL = {}  # key is timestamp, value is the gate state at that timestamp
-g_current_GCL_state = ""  # state of GCL shared across entire simulator, to be changed according to GCL and timestamp
-# should only change gate state if we have a key for that timestamp, else leave it as previous value
-g_packet_latencies = []  # list to store a list of every packet latency
-g_queueing_delays = []  # list to store every queueing delay
+# the state of a run belongs to its Simulation object, so one process can hold any number of simulations
+g_current = threading.local()  # .simulation is the Simulation running on this thread, stored packets read their fields from it
 
 
 
@@ -45,6 +64,11 @@ g_queueing_delays = []  # list to store every queueing delay
 e_es_types = ["sensor", "control"]  # possible end station types?
 e_queue_schedules = ["FIFO", "EDF"]  # possible queue schedules
 e_queue_type_names = ["ST", "Emergency", "Sporadic_Hard", "Sporadic_Soft", "BE"]  # possible queue types
+e_sim_engines = ["TICK", "EVENT"]  # possible simulator engines
+e_event_types = ["Release", "Reception", "Transmission", "Gate"]  # possible events used by the EVENT engine
+e_traffic_classes = ["ST", "Sporadic_Hard", "Sporadic_Soft", "BE"]  # possible packet types, packets store their position here
+e_trace_formats = ["binary", "CSV"]  # possible packet trace file formats
+e_trace_compressions = ["none", "gzip", "lzma"]  # possible packet trace file compressions
 
 
 # global variables to set
@@ -52,7 +76,35 @@ MAX_NODE_COUNT = 100
 MAX_TRAFFIC_COUNT = 1000
 MAX_TIMESTAMP = 0  # debug
 SIM_DEBUG = 0  # debug for simulator to see timestamps
-# random.seed(10)  # for consistent experementation
+SIM_ENGINE = e_sim_engines[0]  # TICK visits every node on every tick, EVENT jumps straight to the next tick where something happens
+USE_PACKET_STORE = False  # keep packets as rows of integer arrays instead of objects, for very large numbers of packets in flight
+PACKET_STORE_CAPACITY = 100000  # initial number of packet rows in the store, doubles whenever it fills up
+RELEASE_CALENDAR_CHUNK = 10000  # number of ticks of ST releases the TICK engine precomputes at a time
+WRITE_PACKET_TRACE = False  # write a record of every delivered packet to the _out_packet_trace file
+PACKET_TRACE_FORMAT = e_trace_formats[0]  # binary records can be loaded with load_packet_trace(), CSV is readable but slower to encode
+PACKET_TRACE_COMPRESSION = e_trace_compressions[0]  # compress the trace file, only uncompressed binary traces can be memmapped
+PACKET_TRACE_CHUNK = 65536  # number of trace records buffered before they are written to the file
+PACKET_TRACE_THREAD = True  # encode, compress and write the trace on a background thread instead of the simulation thread
+PACKET_TRACE_QUEUE_SIZE = 4  # chunks waiting for the background thread before the simulation has to wait for it
+KEEP_RAW_DELAYS = False  # keep every latency and queueing delay in a list (needed for the per-packet CSV files). Uses memory per packet
+GEOMETRIC_RELEASES = True  # BE and sporadic ES sample when they next fire once per packet instead of rolling every tick
+WARMUP_TIMESTAMP = 0  # tick every variant continues from. Variant (and replica) statistics only cover the ticks after it
+VARIANTS = []  # (name, queue_definition_file, GCL_file[, QUEUE_SCHEDULES]) of each variant to run after the warm-up. Blank files keep the current ones
+FORK_VARIANTS = True  # run variants in parallel child processes where os.fork is available, else one after another
+LOCKSTEP_VARIANTS = False  # run variants side by side in one process on the same generated traffic (common random numbers) instead
+QUEUE_SCHEDULES = {}  # queue type name -> schedule, replaces the schedule the queue definition gives that queue type in every switch
+SWEEP_GRID = {}  # setting name -> list of values. Every combination is simulated in parallel instead of a single run
+SWEEP_POINTS = []  # settings dicts to simulate in parallel as well as the SWEEP_GRID combinations
+SWEEP_WORKERS = 0  # number of processes sweep points (and replicas) are simulated in, 0 for one per CPU
+REPLICATIONS = 0  # number of independent replicas to simulate in parallel and report confidence intervals for, instead of a single run
+CONFIDENCE_LEVEL = 0.95  # confidence level of the intervals reported for the replicas
+SCENARIOS = []  # dicts of SCENARIO_SETTINGS to simulate together with the vectorised SCENARIO engine instead of a single run (needs NumPy)
+SCENARIO_MIN_BATCH = 16  # fewer SCENARIOS than this are simulated one after another with SIM_ENGINE, which is faster for so few
+REPLICA = -1  # replica a simulation spawns its random streams (one per node) for, -1 for one stream shared by the whole simulation
+WRITE_CHECKPOINTS = False  # save the simulator state to the _checkpoint.pkl.gz file every CHECKPOINT_INTERVAL ticks and on Ctrl+C
+CHECKPOINT_INTERVAL = 1000000  # number of ticks between checkpoints
+RESUME_CHECKPOINT = ""  # checkpoint file to continue from instead of parsing the input files
+RANDOM_SEED = None  # seed of the random numbers of a simulation for consistent experementation, None for a different run every time
 
 
 # generator parameters
@@ -67,7 +119,7 @@ files_directory = "simulator_files\\"
 prefix = ""
 network_topo_file = ""
 queue_definition_file = ""
-GCL_file = ""
+GCL_file = ""  # global GCL. A switch can use its own with a gcl="filename" attribute in the queue definition
 traffic_definition_file = ""
 traffic_mapping_file = ""
 
@@ -91,13 +143,17 @@ traffic_mapping_file    = files_directory+prefix+"_traffic_mapping.txt"
 # node base class
 class Node():
 
-    def __init__(self, id, name="unnamed"):
+    def __init__(self, sim, id, name="unnamed"):
+        self.sim = sim  # Simulation this node belongs to
         self.node_type = str(self.__class__.__name__)  # this will be the same as the class name for each node
         self.id = id  # unique
         self.name = name
         self.ingress_traffic = []
         self.egress_traffic = []
         self.busy = 0  # attribute used to see how busy the node is (how many ticks it has left to complete)
+        self.next_event_timestamp = -1  # timestamp of the next event scheduled for this node in the EVENT engine
+        self.index = -1  # position in sim.es_ids or sim.switch_ids, nodes are always simulated in this order
+        self.random = sim.get_random_stream(id)  # every random number of the node comes from here
 
 
     def RX_packet(self, packet):
@@ -120,7 +176,7 @@ class Node():
 
         # display traffic gen paramerters
         if self.node_type == "End_Station":
-            output_str += " (Type: "+str(self.t_type)+") "
+            output_str += " (Type: "+", ".join([str(flow.t_type) for flow in self.flows])+") "
 
         return output_str
 
@@ -129,45 +185,57 @@ class Node():
 # end station type of node
 class End_Station(Node):
 
-    def __init__(self, id, parent_id, name="unnamed"):
-        super().__init__(id, name)
+    def __init__(self, sim, id, parent_id, name="unnamed"):
+        super().__init__(sim, id, name)
         self.type = e_es_types[0]  # default
         self.parent_id = int(parent_id)
+        self.flows = []  # Traffic_Flow of every traffic rule mapped to this ES
+        self.release_heap = []  # heap of (next_release, flow_index), flows are only checked to generate when they are due
 
 
-    # check if it is packet generation time and if so put new packet in egress
+    # function to recieve a packet into the ingress queue and mark this ES as needing to digest it
+    def RX_packet(self, packet):
+        self.sim.active_es_ingress.add(self.id)
+        return super().RX_packet(packet)
+
+
+    # check if it is packet generation time for any flow and if so put the new packets in egress
+    # flows due on the same tick are checked in the order they were mapped to this ES so their packets egress in that order
+    # returns the indexes of the flows that generated a packet
     def check_to_generate(self):
 
-        # determine type as ST generates differently
-        if self.t_type == "ST":
-            if self.generate():  # returns true when its time to generate a packet
-                packet = ST(self.id, self.t_dest, self.t_delay_jitter, self.t_period, self.t_deadline,
-                            self.t_size, self.t_name, self.t_offset)
-                self.egress(packet)  # generate new packet and egress it
+        due_flows = []
+        while( (len(self.release_heap) != 0) and (self.release_heap[0][0] <= self.sim.timestamp) ):
+            due_flows.append(heapq.heappop(self.release_heap)[1])
+        due_flows.sort()
 
-        # SH
-        elif self.t_type == "Sporadic_Hard":
-            if self.generate():  # returns true when its time to generate a packet
-                packet = Sporadic_Hard(self.id, self.t_dest, self.t_min_release, self.t_delay_jitter, \
-                                       self.t_deadline, self.t_size, self.t_name, self.t_offset)
-                self.egress(packet)
+        generated_flows = []
+        for flow_index in due_flows:
+            flow = self.flows[flow_index]
+            if flow.generate():  # returns true when its time to generate a packet
+                self.egress(flow.create_packet())  # generate new packet and egress it
+                generated_flows.append(flow_index)
+            self.push_release(flow, self.sim.timestamp+1)
+
+        return generated_flows
 
-        # SS
-        elif self.t_type == "Sporadic_Soft":
-            if self.generate():  # returns true when its time to generate a packet
-                packet = Sporadic_Soft(self.id, self.t_dest, self.t_min_release, self.t_delay_jitter, \
-                                       self.t_deadline, self.t_size, self.t_name, self.t_offset)
-                self.egress(packet)
-
-        # BE
-        elif self.t_type == "BE":
-            if self.generate():  # returns true when its time to generate a packet
-                packet = BE(self.id, self.t_dest, self.t_size, self.t_name, self.t_offset)
-                self.egress(packet)
-
-        # else unrecognised packet
-        else:
-            print("ERROR: Unrecognised packet generation request in ES", "\""+str(self.id)+"\"")
+
+    # function to put a new packet of each of the given flows in egress without checking if they are due
+    # used by simulations that follow the releases of another simulation in lockstep
+    def generate_flows(self, flow_indexes):
+        for flow_index in flow_indexes:
+            self.egress(self.flows[flow_index].create_packet())
+        return 1
+
+
+    # function to put a flow in the release heap at its next release from the given timestamp, unless it never releases
+    def push_release(self, flow, timestamp=-1):
+        if timestamp == -1:
+            timestamp = self.sim.timestamp
+
+        next_release = flow.get_next_release(timestamp)
+        if next_release != math.inf:
+            heapq.heappush(self.release_heap, (next_release, flow.index))
 
         return 1
 
@@ -185,44 +253,45 @@ class End_Station(Node):
 
             # can only digest packet from ingress if the entire packet is present
             if packet.arrival_time == -1:  # if it is the packets first tick in the ingress queue of the ES
-                if SIM_DEBUG:  # debug
-                    print("[T", str(g_timestamp).zfill(3)+"]", "Found", \
+                if self.sim.SIM_DEBUG:  # debug
+                    print("[T", str(self.sim.timestamp).zfill(3)+"]", "Found", \
                           "start of "+str(packet.type)+" packet \""+str(packet.name)+"\" size \""+str(packet.size)+"\"" \
-                          if math.ceil(int(packet.size) / SENDING_SIZE_CAPCITY) > 1 else \
+                          if packet.transmission_ticks > 1 else \
                           str(packet.type)+" packet \""+str(packet.name)+"\"" \
                           , "from ES", "\""+str(packet.source)+"\"", "in destination ingress queue of ES", "\""+str(self.id)+"\"")
 
-                packet.set_arrival_time(g_timestamp)  # add queue enter timestamp
+                packet.set_arrival_time(self.sim.timestamp)  # add queue enter timestamp
 
             # then check the packets size compared to how much we can accept per tick
-            if ((g_timestamp - packet.arrival_time) + 1) != math.ceil(int(packet.size) / SENDING_SIZE_CAPCITY):
+            if ((self.sim.timestamp - packet.arrival_time) + 1) != packet.transmission_ticks:
                 continue  # if it hasnt fully arrived we cant digest it. Try again next tick, move on to other packets
             # else properly ingest the packet into the correct inner queue
 
 
-            # add latency to global list including time ES was busy receiving packet. i.e. latency is start of send until complete receive
-            g_packet_latencies.append(int(packet.arrival_time)-int(packet.transmission_time) + \
-                                      int(math.ceil(int(packet.size) / SENDING_SIZE_CAPCITY)) )
+            # add latency to global statistics including time ES was busy receiving packet. i.e. latency is start of send until complete receive
+            latency = packet.arrival_time - packet.transmission_time + packet.transmission_ticks
+            traffic_id = self.sim.node_id_dict[packet.source].flows[packet.flow].traffic_id
+            self.sim.latency_stats.add(latency)
+            self.sim.latency_breakdown.add(packet, latency, traffic_id)
+            if self.sim.packet_trace != -1:
+                self.sim.packet_trace.add(packet, latency, traffic_id)
+            if self.sim.KEEP_RAW_DELAYS:
+                self.sim.packet_latencies.append(latency)
             final_ingress.remove(packet)  # remove from copy of list so we dont alter the for loop
 
 
             # to check the latency of the packet hasn't extended past its deadline we need to check the types
-            if packet.type == "ST":
-                if g_packet_latencies[-1] > packet.hard_deadline:
-                    print("CRITICAL ERROR:", str(packet.type), "packet", "\""+str(packet.name)+"\"", "from ES", "\""+str(packet.source)+"\"", \
-                          "reached destination ES", "\""+str(self.id)+"\"", "AFTER its deadline")
-                    failed = True
-            elif packet.type == "Sporadic_Hard":
-                if g_packet_latencies[-1] > packet.hard_deadline:
+            if packet.traffic_class == 0 or packet.traffic_class == 1:  # ST and SH have hard deadlines
+                if latency > packet.deadline:
                     print("CRITICAL ERROR:", str(packet.type), "packet", "\""+str(packet.name)+"\"", "from ES", "\""+str(packet.source)+"\"", \
                           "reached destination ES", "\""+str(self.id)+"\"", "AFTER its deadline")
                     failed = True
-            elif packet.type == "Sporadic_Soft":
-                if g_packet_latencies[-1] > packet.soft_deadline:
+            elif packet.traffic_class == 2:  # SS
+                if latency > packet.deadline:
                     print("ERROR:", str(packet.type), "packet", "\""+str(packet.name)+"\"", "from ES", "\""+str(packet.source)+"\"", \
                           "reached destination ES", "\""+str(self.id)+"\"", "AFTER its deadline")
                     failed = True
-            elif packet.type == "BE":  # no timing constraints
+            elif packet.traffic_class == 3:  # BE has no timing constraints
                 pass
             else:
                 print("ERROR: Unrecognised packet type", "\""+str(packet.type)+"\"", "has reached ES", \
@@ -230,17 +299,20 @@ class End_Station(Node):
                 failed = True
 
 
-            if SIM_DEBUG and not failed:  # for debug
-                print("[T", str(g_timestamp).zfill(3)+"]", "Digested", str(packet.type), "packet", \
+            if self.sim.SIM_DEBUG and not failed:  # for debug
+                print("[T", str(self.sim.timestamp).zfill(3)+"]", "Digested", str(packet.type), "packet", \
                       "\""+str(packet.name)+"\"", "from source ES", "\""+str(packet.source)+"\"", \
                       "at final destination ES", "\""+str(self.id)+"\"", "with latency", \
-                      "\""+str(int(packet.arrival_time)-int(packet.transmission_time))+"\"")
+                      "\""+str(packet.arrival_time - packet.transmission_time)+"\"")
+
+            if self.sim.USE_PACKET_STORE:  # packet has left the network so its row can be reused
+                self.sim.packet_store.free(packet)
 
         self.ingress_traffic = final_ingress  # update queue with packets removed. Real world would act on packet here - maybe send something back
 
 
         if failed:
-            exit()  # call some recovery function here in future
+            exit(1)  # call some recovery function here in future
             return 0
         else:
             return 1
@@ -249,13 +321,14 @@ class End_Station(Node):
     # function to add a packet to the egress queue with error checking
     def egress(self, packet):
 
-        if SIM_DEBUG:  # for debug
-            print("[T", str(g_timestamp).zfill(3)+"]", "Adding newly generated", str(self.t_type), "packet", \
+        if self.sim.SIM_DEBUG:  # for debug
+            print("[T", str(self.sim.timestamp).zfill(3)+"]", "Adding newly generated", str(packet.type), "packet", \
                   "\""+str(packet.name)+"\"", "to egress queue of ES", "\""+str(self.id)+"\"")
 
         # make sure packet matches a type defined at the start of the program
-        if packet.type in e_queue_type_names:
+        if isinstance(packet, (Packet, Stored_Packet)):
             self.egress_traffic.append(packet)
+            self.sim.active_es_egress.add(self.id)
             return 1
 
         else:
@@ -276,70 +349,47 @@ class End_Station(Node):
 
             # loop over all packets in egress queue
             for packet in self.egress_traffic:
-                g_node_id_dict[self.parent_id].RX_packet(packet)  # send the packet to the parent switches ingress queue
-                self.busy = math.ceil(int(packet.size) / SENDING_SIZE_CAPCITY)  # how many ticks the node will be busy for
+                self.sim.node_id_dict[self.parent_id].RX_packet(packet)  # send the packet to the parent switches ingress queue
+                self.busy = packet.transmission_ticks  # how many ticks the node will be busy for
                 self.egress_traffic.remove(packet)  # remove this packet from queue as it is being sent
 
-                if SIM_DEBUG:  # for debug
-                    print("[T", str(g_timestamp).zfill(3)+"]", "Sending", str(packet.type), "packet", \
-                          "\""+str(packet.name)+"\"", "of size", "\""+str(self.t_size)+"\"", "to parent Switch", \
+                if self.sim.SIM_DEBUG:  # for debug
+                    print("[T", str(self.sim.timestamp).zfill(3)+"]", "Sending", str(packet.type), "packet", \
+                          "\""+str(packet.name)+"\"", "of size", "\""+str(packet.size)+"\"", "to parent Switch", \
                           "\""+str(self.parent_id)+"\"", "from egress queue of ES", "\""+str(self.id)+"\"")
 
                 return 1
         return 1
 
 
-    # function to be used within the packet generator that chooses when to generate a packet depending on type (simulate sporadicness)
-    def generate(self):
+    # function to get the next tick one of the flows of this ES is due to check to generate, math.inf if there is none
+    def get_next_release(self):
+        if len(self.release_heap) == 0:
+            return math.inf
+        return self.release_heap[0][0]
 
-        # if there is an offset, dont do anything for first N ticks
-        if self.t_offset != 0:
-            if g_timestamp < self.t_offset:
-                return False
 
-        # BE queue has no timing constraints. Give it a percentage chance to fire
-        if self.t_type == "BE":
-            if random.random() < BE_FIRE_CHANCE:  # 1% chance to fire every tick (period ~ 100 ticks)
-                return True
-            else:
-                return False
+    # function to get the next (timestamp, event_type) this ES needs to be simulated at, or -1 if there is none
+    def next_event(self):
+        events = [(self.get_next_release(), e_event_types[0])]  # always have a next release
 
-        elif self.t_type == "ST":  # ST queue is based off its period and nothing else
-            if (g_timestamp-self.t_offset) % self.t_period == 0:  # if we are at a multiple of its period (including offset)
-                return True
-            else:
-                return False
+        # packets waiting to be sent can go when the ES is no longer busy
+        if len(self.egress_traffic) != 0:
+            events.append((self.sim.timestamp + max(self.busy, 1), e_event_types[2]))
 
-        # otherwise we need to check the min_inter_release of SH or SS
-        # NOTE : I have commented out the t_delay_jitter parts as im not sure how this variable is used
-        #          if it means the packet has to be sent within X ticks of being able to then this can be uncommented
-        if self.t_previous_fire == 0:  # if first fire ignore initial min release
-            if random.random() < SPORADIC_FIRE_CHANCE:  # the packet has a % chance to fire
-                self.t_previous_fire = g_timestamp
-                return True
-            else:
-                return False
-                # if self.t_delay_jitter == g_timestamp:  # send if we have reached max delay jitter
-                #     self.t_previous_fire = g_timestamp
-                #     return True
-                # else:
-                #     return False
-        elif (g_timestamp - self.t_previous_fire) >= self.t_min_release:  # if time is equal to or greater than the min release
-            # if (self.t_previous_fire + self.t_min_release + self.t_delay_jitter) == g_timestamp:  # send if we have reached max delay jitter
-            #     self.t_previous_fire = g_timestamp
-            #     return True
-            # else:  # re-indent below
-            if random.random() < SPORADIC_FIRE_CHANCE:  # the packet has a % chance to fire
-                self.t_previous_fire = g_timestamp
-                return True
+        # packets being received are digested when the final frame arrives
+        for packet in self.ingress_traffic:
+            if packet.arrival_time == -1:
+                events.append((self.sim.timestamp+1, e_event_types[1]))
             else:
-                return False
-        else:  # within min_inter_release, cant send
-            return False
+                events.append((packet.arrival_time + packet.transmission_ticks - 1, e_event_types[1]))
+
+        return min(events)
 
 
     ## Setters
-    def set_traffic_rules(self, rules):
+    # adds a traffic flow following the given generic traffic rules to this ES
+    def add_traffic_rules(self, rules):
 
         if 0:  # for debugging
             print("Rule properties:")
@@ -354,46 +404,36 @@ class End_Station(Node):
                   "\""+str(self.id)+"\"")
             return 0
 
-        # extract shared attributess
-        self.t_name = rules["name"]
-        self.t_offset = rules["offset"]
-        self.t_type = rules["type"]
-        self.t_dest = rules["destination_id"]
-        self.t_size = rules["size"]
+        # error check the traffic type
+        if rules["type"] not in e_traffic_classes:
+            print("CRITICAL ERROR: Incorrect traffic type assigned to ES ID", "\""+str(self.id)+"\"")
+            return 0
 
         # if destination_id is 0, we need to change it to a random ES ID
-        if int(self.t_dest) == 0:
+        destination = int(rules["destination_id"])
+        if destination == 0:
             es_list = []
 
             # get list of end stations
-            for node in g_node_id_dict:
-                if g_node_id_dict[node].node_type == "End_Station":
+            for node in self.sim.node_id_dict:
+                if self.sim.node_id_dict[node].node_type == "End_Station":
                     es_list.append(node)
 
             es_list.remove(self.id)  # remove this end station
-            self.t_dest = str(random.choice(es_list))  # pick a random node from the list to set as destination
+            destination = self.random.choice(es_list)  # pick a random node from the list to set as destination
 
-        ## Extract per-type attributes
-        if self.t_type == "ST":
-            self.t_period = rules["period"]
-            self.t_deadline = rules["hard_deadline"]
-            self.t_delay_jitter = rules["max_release_jitter"]
-        elif self.t_type == "Sporadic_Hard":
-            self.t_deadline = rules["hard_deadline"]
-            self.t_delay_jitter = rules["max_release_jitter"]
-            self.t_min_release = rules["min_inter_release"]
-            self.t_previous_fire = 0
-        elif self.t_type == "Sporadic_Soft":
-            self.t_deadline = rules["soft_deadline"]
-            self.t_delay_jitter = rules["max_release_jitter"]
-            self.t_min_release = rules["min_inter_release"]
-            self.t_previous_fire = 0
-        elif self.t_type == "BE":
-            pass  # no timing constraints
-        else:
-            print("CRITICAL ERROR: Incorrect traffic type assigned to ES ID", "\""+str(self.id)+"\"")
-            return 0
+        # create the flow and put it in the release heap at its first release
+        flow = Traffic_Flow(self.sim, self.id, len(self.flows), rules, destination)
+        self.flows.append(flow)
+        self.push_release(flow)
+
+        return 1
 
+
+    # removes every traffic flow of this ES, so its traffic can be mapped again from scratch
+    def clear_traffic_rules(self):
+        self.flows = []
+        self.release_heap = []
         return 1
 
 
@@ -406,10 +446,12 @@ class End_Station(Node):
 # switch type of node
 class Switch(Node):
 
-    def __init__(self, id, name="unnamed"):
-        super().__init__(id, name)
+    def __init__(self, sim, id, name="unnamed"):
+        super().__init__(sim, id, name)
         self.local_routing_table = -1  # to be set
-        self.available_packets = []  # dynamic list
+        self.next_hop_table = {}  # compiled from local_routing_table. Key is destination ES ID, value is the ID of the node to send to
+        self.default_hop = -1  # parent switch ID used for any destination not in next_hop_table (controller has none)
+        self.available_packets = []  # dynamic list of Egress_Candidate
 
         # instance variables used for output statistics
         self.packets_transmitted = 0
@@ -425,6 +467,12 @@ class Switch(Node):
         self.BE_queue = []
 
 
+    # function to recieve a packet into the ingress queue and mark this switch as needing to ingress it
+    def RX_packet(self, packet):
+        self.sim.active_switch_ingress.add(self.id)
+        return super().RX_packet(packet)
+
+
     # filters packets in the ingress queue into the relevant Traffic queue within the switch according to the queue_def
     def ingress_packets(self):
 
@@ -434,7 +482,7 @@ class Switch(Node):
 
         # if there is more than 1 packet in the ingress queue shuffle it to avoid End Station bias
         if len(self.ingress_traffic) > 1:
-            random.shuffle(self.ingress_traffic)
+            self.random.shuffle(self.ingress_traffic)
 
         # each packet gets added to the relevant queue within the switch if the entire packet is present
         final_ingress = self.ingress_traffic.copy()  # use a copy of this so we do not alter the live list when removing packets
@@ -442,70 +490,73 @@ class Switch(Node):
 
             # can only move packet from ingress into its respective queue if the entire packet is present
             if packet.queue_enter == -1:  # if it is the packets first tick in the ingress queue
-                if SIM_DEBUG:  # debug
-                    print("[T", str(g_timestamp).zfill(3)+"]", "Found", \
+                if self.sim.SIM_DEBUG:  # debug
+                    print("[T", str(self.sim.timestamp).zfill(3)+"]", "Found", \
                           "start of "+str(packet.__class__.__name__)+" packet \""+str(packet.name)+"\" size \""+str(packet.size)+"\"" \
-                          if math.ceil(int(packet.size) / SENDING_SIZE_CAPCITY) > 1 else \
+                          if packet.transmission_ticks > 1 else \
                           str(packet.__class__.__name__)+" packet \""+str(packet.name)+"\"" \
                           , "from ES", "\""+str(packet.source)+"\"", "in ingress queue of Switch", "\""+str(self.id)+"\"")
 
-                packet.set_queue_enter(g_timestamp)  # add queue enter timestamp
+                packet.set_queue_enter(self.sim.timestamp)  # add queue enter timestamp
 
 
             # then check the packets size compared to how much we can accept per tick
-            if ((g_timestamp - packet.queue_enter) + 1) != math.ceil(int(packet.size) / SENDING_SIZE_CAPCITY):
+            if ((self.sim.timestamp - packet.queue_enter) + 1) != packet.transmission_ticks:
                 continue  # if it hasnt fully arrived we cant move this packet to its inner queue. Try again next tick, move on to other packets
             # else properly ingest the packet into the correct inner queue
 
             # ST packets
-            if packet.__class__.__name__ == "ST":
+            if packet.traffic_class == 0:
 
                 # simulate a small chance the ST packet will go into the emergency queue to pretend it is late
-                if random.random() < EMERGENCY_QUEUE_CHANCE:  # % chance
+                if self.random.random() < self.sim.EMERGENCY_QUEUE_CHANCE:  # % chance
                     if self.queue_definition.acceptance_test(packet):  # if acceptance test True
                         self.q_load_balance(self.EM_queue, packet)  # add to Emergency queue
-                        if SIM_DEBUG:  # debug
-                            print("[T", str(g_timestamp).zfill(3)+"]", "Adding", packet.__class__.__name__, "Packet", "\""+str(packet.name)+"\"", \
+                        packet.emergency = True
+                        if self.sim.SIM_DEBUG:  # debug
+                            print("[T", str(self.sim.timestamp).zfill(3)+"]", "Adding", packet.__class__.__name__, "Packet", "\""+str(packet.name)+"\"", \
                                   "from ES", "\""+str(packet.source)+"\"", "to inner Emergency queue of Switch", "\""+str(self.id)+"\"")
 
                     else:  # failed acceptance test, drop the packet (by not adding it to any queue)
                         print("WARNING: ST packet", "\""+str(packet.name)+"\"", "from ES", "\""+str(packet.source)+"\"", \
                               "in switch", "\""+str(self.id)+"\"", "failed emergency queue acceptance test and has been DROPPED")
+                        if self.sim.USE_PACKET_STORE:
+                            self.sim.packet_store.free(packet)
 
                 else:  # if it hasnt been chosen to go into the emergency queue
                     self.q_load_balance(self.ST_queue, packet)  # add to ST
-                    if SIM_DEBUG:  # debug
-                        print("[T", str(g_timestamp).zfill(3)+"]", "Adding", packet.__class__.__name__, "Packet", "\""+str(packet.name)+"\"", \
+                    if self.sim.SIM_DEBUG:  # debug
+                        print("[T", str(self.sim.timestamp).zfill(3)+"]", "Adding", packet.__class__.__name__, "Packet", "\""+str(packet.name)+"\"", \
                               "from ES", "\""+str(packet.source)+"\"", "to inner ST queue of Switch", "\""+str(self.id)+"\"")
 
                 final_ingress.remove(packet)  # whatever happens always remove packet from the ingress
 
 
             # SH packets
-            elif packet.__class__.__name__ == "Sporadic_Hard":
+            elif packet.traffic_class == 1:
                 self.q_load_balance(self.SH_queue, packet)
                 final_ingress.remove(packet)
 
-                if SIM_DEBUG:  # debug
-                    print("[T", str(g_timestamp).zfill(3)+"]", "Adding", packet.__class__.__name__, "Packet", "\""+str(packet.name)+"\"", \
+                if self.sim.SIM_DEBUG:  # debug
+                    print("[T", str(self.sim.timestamp).zfill(3)+"]", "Adding", packet.__class__.__name__, "Packet", "\""+str(packet.name)+"\"", \
                           "from ES", "\""+str(packet.source)+"\"", "to inner Sporadic_Hard queue of Switch", "\""+str(self.id)+"\"")
 
             # SS packets
-            elif packet.__class__.__name__ == "Sporadic_Soft":
+            elif packet.traffic_class == 2:
                 self.q_load_balance(self.SS_queue, packet)
                 final_ingress.remove(packet)
 
-                if SIM_DEBUG:  # debug
-                    print("[T", str(g_timestamp).zfill(3)+"]", "Adding", packet.__class__.__name__, "Packet", "\""+str(packet.name)+"\"", \
+                if self.sim.SIM_DEBUG:  # debug
+                    print("[T", str(self.sim.timestamp).zfill(3)+"]", "Adding", packet.__class__.__name__, "Packet", "\""+str(packet.name)+"\"", \
                           "from ES", "\""+str(packet.source)+"\"", "to inner Sporadic_Soft queue of Switch", "\""+str(self.id)+"\"")
 
             # BE packets
-            elif packet.__class__.__name__ == "BE":
+            elif packet.traffic_class == 3:
                 self.q_load_balance(self.BE_queue, packet)
                 final_ingress.remove(packet)
 
-                if SIM_DEBUG:  # debug
-                    print("[T", str(g_timestamp).zfill(3)+"]", "Adding", packet.__class__.__name__, "Packet", "\""+str(packet.name)+"\"", \
+                if self.sim.SIM_DEBUG:  # debug
+                    print("[T", str(self.sim.timestamp).zfill(3)+"]", "Adding", packet.__class__.__name__, "Packet", "\""+str(packet.name)+"\"", \
                           "from ES", "\""+str(packet.source)+"\"", "to inner Best_Effort queue of Switch", "\""+str(self.id)+"\"")
 
             # unrecognised packets
@@ -523,6 +574,7 @@ class Switch(Node):
     # NOTE : queue schedule types from e_queue_schedules need to be called in here
     def cycle_queues(self):
         gcl_pos = 0
+        gcl_state = self.queue_definition.compiled_GCL.get_state(self.sim.timestamp)  # gate bitmask of this switch's GCL right now
         self.available_packets = []
 
 
@@ -531,24 +583,24 @@ class Switch(Node):
 
             # first check the GCL to see if the queue is open
             gcl_pos += 1  # for next iteration
-            if g_current_GCL_state[gcl_pos-1] == str(0):  # if gate is shut
+            if not gcl_state & (1 << (gcl_pos-1)):  # if gate is shut
                 continue  # skip this iteration
 
             # FIFO
             if self.queue_definition.ST_schedule == e_queue_schedules[0]:
                 if len(self.ST_queue[i]) != 0:  # if queue isnt empty
-                    self.available_packets.append((i, FIFO_schedule(self.ST_queue[i])))  # add (queue_number, packet) to available packet list
+                    self.available_packets.append(Egress_Candidate(FIFO_schedule(self.ST_queue[i]), self.ST_queue[i], i))
 
             # EDF
             if self.queue_definition.ST_schedule == e_queue_schedules[1]:  # note the 1 here to signify "EDF" if the e_queue_schedules was ["FIFO", "EDF", ...]
                 if len(self.ST_queue[i]) != 0:  # if queue isnt empty
-                    self.available_packets.append((i, EDF_schedule(self.ST_queue[i])))
+                    self.available_packets.append(Egress_Candidate(EDF_schedule(self.ST_queue[i]), self.ST_queue[i], i))
 
             # DEBUG
-            if SIM_DEBUG:
+            if self.sim.SIM_DEBUG:
                 if len(self.ST_queue[i]) != 0:
-                    print("[T", str(g_timestamp).zfill(3)+"]", "["+str(self.queue_definition.ST_schedule)+"]", "Adding ST packet", \
-                          "\""+str(self.available_packets[-1][1].name)+"\"", "from ES", "\""+str(self.available_packets[-1][1].source)+"\"", \
+                    print("[T", str(self.sim.timestamp).zfill(3)+"]", "["+str(self.queue_definition.ST_schedule)+"]", "Adding ST packet", \
+                          "\""+str(self.available_packets[-1].packet.name)+"\"", "from ES", "\""+str(self.available_packets[-1].packet.source)+"\"", \
                           "to \"available_packets\" candidate queue of Switch", "\""+str(self.id)+"\"")
 
 
@@ -557,25 +609,24 @@ class Switch(Node):
 
             # first check the GCL to see if the queue is open
             gcl_pos += 1  # for next iteration
-            if g_current_GCL_state[gcl_pos-1] == str(0):  # if gate is shut
+            if not gcl_state & (1 << (gcl_pos-1)):  # if gate is shut
                 continue  # skip this iteration
 
             # FIFO
             if self.queue_definition.emergency_schedule == e_queue_schedules[0]:
                 if len(self.EM_queue[i]) != 0:  # if queue isnt empty
-                    self.available_packets.append((i, FIFO_schedule(self.EM_queue[i]), 1))  # add (queue_number, packet, EMERGENCY_FLAG) to available packet list
-                    # NOTE : these tuples should be len 3 to show later that the ST traffic is in the Emergency Queue
+                    self.available_packets.append(Egress_Candidate(FIFO_schedule(self.EM_queue[i]), self.EM_queue[i], i, True))
 
             # EDF
             if self.queue_definition.emergency_schedule == e_queue_schedules[1]:
                 if len(self.EM_queue[i]) != 0:  # if queue isnt empty
-                    self.available_packets.append((i, EDF_schedule(self.EM_queue[i]), 1))  # add queue number, and packet to available packet list
+                    self.available_packets.append(Egress_Candidate(EDF_schedule(self.EM_queue[i]), self.EM_queue[i], i, True))
 
             # DEBUG
-            if SIM_DEBUG:
+            if self.sim.SIM_DEBUG:
                 if len(self.EM_queue[i]) != 0:
-                    print("[T", str(g_timestamp).zfill(3)+"]", "["+str(self.queue_definition.emergency_schedule)+"]", "Adding Emergency packet", \
-                          "\""+str(self.available_packets[-1][1].name)+"\"", "from ES", "\""+str(self.available_packets[-1][1].source)+"\"", \
+                    print("[T", str(self.sim.timestamp).zfill(3)+"]", "["+str(self.queue_definition.emergency_schedule)+"]", "Adding Emergency packet", \
+                          "\""+str(self.available_packets[-1].packet.name)+"\"", "from ES", "\""+str(self.available_packets[-1].packet.source)+"\"", \
                           "to \"available_packets\" candidate queue of Switch", "\""+str(self.id)+"\"")
 
         # SH queues
@@ -583,24 +634,24 @@ class Switch(Node):
 
             # first check the GCL to see if the queue is open
             gcl_pos += 1  # for next iteration
-            if g_current_GCL_state[gcl_pos-1] == str(0):  # if gate is shut
+            if not gcl_state & (1 << (gcl_pos-1)):  # if gate is shut
                 continue  # skip this iteration
 
             # FIFO
             if self.queue_definition.sporadic_hard_schedule == e_queue_schedules[0]:
                 if len(self.SH_queue[i]) != 0:  # if queue isnt empty
-                    self.available_packets.append((i, FIFO_schedule(self.SH_queue[i])))  # add (queue_number, packet) to available packet list
+                    self.available_packets.append(Egress_Candidate(FIFO_schedule(self.SH_queue[i]), self.SH_queue[i], i))
 
             # EDF
             if self.queue_definition.sporadic_hard_schedule == e_queue_schedules[1]:
                 if len(self.SH_queue[i]) != 0:  # if queue isnt empty
-                    self.available_packets.append((i, EDF_schedule(self.SH_queue[i])))  # add queue number, and packet to available packet list
+                    self.available_packets.append(Egress_Candidate(EDF_schedule(self.SH_queue[i]), self.SH_queue[i], i))
 
             # DEBUG
-            if SIM_DEBUG:
+            if self.sim.SIM_DEBUG:
                 if len(self.SH_queue[i]) != 0:
-                    print("[T", str(g_timestamp).zfill(3)+"]", "["+str(self.queue_definition.sporadic_hard_schedule)+"]", "Adding Sporadic_Hard packet", \
-                          "\""+str(self.available_packets[-1][1].name)+"\"", "from ES", "\""+str(self.available_packets[-1][1].source)+"\"", \
+                    print("[T", str(self.sim.timestamp).zfill(3)+"]", "["+str(self.queue_definition.sporadic_hard_schedule)+"]", "Adding Sporadic_Hard packet", \
+                          "\""+str(self.available_packets[-1].packet.name)+"\"", "from ES", "\""+str(self.available_packets[-1].packet.source)+"\"", \
                           "to \"available_packets\" candidate queue of Switch", "\""+str(self.id)+"\"")
 
 
@@ -609,24 +660,24 @@ class Switch(Node):
 
             # first check the GCL to see if the queue is open
             gcl_pos += 1  # for next iteration
-            if g_current_GCL_state[gcl_pos-1] == str(0):  # if gate is shut
+            if not gcl_state & (1 << (gcl_pos-1)):  # if gate is shut
                 continue  # skip this iteration
 
             # FIFO
             if self.queue_definition.sporadic_soft_schedule == e_queue_schedules[0]:
                 if len(self.SS_queue[i]) != 0:  # if queue isnt empty
-                    self.available_packets.append((i, FIFO_schedule(self.SS_queue[i])))  # add (queue_number, packet) to available packet list
+                    self.available_packets.append(Egress_Candidate(FIFO_schedule(self.SS_queue[i]), self.SS_queue[i], i))
 
             # EDF
             if self.queue_definition.sporadic_soft_schedule == e_queue_schedules[1]:
                 if len(self.SS_queue[i]) != 0:  # if queue isnt empty
-                    self.available_packets.append((i, EDF_schedule(self.SS_queue[i])))  # add queue number, and packet to available packet list
+                    self.available_packets.append(Egress_Candidate(EDF_schedule(self.SS_queue[i]), self.SS_queue[i], i))
 
             # DEBUG
-            if SIM_DEBUG:
+            if self.sim.SIM_DEBUG:
                 if len(self.SS_queue[i]) != 0:
-                    print("[T", str(g_timestamp).zfill(3)+"]", "["+str(self.queue_definition.sporadic_soft_schedule)+"]", "Adding Sporadic_Soft packet", \
-                          "\""+str(self.available_packets[-1][1].name)+"\"", "from ES", "\""+str(self.available_packets[-1][1].source)+"\"", \
+                    print("[T", str(self.sim.timestamp).zfill(3)+"]", "["+str(self.queue_definition.sporadic_soft_schedule)+"]", "Adding Sporadic_Soft packet", \
+                          "\""+str(self.available_packets[-1].packet.name)+"\"", "from ES", "\""+str(self.available_packets[-1].packet.source)+"\"", \
                           "to \"available_packets\" candidate queue of Switch", "\""+str(self.id)+"\"")
 
 
@@ -635,24 +686,24 @@ class Switch(Node):
 
             # first check the GCL to see if the queue is open
             gcl_pos += 1  # for next iteration
-            if g_current_GCL_state[gcl_pos-1] == str(0):  # if gate is shut
+            if not gcl_state & (1 << (gcl_pos-1)):  # if gate is shut
                 continue  # skip this iteration
 
             # FIFO
             if self.queue_definition.BE_schedule == e_queue_schedules[0]:
                 if len(self.BE_queue[i]) != 0:  # if queue isnt empty
-                    self.available_packets.append((i, FIFO_schedule(self.BE_queue[i])))  # add (queue_number, packet) to available packet list
+                    self.available_packets.append(Egress_Candidate(FIFO_schedule(self.BE_queue[i]), self.BE_queue[i], i))
 
             # EDF
             if self.queue_definition.BE_schedule == e_queue_schedules[1]:
                 if len(self.BE_queue[i]) != 0:  # if queue isnt empty
-                    self.available_packets.append((i, EDF_schedule(self.BE_queue[i])))  # add queue number, and packet to available packet list
+                    self.available_packets.append(Egress_Candidate(EDF_schedule(self.BE_queue[i]), self.BE_queue[i], i))
 
             # DEBUG
-            if SIM_DEBUG:  # for debug
+            if self.sim.SIM_DEBUG:  # for debug
                 if len(self.BE_queue[i]) != 0:
-                    print("[T", str(g_timestamp).zfill(3)+"]", "["+str(self.queue_definition.BE_schedule)+"]", "Adding Best_Effort packet", \
-                          "\""+str(self.available_packets[-1][1].name)+"\"", "from ES", "\""+str(self.available_packets[-1][1].source)+"\"", \
+                    print("[T", str(self.sim.timestamp).zfill(3)+"]", "["+str(self.queue_definition.BE_schedule)+"]", "Adding Best_Effort packet", \
+                          "\""+str(self.available_packets[-1].packet.name)+"\"", "from ES", "\""+str(self.available_packets[-1].packet.source)+"\"", \
                           "to \"available_packets\" candidate queue of Switch", "\""+str(self.id)+"\"")
 
         return 1
@@ -676,28 +727,15 @@ class Switch(Node):
 
         # find highest priority packet out of all packets available to be sent
         packet_to_send = self.available_packets[0]  # start from FIRST in queue to mimic priority ordering
-        for packet in self.available_packets:
-            if packet[1].priority < packet_to_send[1].priority:
-                packet_to_send = packet
+        for candidate in self.available_packets:
+            if candidate.packet.priority < packet_to_send.packet.priority:
+                packet_to_send = candidate
 
         # send it
-        self.forward(packet_to_send[1])
-
-        # remove it from its original queue
-        queue_type = packet_to_send[1].__class__.__name__
-        queue_number = packet_to_send[0]
-        if queue_type == "ST":
-            # ST traffic could be in emergency queue, check to see which queue the packet it is
-            if len(packet_to_send) == 3:  # an Emergency queue
-                self.EM_queue[queue_number].remove(packet_to_send[1])
-            else:  # an ST queue
-                self.ST_queue[queue_number].remove(packet_to_send[1])
-        elif queue_type == "Sporadic_Hard":
-            self.SH_queue[queue_number].remove(packet_to_send[1])
-        elif queue_type == "Sporadic_Soft":
-            self.SS_queue[queue_number].remove(packet_to_send[1])
-        elif queue_type == "BE":
-            self.BE_queue[queue_number].remove(packet_to_send[1])
+        self.forward(packet_to_send.packet)
+
+        # remove it from the front of its original queue
+        packet_to_send.queue.popleft()
 
         return 1
 
@@ -705,7 +743,7 @@ class Switch(Node):
     # sends the traffic to destination from route in routing table
     # NOTE : This may need to be translated into sending multiple frames looped so it can be preempted
     def forward(self, packet):
-        packet.set_queue_leave(g_timestamp)  # set the queue_leave time for this packet
+        packet.set_queue_leave(self.sim.timestamp)  # set the queue_leave time for this packet
         self.packets_transmitted += 1
         self.recalculate_packet_delay(packet)
 
@@ -713,33 +751,35 @@ class Switch(Node):
             print("ERROR: Switch", "\""+str(self.id)+"\"", "is busy and cannot send new packets")
             return 0
 
-        # get hop from routing table
-        hop = -1
-        for route in self.local_routing_table:
-            if int(route[0]) == int(packet.destination):
-                hop = route[1]
-                break  # found
+        # get the next node from the compiled routing table. Either the destination ES, the next switch down, or the parent switch
+        next_node_id = self.next_hop_table.get(packet.destination, self.default_hop)
+        if next_node_id == -1:
+            print("ERROR: Switch", "\""+str(self.id)+"\"", "has no route to destination ES", "\""+str(packet.destination)+"\"")
+            return 0
 
-        if SIM_DEBUG:  # debug
-            print("[T", str(g_timestamp).zfill(3)+"]", "Sending", str(packet.__class__.__name__), \
+        if self.sim.SIM_DEBUG:  # debug
+            print("[T", str(self.sim.timestamp).zfill(3)+"]", "Sending", str(packet.__class__.__name__), \
                   "packet", "\""+str(packet.name)+"\"", "from ES", "\""+str(packet.source)+"\"", \
                   "in egress queue of Switch", "\""+str(self.id)+"\"", \
-                  "to node ID", "\""+str(packet.destination)+"\"" if int(hop) == int(self.id) else "\""+str(hop)+"\"")
+                  "to node ID", "\""+str(next_node_id)+"\"")
 
-        # if hop is this switch we can send packet directly to the ES else we send to next switch
         packet.queue_enter = -1  # reset this in case we are moveing to another switch
-        g_node_id_dict[int(packet.destination) if int(hop) == int(self.id) else int(hop)].RX_packet(packet)
+        self.sim.node_id_dict[next_node_id].RX_packet(packet)
 
         # set this switch to be busy depending on the size of the packet to send, busy ticks decrese in egress_packets
-        self.busy = math.ceil(int(packet.size) / SENDING_SIZE_CAPCITY)
+        self.busy = packet.transmission_ticks
 
         return 1
 
 
     # function that recalculates queueing delay for this switch
     def recalculate_packet_delay(self, packet):
-        queue_delay = int(int(packet.queue_leave)-int(packet.queue_enter))  # get the time it has been in the queue
-        g_queueing_delays.append(queue_delay)  # add to global array
+        queue_delay = packet.queue_leave - packet.queue_enter  # get the time it has been in the queue
+        self.sim.queueing_stats.add(queue_delay)  # add to global statistics
+        packet.queueing_delay += queue_delay
+        packet.hops += 1
+        if self.sim.KEEP_RAW_DELAYS:
+            self.sim.queueing_delays.append(queue_delay)
 
         # change local variables
         self.total_queue_delay += queue_delay  # cumulative
@@ -748,6 +788,53 @@ class Switch(Node):
         return 1
 
 
+    # function to get the next (timestamp, event_type) this switch needs to be simulated at, or -1 if there is none
+    def next_event(self):
+        events = []
+
+        # ingress queue. More than 1 packet gets shuffled every tick so it must be simulated every tick
+        if len(self.ingress_traffic) > 1:
+            events.append((self.sim.timestamp+1, e_event_types[1]))
+        elif len(self.ingress_traffic) == 1:
+            packet = self.ingress_traffic[0]
+            if packet.queue_enter == -1:  # not seen yet
+                events.append((self.sim.timestamp+1, e_event_types[1]))
+            else:  # moved to an inner queue when the final frame arrives
+                events.append((packet.queue_enter + packet.transmission_ticks - 1, e_event_types[1]))
+
+        # inner queues. Can send when no longer busy as long as the gate to a queue with a packet in it is open
+        if self.has_queued_packets():
+            free_timestamp = self.sim.timestamp + max(self.busy, 1)
+            if self.has_open_queue(self.queue_definition.compiled_GCL.get_state(free_timestamp)):
+                events.append((free_timestamp, e_event_types[2]))
+            else:  # check again when the gates change
+                events.append((self.queue_definition.compiled_GCL.get_next_change(free_timestamp), e_event_types[3]))
+
+        if len(events) == 0:
+            return -1
+        return min(events)
+
+
+    # function to check if any inner queue has a packet in it
+    def has_queued_packets(self):
+        for queue_list in (self.ST_queue, self.EM_queue, self.SH_queue, self.SS_queue, self.BE_queue):
+            for queue in queue_list:
+                if len(queue) != 0:
+                    return True
+        return False
+
+
+    # function to check if any inner queue with a packet in it has its gate open in the given GCL bitmask
+    def has_open_queue(self, gcl_state):
+        gcl_pos = 0  # gates are in the same order as cycle_queues() goes through the queues
+        for queue_list in (self.ST_queue, self.EM_queue, self.SH_queue, self.SS_queue, self.BE_queue):
+            for queue in queue_list:
+                if( (len(queue) != 0) and (gcl_state & (1 << gcl_pos)) ):
+                    return True
+                gcl_pos += 1
+        return False
+
+
     ## Inner queue selection functions
     # These functions must be given a list of queues, and a packet,
     #   and they must only put the packet in ONE of the queues and not do anything else
@@ -775,18 +862,27 @@ class Switch(Node):
     def set_queue_def(self, queue_def):
         self.queue_definition = queue_def
 
-        # put empty lists in each queue type to signify how many queues each queue type has
-        [self.ST_queue.append([]) for i in range(self.queue_definition.ST_count)]
-        [self.EM_queue.append([]) for i in range(self.queue_definition.emergency_count)]
-        [self.SH_queue.append([]) for i in range(self.queue_definition.sporadic_hard_count)]
-        [self.SS_queue.append([]) for i in range(self.queue_definition.sporadic_soft_count)]
-        [self.BE_queue.append([]) for i in range(self.queue_definition.BE_count)]
+        # put empty queues in each queue type to signify how many queues each queue type has
+        [self.ST_queue.append(create_queue(self.queue_definition.ST_schedule)) for i in range(self.queue_definition.ST_count)]
+        [self.EM_queue.append(create_queue(self.queue_definition.emergency_schedule)) for i in range(self.queue_definition.emergency_count)]
+        [self.SH_queue.append(create_queue(self.queue_definition.sporadic_hard_schedule)) \
+         for i in range(self.queue_definition.sporadic_hard_count)]
+        [self.SS_queue.append(create_queue(self.queue_definition.sporadic_soft_schedule)) \
+         for i in range(self.queue_definition.sporadic_soft_count)]
+        [self.BE_queue.append(create_queue(self.queue_definition.BE_schedule)) for i in range(self.queue_definition.BE_count)]
 
         return 1
 
 
-    def set_local_routing_table(self, routing_table_def):
+    def set_local_routing_table(self, routing_table_def, default_hop=-1):
         self.local_routing_table = routing_table_def
+        self.default_hop = default_hop
+
+        # compile the (es_id, hop) routes into a direct lookup. If the hop is this switch the ES is a child so send straight to it
+        self.next_hop_table = {}
+        for route in self.local_routing_table:
+            self.next_hop_table[int(route[0])] = int(route[0]) if int(route[1]) == self.id else int(route[1])
+
         return 1
 
 
@@ -794,8 +890,8 @@ class Switch(Node):
 # controller type of switch
 class Controller(Switch):
 
-    def __init__(self, id, name="unnamed"):
-        super().__init__(id, name)
+    def __init__(self, sim, id, name="unnamed"):
+        super().__init__(sim, id, name)
         self.routing_table = -1  # the entire routing table is stored in this object as a dict
 
 
@@ -817,36 +913,55 @@ class Controller(Switch):
 ##################################################
 
 # base class traffic (abstraction of packets)
+# packets use __slots__ as there can be a very large number of them in flight at once
 class Traffic():
+    __slots__ = ("source", "destination")
 
     def __init__(self, source, destination):
         self.source = source
-        self.destination = destination
+        self.destination = int(destination)  # always an ES ID so the routing tables can look it up directly
 
 
     ## Setters
     def set_dest(self, dest):
-        self.destination = dest
+        self.destination = int(dest)
         return 1
 
 
 
 # define packets that belong to the traffic class (frame -> packet -> traffic)
+# size, transmission ticks and deadline are fixed integers when the packet is created so the hot paths dont recompute them
+# the simulation a packet is created in sets its transmission time and ticks, packets dont keep a reference to it
 class Packet(Traffic):
+    __slots__ = ("priority", "name", "offset", "size", "transmission_ticks", "deadline", \
+                 "transmission_time", "arrival_time", "queue_enter", "queue_leave", "flow", "emergency", \
+                 "queueing_delay", "hops")
+    traffic_class = -1  # position of the packet type in e_traffic_classes. Set by each packet type
 
-    def __init__(self, source, destination, priority, size, name="unnamed", offset="0"):
+    def __init__(self, sim, source, destination, priority, size, name="unnamed", offset="0", deadline=-1):
         super().__init__(source, destination)
         self.priority = priority
         self.name = name
         self.offset = offset
-        self.size = size
-        self.type = self.__class__.__name__
+        self.size = int(size)
+        self.transmission_ticks = math.ceil(self.size / sim.SENDING_SIZE_CAPCITY)  # how many ticks it takes to send this packet
+        self.deadline = int(deadline)  # relative deadline in whole ticks. -1 if the packet has no deadline
 
         # instance variables
-        self.transmission_time = g_timestamp  # set to now as soon as object is initialised it is transmitted
+        self.transmission_time = sim.timestamp  # set to now as soon as object is initialised it is transmitted
         self.arrival_time = -1
         self.queue_enter = -1
         self.queue_leave = -1
+        self.flow = 0  # position of the flow that generated it in the source ES
+        self.emergency = False  # True once it has been through an Emergency queue
+        self.queueing_delay = 0  # total ticks spent in switch queues so far
+        self.hops = 0  # number of switches it has been sent from so far
+
+
+    # name of the packet type. Only used for output, compare traffic_class instead
+    @property
+    def type(self):
+        return e_traffic_classes[self.traffic_class]
 
 
     ## Setters
@@ -868,13 +983,19 @@ class Packet(Traffic):
 
 # ST traffic type
 class ST(Packet):
+    __slots__ = ("delay_jitter_constraints", "period")
+    traffic_class = 0
 
-    def __init__(self, source, destination, delay_jitter_constraints, period, deadline, size, \
+    def __init__(self, sim, source, destination, delay_jitter_constraints, period, deadline, size, \
                  name="unnamed", offset="0"):
-        super().__init__(source, destination, 1, size, name, offset)  # priority 1
+        super().__init__(sim, source, destination, 1, size, name, offset, deadline)  # priority 1
         self.delay_jitter_constraints = int(delay_jitter_constraints)
         self.period = int(period)
-        self.hard_deadline = int(deadline)
+
+
+    @property
+    def hard_deadline(self):
+        return self.deadline
 
 
     def to_string(self):
@@ -893,10 +1014,11 @@ class ST(Packet):
 
 # non-st traffic type. Abstraction. No traffic should directly be NonST
 class NonST(Packet):
+    __slots__ = ("minimal_inter_release_time", "delay_jitter_constraints")
 
-    def __init__(self, source, destination, priority, minimal_inter_release_time, delay_jitter_constraints, \
-                 size, name="unnamed", offset="0"):
-        super().__init__(source, destination, priority, size, name, offset)
+    def __init__(self, sim, source, destination, priority, minimal_inter_release_time, delay_jitter_constraints, \
+                 size, name="unnamed", offset="0", deadline=-1):
+        super().__init__(sim, source, destination, priority, size, name, offset, deadline)
         self.minimal_inter_release_time = minimal_inter_release_time
         self.delay_jitter_constraints = delay_jitter_constraints
 
@@ -904,29 +1026,380 @@ class NonST(Packet):
 
 # sporadic hard type of nonST traffic
 class Sporadic_Hard(NonST):
+    __slots__ = ()
+    traffic_class = 1
 
-    def __init__(self, source, destination, minimal_inter_release_time, delay_jitter_constraints, \
+    def __init__(self, sim, source, destination, minimal_inter_release_time, delay_jitter_constraints, \
                  deadline, size, name="unnamed", offset="0"):
-        super().__init__(source, destination, 2, minimal_inter_release_time, delay_jitter_constraints, size, name, offset)  # priority 2
-        self.hard_deadline = deadline
+        super().__init__(sim, source, destination, 2, minimal_inter_release_time, delay_jitter_constraints, size, name, offset, \
+                         deadline)  # priority 2
+
+
+    @property
+    def hard_deadline(self):
+        return self.deadline
 
 
 
 # sporadic soft type of nonST traffic
 class Sporadic_Soft(NonST):
+    __slots__ = ()
+    traffic_class = 2
 
-    def __init__(self, source, destination, minimal_inter_release_time, delay_jitter_constraints, \
+    def __init__(self, sim, source, destination, minimal_inter_release_time, delay_jitter_constraints, \
                  deadline, size, name="unnamed", offset="0"):
-        super().__init__(source, destination, 3, minimal_inter_release_time, delay_jitter_constraints, size, name, offset)  # priority 3
-        self.soft_deadline = deadline
+        super().__init__(sim, source, destination, 3, minimal_inter_release_time, delay_jitter_constraints, size, name, offset, \
+                         deadline)  # priority 3
+
+
+    @property
+    def soft_deadline(self):
+        return self.deadline
 
 
 
 # best effort type of nonST traffic
 class BE(NonST):
+    __slots__ = ()
+    traffic_class = 3
+
+    def __init__(self, sim, source, destination, size, name="unnamed", offset="0"):
+        super().__init__(sim, source, destination, 4, 0, 0, size, name, offset)  # priority 4, no timing constraints
+
+
+
+# a single stream of traffic from an ES, following one of the generic traffic rules. An ES can source many flows
+# decides when its packets are generated and creates them
+class Traffic_Flow():
+
+    def __init__(self, sim, source, index, rules, destination):
+        self.sim = sim  # Simulation the flow belongs to
+        self.source = source  # ES ID
+        self.index = index  # position in the flows of the source ES
+        self.random = sim.node_id_dict[source].random  # flows draw from the random stream of their source ES
+        self.traffic_id = rules["unique_id"]  # ID of the traffic definition this flow follows
+
+        # extract shared attributess
+        self.t_name = rules["name"]
+        self.t_offset = rules["offset"]
+        self.t_type = rules["type"]
+        self.t_dest = int(destination)
+        self.t_size = rules["size"]
+
+        ## Extract per-type attributes
+        if self.t_type == "ST":
+            self.t_period = rules["period"]
+            self.t_deadline = rules["hard_deadline"]
+            self.t_delay_jitter = rules["max_release_jitter"]
+        elif self.t_type == "Sporadic_Hard":
+            self.t_deadline = rules["hard_deadline"]
+            self.t_delay_jitter = rules["max_release_jitter"]
+            self.t_min_release = rules["min_inter_release"]
+            self.t_previous_fire = 0
+        elif self.t_type == "Sporadic_Soft":
+            self.t_deadline = rules["soft_deadline"]
+            self.t_delay_jitter = rules["max_release_jitter"]
+            self.t_min_release = rules["min_inter_release"]
+            self.t_previous_fire = 0
+        # BE has no timing constraints
+
+        # BE and sporadic traffic sample their first fire now
+        if self.sim.GEOMETRIC_RELEASES and self.t_type != "ST":
+            self.sample_next_fire(self.sim.timestamp)
+
+
+    # function to create a new packet of this flow
+    def create_packet(self):
 
-    def __init__(self, source, destination, size, name="unnamed", offset="0"):
-        super().__init__(source, destination, 4, 0, 0, size, name, offset)  # priority 4, no timing constraints
+        # the packet store keeps new packets as a row of its arrays instead of creating a packet object
+        if self.sim.USE_PACKET_STORE:
+            deadline = self.t_deadline if self.t_type != "BE" else -1  # BE has no deadline
+            return self.sim.packet_store.allocate(e_traffic_classes.index(self.t_type), self.source, self.t_dest, self.t_size, \
+                                           deadline, self.index)
+
+        # determine type as each has its own packet class
+        if self.t_type == "ST":
+            packet = ST(self.sim, self.source, self.t_dest, self.t_delay_jitter, self.t_period, self.t_deadline, \
+                        self.t_size, self.t_name, self.t_offset)
+        elif self.t_type == "Sporadic_Hard":
+            packet = Sporadic_Hard(self.sim, self.source, self.t_dest, self.t_min_release, self.t_delay_jitter, \
+                                   self.t_deadline, self.t_size, self.t_name, self.t_offset)
+        elif self.t_type == "Sporadic_Soft":
+            packet = Sporadic_Soft(self.sim, self.source, self.t_dest, self.t_min_release, self.t_delay_jitter, \
+                                   self.t_deadline, self.t_size, self.t_name, self.t_offset)
+        else:  # BE
+            packet = BE(self.sim, self.source, self.t_dest, self.t_size, self.t_name, self.t_offset)
+
+        packet.flow = self.index
+        return packet
+
+
+    # function to check if this is ST traffic with integer offset and period, so its releases can be calculated directly
+    def is_periodic(self):
+        return( (self.t_type == "ST") and (self.t_offset == int(self.t_offset)) and (self.t_period == int(self.t_period)) )
+
+
+    # function to be used within the packet generator that chooses when to generate a packet depending on type (simulate sporadicness)
+    def generate(self):
+
+        # if there is an offset, dont do anything for first N ticks
+        if self.t_offset != 0:
+            if self.sim.timestamp < self.t_offset:
+                return False
+
+        # BE and sporadic traffic fire at their sampled tick, then sample when they fire next
+        if self.sim.GEOMETRIC_RELEASES and self.t_type != "ST":
+            if self.sim.timestamp != self.t_next_fire:
+                return False
+            if self.t_type != "BE":
+                self.t_previous_fire = self.sim.timestamp
+            self.sample_next_fire(self.sim.timestamp+1)
+            return True
+
+        # BE queue has no timing constraints. Give it a percentage chance to fire
+        if self.t_type == "BE":
+            if self.random.random() < self.sim.BE_FIRE_CHANCE:  # 1% chance to fire every tick (period ~ 100 ticks)
+                return True
+            else:
+                return False
+
+        elif self.t_type == "ST":  # ST queue is based off its period and nothing else
+            if (self.sim.timestamp-self.t_offset) % self.t_period == 0:  # if we are at a multiple of its period (including offset)
+                return True
+            else:
+                return False
+
+        # otherwise we need to check the min_inter_release of SH or SS
+        # NOTE : I have commented out the t_delay_jitter parts as im not sure how this variable is used
+        #          if it means the packet has to be sent within X ticks of being able to then this can be uncommented
+        if self.t_previous_fire == 0:  # if first fire ignore initial min release
+            if self.random.random() < self.sim.SPORADIC_FIRE_CHANCE:  # the packet has a % chance to fire
+                self.t_previous_fire = self.sim.timestamp
+                return True
+            else:
+                return False
+                # if self.t_delay_jitter == self.sim.timestamp:  # send if we have reached max delay jitter
+                #     self.t_previous_fire = self.sim.timestamp
+                #     return True
+                # else:
+                #     return False
+        elif (self.sim.timestamp - self.t_previous_fire) >= self.t_min_release:  # if time is equal to or greater than the min release
+            # if (self.t_previous_fire + self.t_min_release + self.t_delay_jitter) == self.sim.timestamp:  # send if we have reached max delay jitter
+            #     self.t_previous_fire = self.sim.timestamp
+            #     return True
+            # else:  # re-indent below
+            if self.random.random() < self.sim.SPORADIC_FIRE_CHANCE:  # the packet has a % chance to fire
+                self.t_previous_fire = self.sim.timestamp
+                return True
+            else:
+                return False
+        else:  # within min_inter_release, cant send
+            return False
+
+
+    # function to get the first timestamp (from the given timestamp onwards) where generate() has to be called
+    # NOTE : without GEOMETRIC_RELEASES, BE and sporadic traffic roll a random number every tick they are allowed to fire
+    #          so they are due every tick
+    def get_next_release(self, timestamp):
+
+        # BE and sporadic traffic already know when they fire next
+        if self.sim.GEOMETRIC_RELEASES and self.t_type != "ST":
+            return self.t_next_fire
+
+        return self.get_first_allowed_tick(timestamp)
+
+
+    # function to get the first timestamp (from the given timestamp onwards) where the traffic rules allow a fire
+    def get_first_allowed_tick(self, timestamp):
+
+        # nothing can happen before the offset
+        if self.t_offset != 0:
+            if timestamp < self.t_offset:
+                timestamp = math.ceil(self.t_offset)
+
+        # ST only fires on multiples of its period (including offset)
+        if self.t_type == "ST":
+            if not self.is_periodic():
+                return timestamp  # cant jump to a non-integer release so check every tick like the TICK engine would
+            periods_passed = math.ceil((timestamp - self.t_offset) / self.t_period)
+            return int(self.t_offset + (periods_passed * self.t_period))
+
+        # SH and SS cant fire within min_inter_release of the previous fire
+        elif( (self.t_type == "Sporadic_Hard") or (self.t_type == "Sporadic_Soft") ):
+            if self.t_previous_fire != 0:  # first fire ignores the initial min release
+                return max(timestamp, math.ceil(self.t_previous_fire + self.t_min_release))
+
+        # BE (and sporadic traffic that is able to fire) can fire on any tick
+        return timestamp
+
+
+    # function to sample the tick BE or sporadic traffic fires next, from the given timestamp onwards
+    # rolling a fire chance every tick it is allowed to fire is a Bernoulli trial per tick, so the number of ticks until
+    # it fires is geometric and can be sampled with 1 random number per packet. Sets t_next_fire, math.inf if it never fires
+    def sample_next_fire(self, timestamp):
+        if self.t_type == "BE":
+            fire_chance = self.sim.BE_FIRE_CHANCE
+        else:
+            fire_chance = self.sim.SPORADIC_FIRE_CHANCE
+
+        if fire_chance <= 0:  # never fires
+            self.t_next_fire = math.inf
+        elif fire_chance >= 1:  # fires on the first tick it is allowed to
+            self.t_next_fire = self.get_first_allowed_tick(timestamp)
+        else:  # number of failed rolls before the one that fires
+            failed_rolls = int(math.log(1.0 - self.random.random()) / math.log(1.0 - fire_chance))
+            self.t_next_fire = self.get_first_allowed_tick(timestamp) + failed_rolls
+
+        return 1
+
+
+
+# makes a property that reads and writes one column of the packet store for the row a Stored_Packet points to
+def packet_store_column(column):
+    def get_value(packet):
+        return getattr(g_current.simulation.packet_store, column)[packet]
+
+    def set_value(packet, value):
+        getattr(g_current.simulation.packet_store, column)[packet] = value
+
+    return property(get_value, set_value)
+
+
+
+# packet that lives in a row of the packet store of a simulation (used when USE_PACKET_STORE is set)
+# it is the integer row handle itself so queues hold integers, all of its fields are read from the store columns of the
+#  simulation running on the current thread
+class Stored_Packet(int):
+    __slots__ = ()
+
+    source = packet_store_column("source")
+    destination = packet_store_column("destination")
+    traffic_class = packet_store_column("traffic_class")
+    size = packet_store_column("size")
+    transmission_ticks = packet_store_column("transmission_ticks")
+    deadline = packet_store_column("deadline")
+    transmission_time = packet_store_column("transmission_time")
+    arrival_time = packet_store_column("arrival_time")
+    queue_enter = packet_store_column("queue_enter")
+    queue_leave = packet_store_column("queue_leave")
+    flow = packet_store_column("flow")
+    emergency = packet_store_column("emergency")
+    queueing_delay = packet_store_column("queueing_delay")
+    hops = packet_store_column("hops")
+
+
+    # fields shared by every packet of a flow are taken from its flow in the source ES instead of being stored per packet
+    @property
+    def priority(self):
+        return self.traffic_class + 1  # ST 1, SH 2, SS 3, BE 4
+
+
+    @property
+    def name(self):
+        return g_current.simulation.node_id_dict[self.source].flows[self.flow].t_name
+
+
+    @property
+    def offset(self):
+        return g_current.simulation.node_id_dict[self.source].flows[self.flow].t_offset
+
+
+    @property
+    def type(self):
+        return e_traffic_classes[self.traffic_class]
+
+
+    @property
+    def hard_deadline(self):
+        return self.deadline
+
+
+    @property
+    def soft_deadline(self):
+        return self.deadline
+
+
+    ## Setters
+    def set_dest(self, dest):
+        self.destination = int(dest)
+        return 1
+
+
+    def set_arrival_time(self, timestamp):
+        self.arrival_time = timestamp
+        return 1
+
+
+    def set_queue_enter(self, timestamp):
+        self.queue_enter = timestamp
+        return 1
+
+
+    def set_queue_leave(self, timestamp):
+        self.queue_leave = timestamp
+        return 1
+
+
+
+# struct-of-arrays store for every packet in flight. Each packet is a row across preallocated integer columns
+# rows of digested or dropped packets go back on a free list to be reused, and the columns double in size when it is full
+class Packet_Store():
+
+    columns = ("source", "destination", "traffic_class", "size", "transmission_ticks", "deadline", \
+               "transmission_time", "arrival_time", "queue_enter", "queue_leave", "flow", "emergency", \
+               "queueing_delay", "hops")
+
+    def __init__(self, sim, capacity):
+        self.sim = sim  # Simulation the packets belong to
+        self.capacity = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.free_rows = array("q")  # used as a stack, lowest free row is at the end so it is reused first
+        for column in self.columns:
+            setattr(self, column, array("q"))
+        self.grow(max(int(capacity), 1))
+
+
+    # adds rows to every column and puts them on the free list
+    def grow(self, rows):
+        for column in self.columns:
+            getattr(self, column).extend(array("q", [-1]) * rows)
+        self.free_rows.extend(range(self.capacity+rows-1, self.capacity-1, -1))
+        self.capacity += rows
+        return 1
+
+
+    # takes a free row for a new packet transmitted now and returns its handle
+    def allocate(self, traffic_class, source, destination, size, deadline=-1, flow=0):
+        if len(self.free_rows) == 0:
+            self.grow(self.capacity)
+
+        row = self.free_rows.pop()
+        self.source[row] = source
+        self.destination[row] = int(destination)
+        self.traffic_class[row] = traffic_class
+        self.size[row] = int(size)
+        self.transmission_ticks[row] = math.ceil(int(size) / self.sim.SENDING_SIZE_CAPCITY)
+        self.deadline[row] = int(deadline)
+        self.transmission_time[row] = self.sim.timestamp
+        self.arrival_time[row] = -1
+        self.queue_enter[row] = -1
+        self.queue_leave[row] = -1
+        self.flow[row] = flow  # position of the flow in the source ES
+        self.emergency[row] = 0  # set once it has been through an Emergency queue
+        self.queueing_delay[row] = 0
+        self.hops[row] = 0
+
+        self.in_use += 1
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+        return Stored_Packet(row)
+
+
+    # returns the row of a packet that has left the network so it can be reused
+    def free(self, packet):
+        self.free_rows.append(packet)
+        self.in_use -= 1
+        return 1
 
 
 
@@ -936,13 +1409,13 @@ class BE(NonST):
 ##################################################
 
 # queue class (should be present in each switch)
-# TODO : GCL in here is useless I think - best being global only
+# holds the GCL of its switch, which is the global GCL unless the switch has its own
 class Queue():
 
-    def __init__(self, ST_count, emergency_count, sporadic_hard_count, sporadic_soft_count, BE_count, \
+    def __init__(self, sim, ST_count, emergency_count, sporadic_hard_count, sporadic_soft_count, BE_count, \
                  ST_schedule=e_queue_schedules[0], emergency_schedule=e_queue_schedules[0], \
                  sporadic_hard_schedule=e_queue_schedules[0], sporadic_soft_schedule=e_queue_schedules[0], \
-                 BE_schedule=e_queue_schedules[0]):
+                 BE_schedule=e_queue_schedules[0], offline_GCL=-1, compiled_GCL=-1):
 
         # setup queues and their schedule
         self.ST_count = ST_count
@@ -956,9 +1429,9 @@ class Queue():
         self.BE_count = BE_count
         self.BE_schedule = BE_schedule
 
-        # dont forget initial GCL is global
-        global g_offline_GCL
-        self.offline_GCL = g_offline_GCL  # does this even need to be stored here? Can just use global one?
+        # GCL defaults to the global one of the simulation. Compiled GCLs are shared between switches so must not be changed in here
+        self.offline_GCL = sim.offline_GCL if offline_GCL == -1 else offline_GCL
+        self.compiled_GCL = sim.compiled_GCL if compiled_GCL == -1 else compiled_GCL
         self.active_GCL = self.offline_GCL  # initially. Can be changed with modify_GCL()
 
 
@@ -1008,48 +1481,651 @@ class Queue():
 
 
 
-##################################################
-############# INOUT PARSER FUNCTIONS #############
-##################################################
+# GCL compiled into the gate bitmask (bit N set means gate N is open) of every tick in one cycle
+# the cycle restarts at the REPEAT entry so any timestamp is looked up directly instead of walking through the GCL
+class Compiled_GCL():
 
-## HELPERS
-# main function to bulk parse all inputs from file paths defined under  ### USER SETTINGS ###
-def bullk_parse(network_topo_file, queue_definition_file, GCL_file, traffic_definition_file):
+    def __init__(self, gcl):  # gcl is a parsed GCL dict, key is start timestamp and value is the gate string
+        self.cycle_length = max(gcl)  # final entry is the REPEAT
+        self.gate_states = [0] * self.cycle_length
+        self.ticks_to_change = [self.cycle_length] * self.cycle_length  # ticks until the gate state is different
 
-    # network topo
-    n_topo_return_value = network_topo_parse_wrapper(network_topo_file)
-    if n_topo_return_value == 0:
-        return 0
+        # every tick from a start timestamp up to the next start timestamp has the same state
+        timestamps = sorted([timestamp for timestamp in gcl if timestamp < self.cycle_length])
+        timestamps.append(self.cycle_length)
+        for index in range(len(timestamps)-1):
+            gate_state = 0
+            for gate in range(len(gcl[timestamps[index]])):
+                if gcl[timestamps[index]][gate] != str(0):  # gate is open
+                    gate_state |= 1 << gate
+            self.gate_states[timestamps[index]:timestamps[index+1]] = [gate_state] * (timestamps[index+1] - timestamps[index])
 
-    # else if there is a filename change
-    elif type(n_topo_return_value) is tuple:
-        network_topo_file = n_topo_return_value[0]  # update current filename for routing table parse
-        if n_topo_return_value[1] == 0:  # if it still failed
+        # count back through 2 cycles so the ticks before the end of the cycle can see the changes at the start of the next one
+        ticks = self.cycle_length
+        for position in range((2*self.cycle_length)-1, -1, -1):
+            if self.gate_states[position % self.cycle_length] != self.gate_states[(position+1) % self.cycle_length]:
+                ticks = 1
+            else:
+                ticks = min(ticks+1, self.cycle_length)
+            if position < self.cycle_length:
+                self.ticks_to_change[position] = ticks
+
+
+    # returns the gate bitmask at the given timestamp
+    def get_state(self, timestamp):
+        return self.gate_states[timestamp % self.cycle_length]
+
+
+    # returns the first timestamp after the given timestamp where the gate state changes
+    def get_next_change(self, timestamp):
+        return timestamp + self.ticks_to_change[timestamp % self.cycle_length]
+
+
+
+# candidate packet at the front of an open inner queue, waiting in available_packets to be picked by egress_packets()
+class Egress_Candidate():
+
+    __slots__ = ("packet", "queue", "queue_number", "emergency")
+
+    def __init__(self, packet, queue, queue_number, emergency=False):
+        self.packet = packet
+        self.queue = queue  # the queue the packet is at the front of, so it can be popped without searching
+        self.queue_number = queue_number
+        self.emergency = emergency  # True if this is ST traffic in an Emergency queue
+
+
+
+# heap backed inner queue for EDF scheduled queues. Keeps packets ordered by absolute deadline (ties in arrival order)
+# so the earliest deadline is always at the front. Removed packets are only marked and get dropped when they reach the front
+class EDF_Queue():
+
+    def __init__(self):
+        self.heap = []  # entries are [absolute_deadline, arrival_count, packet] with packet set to None when removed
+        self.entries = {}  # key is the packet (objects hash by identity, stored packets by row), value is its heap entry
+        self.arrival_count = 0  # tie breaker so packets with the same deadline leave in the order they arrived
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+    # packets in the order they arrived
+    def __iter__(self):
+        return iter(self.entries)
+
+
+    def append(self, packet):
+        entry = [get_EDF_deadline(packet), self.arrival_count, packet]
+        self.arrival_count += 1
+        self.entries[packet] = entry
+        heapq.heappush(self.heap, entry)
+        return 1
+
+
+    # returns the packet with the earliest deadline without removing it
+    def peek(self):
+        while self.heap[0][2] is None:  # drop any removed packets that have reached the front
+            heapq.heappop(self.heap)
+        return self.heap[0][2]
+
+
+    # removes and returns the packet with the earliest deadline
+    def popleft(self):
+        packet = self.peek()
+        del self.entries[packet]
+        heapq.heappop(self.heap)
+        return packet
+
+
+    def remove(self, packet):
+        entry = self.entries.pop(packet)
+
+        if entry is self.heap[0]:  # front of the queue can be removed straight away
+            heapq.heappop(self.heap)
+        else:  # anywhere else is marked and removed later
+            entry[2] = None
+
+        return 1
+
+
+
+# constant memory statistics of a stream of integer values (latencies, queueing delays or deadline slack in ticks)
+# count, mean and variance are kept with Welford's algorithm. Quantiles come from log bucketed histograms (one for
+# negative values) where values within 64 of 0 have their own bucket and larger ones share a bucket with others within ~3%
+class Streaming_Stats():
+
+    sub_buckets = 32  # buckets per power of 2 above 64. More buckets is more accurate quantiles
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # sum of squared differences from the mean
+        self.min = -1
+        self.max = -1
+        self.histogram = []  # count of values in each bucket, grows as larger values are added
+        self.negative_histogram = []  # same for negative values, bucketed by their magnitude
+
+
+    # adds a value to the statistics
+    def add(self, value):
+        value = int(value)
+
+        # Welford update
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+        if( (self.count == 1) or (value < self.min) ):
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+        if value >= 0:
+            histogram = self.histogram
+            bucket = self.get_bucket(value)
+        else:
+            histogram = self.negative_histogram
+            bucket = self.get_bucket(-value)
+        if bucket >= len(histogram):
+            histogram.extend([0] * (bucket + 1 - len(histogram)))
+        histogram[bucket] += 1
+
+        return 1
+
+
+    # adds count copies of a value to the statistics, as if add() was called count times
+    def add_count(self, value, count):
+        value = int(value)
+        count = int(count)
+        if count < 1:
+            return 0
+
+        # Chan's update, merging in count values with a mean of value and no variance
+        total = self.count + count
+        delta = value - self.mean
+        self.mean += delta * count / total
+        self.m2 += delta * delta * self.count * count / total
+
+        if( (self.count == 0) or (value < self.min) ):
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.count = total
+
+        if value >= 0:
+            histogram = self.histogram
+            bucket = self.get_bucket(value)
+        else:
+            histogram = self.negative_histogram
+            bucket = self.get_bucket(-value)
+        if bucket >= len(histogram):
+            histogram.extend([0] * (bucket + 1 - len(histogram)))
+        histogram[bucket] += count
+
+        return 1
+
+
+    # returns the histogram bucket of a value
+    def get_bucket(self, value):
+        if value < 2*self.sub_buckets:
+            return value
+        shift = value.bit_length() - self.sub_buckets.bit_length()  # so sub_buckets <= (value >> shift) < 2*sub_buckets
+        return (2*self.sub_buckets) + ((shift-1) * self.sub_buckets) + ((value >> shift) - self.sub_buckets)
+
+
+    # returns the largest value that goes in a bucket
+    def get_bucket_max(self, bucket):
+        if bucket < 2*self.sub_buckets:
+            return bucket
+        shift = ((bucket - (2*self.sub_buckets)) // self.sub_buckets) + 1
+        mantissa = ((bucket - (2*self.sub_buckets)) % self.sub_buckets) + self.sub_buckets
+        return ((mantissa+1) << shift) - 1
+
+
+    # returns the smallest value that goes in a bucket
+    def get_bucket_min(self, bucket):
+        if bucket == 0:
+            return 0
+        return self.get_bucket_max(bucket-1) + 1
+
+
+    # returns the sample variance, 0 if there are less than 2 values
+    def get_variance(self):
+        if self.count < 2:
+            return 0.0
+        return self.m2 / (self.count - 1)
+
+
+    def get_stdev(self):
+        return math.sqrt(self.get_variance())
+
+
+    # returns the value that the given fraction (0 to 1) of values are less than or equal to, -1 if there are no values
+    # this is the largest value of its histogram bucket, limited to the actual min and max
+    def get_quantile(self, fraction):
+        if self.count == 0:
+            return -1
+
+        rank = max(math.ceil(fraction * self.count), 1)  # position of the value in sorted order (1-based)
+        seen = 0
+
+        # negative values from the most negative up
+        for bucket in range(len(self.negative_histogram)-1, -1, -1):
+            seen += self.negative_histogram[bucket]
+            if seen >= rank:
+                return min(max(-self.get_bucket_min(bucket), self.min), self.max)
+
+        for bucket in range(len(self.histogram)):
+            seen += self.histogram[bucket]
+            if seen >= rank:
+                return min(max(self.get_bucket_max(bucket), self.min), self.max)
+
+        return self.max
+
+
+    def to_string(self):
+        if self.count == 0:
+            return "Count: 0"
+
+        out_str = "Count: "+str(self.count)
+        out_str += "\nMean: "+str(self.mean)
+        out_str += "\nStandard deviation: "+str(self.get_stdev())
+        out_str += "\nMin: "+str(self.min)
+        out_str += "\nMax: "+str(self.max)
+        out_str += "\np50: "+str(self.get_quantile(0.5))
+        out_str += "\np99: "+str(self.get_quantile(0.99))
+        out_str += "\np99.9: "+str(self.get_quantile(0.999))
+
+        return out_str
+
+
+
+# latency and deadline slack (deadline - latency) statistics of delivered packets, split by traffic definition ID,
+# traffic class (ST that went through an Emergency queue counts as Emergency) and destination ES
+class Latency_Breakdown():
+
+    class_order = ["ST", "Emergency", "Sporadic_Hard", "Sporadic_Soft", "BE"]  # order classes are output in
+
+    def __init__(self):
+        # key is the traffic definition ID, class name or destination ES ID. Value is [latency Streaming_Stats, slack Streaming_Stats]
+        self.by_traffic_id = {}
+        self.by_class = {}
+        self.by_destination = {}
+
+
+    # adds the latency of a delivered packet, from a flow following the given traffic definition ID, to every breakdown
+    def add(self, packet, latency, traffic_id):
+        class_name = "Emergency" if packet.emergency else packet.type
+
+        for table, key in ((self.by_traffic_id, traffic_id), (self.by_class, class_name), (self.by_destination, packet.destination)):
+            if key not in table:
+                table[key] = [Streaming_Stats(), Streaming_Stats()]
+            table[key][0].add(latency)
+            if packet.traffic_class != 3:  # BE has no deadline so no slack
+                table[key][1].add(packet.deadline - latency)
+
+        return 1
+
+
+    # returns a list of rows, one per key of every breakdown. Slack values are empty strings if there was no deadline
+    def get_rows(self):
+        rows = []
+        tables = (("Traffic_ID", self.by_traffic_id, sorted(self.by_traffic_id)), \
+                  ("Class", self.by_class, [name for name in self.class_order if name in self.by_class]), \
+                  ("Destination_ES", self.by_destination, sorted(self.by_destination)))
+
+        for group, table, keys in tables:
+            for key in keys:
+                latency, slack = table[key]
+                row = [group, key, latency.count, latency.mean, latency.get_stdev(), latency.min, latency.max, \
+                       latency.get_quantile(0.5), latency.get_quantile(0.99), latency.get_quantile(0.999)]
+                if slack.count == 0:
+                    row += ["", "", ""]
+                else:
+                    row += [slack.min, slack.get_quantile(0.01), slack.mean]
+                rows.append(row)
+
+        return rows
+
+
+
+# trace file with a fixed-width record for every delivered packet, buffered and written in chunks
+# records are little-endian with no padding so an uncompressed binary file can be loaded as a NumPy memmap
+# when threaded, full chunks are passed to a background writer thread through a bounded queue. The simulation
+#  only waits for it when the queue is full, and the chunk buffers are recycled rather than reallocated
+class Packet_Trace():
+
+    # (name, type) of each field of a record. The types are both struct format characters and NumPy type codes
+    record_fields = (("traffic_id", "i"), ("source", "i"), ("destination", "i"), ("traffic_class", "b"), ("emergency", "b"), \
+                     ("hops", "h"), ("release", "q"), ("arrival", "q"), ("latency", "q"), ("queueing_delay", "q"))
+    record_format = struct.Struct("<" + "".join([field[1] for field in record_fields]))
+
+    # resume is the state returned by checkpoint() to continue writing a trace from at resume_timestamp, -1 to start a new trace
+    def __init__(self, filename, chunk_size, file_format=e_trace_formats[0], compression=e_trace_compressions[0], \
+                 threaded=False, queue_size=4, resume=-1, resume_timestamp=0):
+        self.chunk_size = max(int(chunk_size), 1)
+        self.buffer = bytearray(self.record_format.size * self.chunk_size)
+        self.buffered = 0  # number of records in the buffer
+        self.count = 0  # number of records handed to be written
+        self.stalls = 0  # number of times the simulation had to wait for the writer thread
+        self.error = None  # first error raised while writing
+        self.file_format = file_format
+        self.compression = compression
+
+        # an uncompressed trace of the same format is cut back to the checkpoint and continued, anything else starts a new file
+        extension = get_trace_extension(file_format, compression)
+        mode = "w"
+        if resume != -1:
+            if( (resume[2:] == (file_format, compression)) and (compression == e_trace_compressions[0]) and \
+                (os.path.isfile(str(filename)+extension)) and (os.path.getsize(str(filename)+extension) >= resume[1]) ):
+                os.truncate(str(filename)+extension, resume[1])
+                self.count = resume[0]
+                mode = "a"
+            else:
+                filename = str(filename) + "_from_" + str(resume_timestamp)
+                print("Packet trace can not be continued, writing the rest of it to", "\""+filename+extension+"\"")
+
+        # open the file with the extension of its format and compression
+        filename = str(filename) + extension
+        mode += "t" if file_format == "CSV" else "b"
+        newline = "" if file_format == "CSV" else None
+        if compression == "gzip":
+            self.file = gzip.open(filename, mode, newline=newline)
+        elif compression == "lzma":
+            self.file = lzma.open(filename, mode, newline=newline)
+        else:
+            self.file = open(filename, mode, newline=newline)
+        self.filename = filename
+
+        if file_format == "CSV":
+            self.csv_writer = csv.writer(self.file)
+            if mode[0] == "w":
+                self.csv_writer.writerow([field[0] for field in self.record_fields])  # headings
+
+        # start the writer thread with a spare buffer for every chunk the queue can hold and the one being written
+        self.thread = -1
+        if threaded:
+            self.pending = queue_module.Queue(max(int(queue_size), 1))
+            self.spare = queue_module.Queue()
+            for i in range(self.pending.maxsize + 1):
+                self.spare.put(bytearray(len(self.buffer)))
+            self.thread = threading.Thread(target=self.run_writer, name="Packet_Trace_Writer", daemon=True)
+            self.thread.start()
+
+
+    # adds the record of a delivered packet, from a flow following the given traffic definition ID,
+    #  handing the buffer off when it is full
+    def add(self, packet, latency, traffic_id):
+        self.record_format.pack_into(self.buffer, self.buffered * self.record_format.size, traffic_id, packet.source, \
+                                     packet.destination, packet.traffic_class, packet.emergency, packet.hops, \
+                                     packet.transmission_time, packet.arrival_time, latency, packet.queueing_delay)
+        self.buffered += 1
+
+        if self.buffered == self.chunk_size:
+            self.flush()
+        return 1
+
+
+    # hands every buffered record to the writer thread, or writes them directly when not threaded
+    def flush(self):
+        if self.buffered == 0:
+            return 1
+
+        chunk = (self.buffer, self.buffered * self.record_format.size)
+        self.count += self.buffered
+        self.buffered = 0
+
+        if self.thread == -1:
+            self.write_chunk(chunk)
+            return 1
+
+        # blocks while the queue is full so the simulation can not outrun the writer
+        if self.pending.full():
+            self.stalls += 1
+        self.pending.put(chunk)
+        self.buffer = self.spare.get()
+        return 1
+
+
+    # encodes a chunk of records into the file
+    def write_chunk(self, chunk):
+        records = memoryview(chunk[0])[:chunk[1]]
+        if self.file_format == "CSV":
+            self.csv_writer.writerows(self.record_format.iter_unpack(records))
+        else:
+            self.file.write(records)
+        records.release()
+        return 1
+
+
+    # writer thread loop, writes chunks until it is handed None
+    # errors are kept for close() and the chunks are still drained so the simulation never waits forever
+    def run_writer(self):
+        while 1:
+            chunk = self.pending.get()
+            if chunk is None:
+                self.pending.task_done()
+                return 1
+
+            if self.error is None:
+                try:
+                    self.write_chunk(chunk)
+                except (OSError, ValueError) as error:
+                    self.error = error
+            self.spare.put(chunk[0])
+            self.pending.task_done()
+
+
+    # writes out every record so far and returns the (record count, file size, format, compression) to resume from
+    # compressed files have no usable size as they can only be continued from the end
+    def checkpoint(self):
+        self.flush()
+        if self.thread != -1:
+            self.pending.join()
+        self.file.flush()
+
+        size = -1
+        if self.compression == e_trace_compressions[0]:
+            size = os.path.getsize(self.filename)
+        return (self.count, size, self.file_format, self.compression)
+
+
+    # writes out every remaining record, stops the writer thread and closes the file
+    def close(self):
+        self.flush()
+        if self.thread != -1:
+            self.pending.put(None)
+            self.thread.join()
+        self.file.close()
+
+        if self.error is not None:
+            print("ERROR: Could not write packet trace", "\""+self.filename+"\"", "-", self.error)
+            return 0
+        return 1
+
+
+
+# function to get the file extension of a packet trace with the given format and compression
+def get_trace_extension(file_format, compression):
+    extension = ".csv" if file_format == "CSV" else ".bin"
+    if compression == "gzip":
+        extension += ".gz"
+    elif compression == "lzma":
+        extension += ".xz"
+    return extension
+
+
+
+# function to load a binary packet trace file as a NumPy array with one named field per record field
+# uncompressed files are memmapped read-only, compressed files are decompressed into memory
+def load_packet_trace(filename):
+    if np is None:
+        print("ERROR: NumPy is required to load packet trace", "\""+str(filename)+"\"")
+        return 0
+
+    dtype = np.dtype([(field[0], "<"+field[1]) for field in Packet_Trace.record_fields])
+    filename = str(filename)
+    if filename.endswith(".csv") or filename.endswith(".csv.gz") or filename.endswith(".csv.xz"):
+        print("ERROR: Only binary packet traces can be loaded, not", "\""+filename+"\"")
+        return 0
+    if filename.endswith(".gz"):
+        with gzip.open(filename, "rb") as f:
+            return np.frombuffer(f.read(), dtype=dtype)
+    if filename.endswith(".xz"):
+        with lzma.open(filename, "rb") as f:
+            return np.frombuffer(f.read(), dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode="r")
+
+
+
+# calendar of which ES have a flow releasing on each tick, so the TICK engine only visits ES that are releasing
+# releases of ES with only periodic ST flows are generated in chunks of chunk_size ticks at a time with NumPy.
+# every other ES (or every ES if NumPy is not installed) waits in a heap keyed by the next release of its flows
+class Release_Calendar():
+
+    def __init__(self, sim, chunk_size):
+        self.sim = sim  # Simulation whose ES are in the calendar
+        self.chunk_size = max(int(chunk_size), 1)
+        self.scheduled_es_ids = []  # ES whose releases are precomputed, in simulation order
+        self.release_heap = []  # heap of (next_release, index, ES ID) for every other ES
+        self.heap_due = []  # ES from the heap returned on the last lookup, they go back in once they have checked to generate
+
+        for es in self.sim.es_ids:
+            node = self.sim.node_id_dict[es]
+            if( (np is not None) and (len(node.flows) != 0) and all([flow.is_periodic() for flow in node.flows]) ):
+                self.scheduled_es_ids.append(es)
+            else:
+                self.push_release(es)
+
+        # current chunk. release_es[release_starts[N]:release_starts[N+1]] are the ES releasing at release_ticks[N]
+        self.chunk_end = 0
+        self.release_ticks = []
+        self.release_starts = [0]
+        self.release_es = []
+        self.position = 0  # index into release_ticks of the next tick to be looked up
+
+
+    # precomputes every ST release from start_timestamp up to the end of the chunk
+    def build_chunk(self, start_timestamp):
+        self.chunk_end = start_timestamp + self.chunk_size
+        self.release_ticks = []
+        self.release_starts = [0]
+        self.release_es = []
+        self.position = 0
+
+        # release ticks of each flow, and the position of its ES in scheduled_es_ids
+        ticks = []
+        positions = []
+        for position in range(len(self.scheduled_es_ids)):
+            for flow in self.sim.node_id_dict[self.scheduled_es_ids[position]].flows:
+                first_release = flow.get_next_release(start_timestamp)
+                if first_release < self.chunk_end:
+                    flow_ticks = np.arange(first_release, self.chunk_end, int(flow.t_period), dtype=np.int64)
+                    ticks.append(flow_ticks)
+                    positions.append(np.full(len(flow_ticks), position, dtype=np.int64))
+
+        if len(ticks) == 0:  # no releases in this chunk
+            return 1
+
+        # merge into one calendar sorted by tick, ES releasing on the same tick stay in simulation order
+        ticks = np.concatenate(ticks)
+        positions = np.concatenate(positions)
+        order = np.lexsort((positions, ticks))
+        ticks = ticks[order]
+        positions = positions[order]
+
+        # an ES with more than one flow releasing on the same tick only needs to be visited once
+        first = np.ones(len(ticks), dtype=bool)
+        first[1:] = (ticks[1:] != ticks[:-1]) | (positions[1:] != positions[:-1])
+        ticks = ticks[first]
+        positions = positions[first]
+
+        release_ticks, release_starts = np.unique(ticks, return_index=True)
+        self.release_ticks = release_ticks.tolist()
+        self.release_starts = release_starts.tolist() + [len(positions)]
+        self.release_es = np.array(self.scheduled_es_ids)[positions].tolist()
+        return 1
+
+
+    # puts an ES in the heap at the next release of its flows, unless they never release again
+    def push_release(self, es):
+        node = self.sim.node_id_dict[es]
+        next_release = node.get_next_release()
+        if next_release != math.inf:
+            heapq.heappush(self.release_heap, (next_release, node.index, es))
+        return 1
+
+
+    # returns the IDs of every ES that has to check to generate at the given timestamp. Timestamps must not go backwards
+    # ES with only ST flows dont roll random numbers, and ES come out of the heap in simulation order after them,
+    # so the order of random numbers is unchanged
+    def get_generating_es_ids(self, timestamp):
+        if timestamp >= self.chunk_end:
+            self.build_chunk(timestamp)
+
+        # ES that were due last lookup have put their flows back in their own release heaps by now
+        for es in self.heap_due:
+            self.push_release(es)
+        self.heap_due = []
+        while( (len(self.release_heap) != 0) and (self.release_heap[0][0] <= timestamp) ):
+            self.heap_due.append(heapq.heappop(self.release_heap)[2])
+
+        # skip past any ticks that were not looked up
+        while( (self.position < len(self.release_ticks)) and (self.release_ticks[self.position] < timestamp) ):
+            self.position += 1
+
+        if( (self.position < len(self.release_ticks)) and (self.release_ticks[self.position] == timestamp) ):
+            released_es_ids = self.release_es[self.release_starts[self.position]:self.release_starts[self.position+1]]
+            self.position += 1
+            return released_es_ids + self.heap_due
+
+        return self.heap_due
+
+
+
+##################################################
+############# INOUT PARSER FUNCTIONS #############
+##################################################
+
+## HELPERS
+# main function to bulk parse all inputs from file paths defined under  ### USER SETTINGS ### into the given simulation
+def bullk_parse(sim, network_topo_file, queue_definition_file, GCL_file, traffic_definition_file, traffic_mapping_file):
+
+    # network topo
+    n_topo_return_value = network_topo_parse_wrapper(sim, network_topo_file)
+    if n_topo_return_value == 0:
+        return 0
+
+    # else if there is a filename change
+    elif type(n_topo_return_value) is tuple:
+        network_topo_file = n_topo_return_value[0]  # update current filename for routing table parse
+        if n_topo_return_value[1] == 0:  # if it still failed
             return 0
 
 
     # routing table
-    if routing_table_parse_wrapper(network_topo_file) == 0:
+    if routing_table_parse_wrapper(sim, network_topo_file) == 0:
         return 0
 
 
     # GCL
-    if GCL_parse_wrapper(GCL_file) == 0:
+    if GCL_parse_wrapper(sim, GCL_file) == 0:
         return 0
 
 
     # queue definition
-    if queue_def_parse_wrapper(queue_definition_file) == 0:
+    if queue_def_parse_wrapper(sim, queue_definition_file) == 0:
         return 0
 
 
     # traffic definition
-    if traffic_parse_wrapper(traffic_definition_file) == 0:
+    if traffic_parse_wrapper(sim, traffic_definition_file) == 0:
         return 0
 
 
     # traffic mapping
-    if traffic_mapping_parse_wrapper(traffic_mapping_file) == 0:
+    if traffic_mapping_parse_wrapper(sim, traffic_mapping_file) == 0:
         return 0
 
 
@@ -1059,9 +2135,8 @@ def bullk_parse(network_topo_file, queue_definition_file, GCL_file, traffic_defi
 
 
 # helper function to recursively check switches are error free
-def error_check_switch(switch):
+def error_check_switch(sim, switch):
 
-    global g_node_id_dict  # for readability
     end_station_count = 0
     switch_count = 0
     child_nodes_count = len(switch)
@@ -1074,7 +2149,7 @@ def error_check_switch(switch):
     if( ("unique_id" not in switch.keys()) or ("name" not in switch.keys()) ):
         print("ERROR: Invalid switch attribute names")
         return 0
-    if int(switch.get("unique_id")) in g_node_id_dict:  # make sure each ID is unique
+    if int(switch.get("unique_id")) in sim.node_id_dict:  # make sure each ID is unique
         print("ERROR: Duplicate ID found (ID:", switch.get("unique_id")+")")
         return 0
     if child_nodes_count < 1:  # must be at least 1 other node connected to a switch
@@ -1096,32 +2171,32 @@ def error_check_switch(switch):
             if( ("unique_id" not in node.keys()) or ("name" not in node.keys()) ):
                 print("ERROR: Invalid end station attribute names")
                 return 0
-            if int(node.get("unique_id")) in g_node_id_dict:  # make sure we dont have any duplicate IDs
+            if int(node.get("unique_id")) in sim.node_id_dict:  # make sure we dont have any duplicate IDs
                 print("ERROR: Duplicate ID found (ID:", node.get("unique_id")+")")
                 return 0
             if len(node) != 0:  # end stations are not allowed any children
                 print("ERROR: End station (ID:", node.get("unique_id")+")", "has children")
                 return 0
-            if int(node.get("unique_id")) in g_node_id_dict:  # make sure each ID is unique
+            if int(node.get("unique_id")) in sim.node_id_dict:  # make sure each ID is unique
                 print("ERROR: Duplicate ID found (ID:", switch.get("unique_id")+")")
                 return 0
             end_station_count += 1  # no errors, add to count
-            end_station_node = End_Station(int(node.get("unique_id")), switch.get("unique_id"), node.get("name"))  # create node
-            g_node_id_dict[int(node.get("unique_id"))] = end_station_node  # add this erorr free end station to node list
+            end_station_node = End_Station(sim, int(node.get("unique_id")), switch.get("unique_id"), node.get("name"))  # create node
+            sim.node_id_dict[int(node.get("unique_id"))] = end_station_node  # add this erorr free end station to node list
         if end_station_count < 1:  # must be at least 1 end station
             print("ERROR: There must be at least 1 end station connected to switch (ID:", switch.get("unique_id")+")")
             return 0
 
         # child switch
         if node.tag == "Switch":
-            if error_check_switch(node) == 0:  # recursively check for errors on this switch and its children switches if any
+            if error_check_switch(sim, node) == 0:  # recursively check for errors on this switch and its children switches if any
                 return 0
-            if int(node.get("unique_id")) in g_node_id_dict:  # double check none of its children has its ID before adding it
+            if int(node.get("unique_id")) in sim.node_id_dict:  # double check none of its children has its ID before adding it
                 print("ERROR: Duplicate ID found (ID:", node.get("unique_id")+")")
                 return 0
             switch_count += 1
-            switch_node = Switch(int(node.get("unique_id")), node.get("name"))  # create node
-            g_node_id_dict[int(node.get("unique_id"))] = switch_node  # switch and its children are error free, add its ID to list
+            switch_node = Switch(sim, int(node.get("unique_id")), node.get("name"))  # create node
+            sim.node_id_dict[int(node.get("unique_id"))] = switch_node  # switch and its children are error free, add its ID to list
 
     return 1
 
@@ -1129,9 +2204,8 @@ def error_check_switch(switch):
 
 ## PARSERS
 # function to parse the network topology file and populate the network
-def parse_network_topo(f_network_topo):
+def parse_network_topo(sim, f_network_topo):
 
-    global g_node_id_dict
 
     # parse XML file and get root
     parser = etree.XMLParser(ns_clean=True)
@@ -1157,8 +2231,8 @@ def parse_network_topo(f_network_topo):
     if controller.get("unique_id") != str(0):  # controller ID must be 0
         print("ERROR: Controller ID must be 0")
         return 0
-    controller_node = Controller(0, controller.get("name"))  # create controller node with id 0 and name from file
-    g_node_id_dict[0] = controller_node  # add controller to global node list
+    controller_node = Controller(sim, 0, controller.get("name"))  # create controller node with id 0 and name from file
+    sim.node_id_dict[0] = controller_node  # add controller to global node list
 
 
     ## Switches
@@ -1170,19 +2244,19 @@ def parse_network_topo(f_network_topo):
         if switch.tag != "Switch":  # make sure we only have switches and not end stations connected to the controller
             print("ERROR: Invalid switch node tag connected to the Controller")
             return 0
-        if error_check_switch(switch) == 0:  # recursively check for errors on this switch and its children switches if any
+        if error_check_switch(sim, switch) == 0:  # recursively check for errors on this switch and its children switches if any
             return 0
-        if int(switch.get("unique_id")) in g_node_id_dict:  # double check none of its children has its ID before adding it
+        if int(switch.get("unique_id")) in sim.node_id_dict:  # double check none of its children has its ID before adding it
             print("ERROR: Duplicate ID found (ID:", switch.get("unique_id")+")")
             return 0
-        switch_node = Switch(int(switch.get("unique_id")), switch.get("name"))  # create node
-        g_node_id_dict[int(switch.get("unique_id"))] = switch_node  # switch and its children are error free, add its ID to list
+        switch_node = Switch(sim, int(switch.get("unique_id")), switch.get("name"))  # create node
+        sim.node_id_dict[int(switch.get("unique_id"))] = switch_node  # switch and its children are error free, add its ID to list
 
 
     ### Finish up
     # check we havent exceeded the max count
-    if len(g_node_id_dict) > MAX_NODE_COUNT:
-        print("ERROR: Too many nodes:", len(g_node_id_dict), "(MAX:", str(MAX_NODE_COUNT)+")")
+    if len(sim.node_id_dict) > sim.MAX_NODE_COUNT:
+        print("ERROR: Too many nodes:", len(sim.node_id_dict), "(MAX:", str(sim.MAX_NODE_COUNT)+")")
         return 0
 
     return 1
@@ -1190,132 +2264,103 @@ def parse_network_topo(f_network_topo):
 
 
 # function to parse the routing table from the network topo and populate the switches with routes (to be done after parsing network topo)
-def parse_routing_table(f_network_topo):
+# every switch gets a route for each ES below it, and a default route to its parent switch for every other ES
+def parse_routing_table(sim, f_network_topo):
 
-    routing_table = {}
+    routing_table = {}  # key is switch ID, value is list of (end_station_id, hop_switch_id) for every ES below that switch
+    default_routes = {}  # key is switch ID, value is the parent switch ID used to reach every ES not below that switch
 
     # parse file and get root of XML
     parser = etree.XMLParser(ns_clean=True)
     tree = etree.parse(f_network_topo, parser)
     root = tree.getroot()
+    controller = root[0]
 
 
     # get a list of all switches and end stations from the network topo
-    switch_list = []
-    end_station_list = []
-    for key in g_node_id_dict:
-        if g_node_id_dict[key].node_type == "Switch":
-            switch_list.append(key)
-        if g_node_id_dict[key].node_type == "End_Station":
-            end_station_list.append(key)
-    switch_list.append(0)  # controller is also a switch
-
-    # for every switch in the XML, add all its children to global routing table dictionary to be altered later
-    for node in root.iter("Switch"):
-        routing_table[int(node.get("unique_id"))] = [(int(es.get("unique_id")), int(node.get("unique_id"))) for es in node]
-    routing_table[int(root[0].get("unique_id"))] = [(int(es.get("unique_id")), int(root[0].get("unique_id"))) for es in root[0]]  # controller is also a switch
-
-
-    # go through dictionary and translate any switch IDs listed under children to the ES that switch links to
-    # loop until no more switches in children
-    while 1:
-        changes = 0  # track amount of changes made so we can break out when we make no changes in a loop
-
-        for switch_id in routing_table:  # for each switch in the routing table
-            out_tuple = []  # prepare list to keep track of any hops for the entire switch we are checking
-            switches_to_delete = []  # prepare list of elements that we are to delete upon completion of the scan
-
-            for child_index in range(len(routing_table[switch_id])):  # check every child of the current switch
-                if routing_table[switch_id][child_index][0] in switch_list:  # if the child of a switch is another switch we have found a hop point
-                    changes += 1  # increase change count
-
-                    # insert hop entries from child switch
-                    for node in routing_table[routing_table[switch_id][child_index][0]]:  # for each node connected to the child hop switch
-
-                        # build the translation in the form (end_station_id, hop_switch_id)
-                        part_out_tuple = []
-                        part_out_tuple.append(node[0])  # get end_station_id from child switch
-
-                        if routing_table[switch_id][child_index][1] == switch_id:
-                            part_out_tuple.append(routing_table[switch_id][child_index][0])  # insert direct hop switch_id
-                        else:
-                            part_out_tuple.append(routing_table[switch_id][child_index][1])  # insert indirect hop switch_id
-
-                        # append translation to the new lists so we do not modify the live list
-                        out_tuple.append(tuple(part_out_tuple))
-                    switches_to_delete.append(routing_table[switch_id][child_index])  # remember the broken entry to delete later
-
-
-            # finally modify the live switch dict to reflect new changes
-            for element in switches_to_delete:
-                routing_table[switch_id].remove(element)  # delete broken entries
-            for hop in out_tuple:
-                routing_table[switch_id].append(hop)  # insert new hop entries into the list
-
+    switch_count = 1  # controller is also a switch
+    end_station_count = 0
+    for key in sim.node_id_dict:
+        if sim.node_id_dict[key].node_type == "Switch":
+            switch_count += 1
+        if sim.node_id_dict[key].node_type == "End_Station":
+            end_station_count += 1
 
-        # we can leave the while loop if we make no changes
-        if changes == 0:
-            break
 
+    # walk the tree once with child switches before their parents, so each switch builds its routes from its child switches routes
+    # NOTE : uses a stack instead of recursion so very deep topologies do not hit the recursion limit
+    stack = [(controller, False)]
+    while len(stack) != 0:
+        switch, children_done = stack.pop()
 
-    # next make sure every end station is included in the routing table. If any are missing it means they are NOT children, so add the parent as an entry
-    for switch_id in routing_table:
-        missing_end_stations = end_station_list.copy()  # create list of all end stations
+        if not children_done:  # come back to this switch once all its child switches have their routes
+            stack.append((switch, True))
+            for node in switch:
+                if node.tag == "Switch":
+                    stack.append((node, False))
+            continue
 
-        for child_id in routing_table[switch_id]:  # check each child of the switch
-            if child_id[0] in missing_end_stations:
-                missing_end_stations.remove(child_id[0])  # remove stations that are present form the list so we have a list of missing end station ids
+        switch_id = int(switch.get("unique_id"))
+        routes = []
+        for node in switch:
+            node_id = int(node.get("unique_id"))
+            if node.tag == "End_Station":  # direct child, the hop is this switch
+                routes.append((node_id, switch_id))
+            else:  # everything below a child switch goes through that child switch
+                routes.extend([(route[0], node_id) for route in routing_table[node_id]])
 
-        # add entries for each end station that is missing
-        for node in root.iter("Switch"):
-            if int(node.get("unique_id")) == switch_id:  # find switch in XML so we can get the parent
-                for end_station in missing_end_stations:
-                    routing_table[switch_id].append(tuple( (end_station, int(node.getparent().get("unique_id"))) ))  # append tuple of (es_id, sw_parent) to routing
+        routing_table[switch_id] = routes
+        if switch is not controller:  # the controller is the top of the tree so has no default route
+            default_routes[switch_id] = int(switch.getparent().get("unique_id"))
 
 
     # error checking
-    # each switch should have the same amount of children representing every end station
-    for key in routing_table:
-        if len(routing_table[key]) != len(end_station_list):
-            print("ERROR: Entry \""+key+"\"", "in the global routing table has an incorrect amount of children")
-            return 0
+    # every end station is below the controller so it should have a route for every end station
+    if len(routing_table[int(controller.get("unique_id"))]) != end_station_count:
+        print("ERROR: Controller in the global routing table has an incorrect amount of children")
+        return 0
 
     # each switch should be present in the routing table
-    if len(routing_table) != len(switch_list):
+    if len(routing_table) != switch_count:
         print("ERROR: Incorrect amount of switches present in the global routing table")
         return 0
 
 
     # populate switch objects with their appropriate routing table
-    for key in g_node_id_dict:
+    for key in sim.node_id_dict:
         if key in routing_table:
             if key == 0:  # add entire routing table to the controller
-                g_node_id_dict[key].set_routing_table(routing_table)
-                g_node_id_dict[key].set_local_routing_table(routing_table[key])
+                sim.node_id_dict[key].set_routing_table(routing_table)
+                sim.node_id_dict[key].set_local_routing_table(routing_table[key])
 
-            else:  # only add local routing table to switches
-                g_node_id_dict[key].set_local_routing_table(routing_table[key])
+            else:  # only add local routing table and default route to switches
+                sim.node_id_dict[key].set_local_routing_table(routing_table[key], default_routes[key])
 
     return 1
 
 
 
 # function to parse the queue definition file
-def parse_queue_definition(f_queue_def, debug=0):
+def parse_queue_definition(sim, f_queue_def, debug=0):
 
-    global g_node_id_dict, e_queue_schedules, e_queue_type_names
 
     # parse XML file and get root
     parser = etree.XMLParser(ns_clean=True)
     tree = etree.parse(f_queue_def, parser)
     root = tree.getroot()
 
+    # schedules from the settings must be for a queue type and be a valid schedule
+    for queue_type_name in sim.QUEUE_SCHEDULES:
+        if queue_type_name not in e_queue_type_names:
+            print("ERROR: Unrecognised queue type", "\""+str(queue_type_name)+"\"", "in QUEUE_SCHEDULES")
+            return 0
+
     # get a list of all switches present from the network topo
-    switch_list = []
-    for key in g_node_id_dict:
-        if g_node_id_dict[key].node_type == "Switch":
-            switch_list.append(key)
-    switch_list.append(0)  # controller is also a switch
+    switch_list = set()
+    for key in sim.node_id_dict:
+        if sim.node_id_dict[key].node_type == "Switch":
+            switch_list.add(key)
+    switch_list.add(0)  # controller is also a switch
 
 
     ## Error checking and adding defaults
@@ -1324,7 +2369,7 @@ def parse_queue_definition(f_queue_def, debug=0):
         return 0
 
     # check each switch in the file for errors
-    queue_def_switches = []
+    queue_def_switches = set()
     for switch in root:
 
         if int(switch.get("unique_id")) not in switch_list:  # each switch ID in file should be in the actual switch list parsed from the network topology
@@ -1334,7 +2379,7 @@ def parse_queue_definition(f_queue_def, debug=0):
             print("ERROR: Found duplicate Switch ID:", str(switch.get("unique_id")))
             return 0
         else:  # if not diplicate then add the id to the list
-            queue_def_switches.append(int(switch.get("unique_id")))
+            queue_def_switches.add(int(switch.get("unique_id")))
         if len(switch) != 1:  # switches should only have 1 child, the types of queue it holds
             print("ERROR: Switch (ID:", switch.get("unique_id")+") has incorrect number of children")
             return 0
@@ -1373,6 +2418,8 @@ def parse_queue_definition(f_queue_def, debug=0):
                 if debug:
                     print("Switch (ID:", switch.get("unique_id")+") has not defined queue schedule as required. Defaulting to FIFO")
                 queue_type.set("schedule", e_queue_schedules[0])  # add schedule attribute to switch's queue type
+            if queue_type.tag in sim.QUEUE_SCHEDULES:  # schedule from the settings replaces the one from the file
+                queue_type.set("schedule", str(sim.QUEUE_SCHEDULES[queue_type.tag]))
             if queue_type.get("schedule") not in e_queue_schedules:  # make sure schedule attribute is valid
                 print("ERROR: Unrecognised queue schedule for queue", "\""+str(queue_type.tag)+"\"", \
                       "in Switch (ID:", switch.get("unique_id")+")")
@@ -1416,19 +2463,33 @@ def parse_queue_definition(f_queue_def, debug=0):
                 BE_count = int(queue_type.get("count"))
                 BE_schedule = str(queue_type.get("schedule"))
 
-        queue_def = Queue(ST_count, emergency_count, sporadic_hard_count, sporadic_soft_count, BE_count, \
-                          ST_schedule, emergency_schedule, sporadic_hard_schedule, sporadic_soft_schedule, BE_schedule)
-        g_node_id_dict[int(switch.get("unique_id"))].set_queue_def(queue_def)
+        # switches can have their own GCL file (relative to the queue definition file), else they use the global GCL
+        offline_GCL, compiled_GCL = sim.offline_GCL, sim.compiled_GCL
+        if "gcl" in switch.keys():
+            f_switch_GCL = Path(f_queue_def).parent / switch.get("gcl")
+            if not f_switch_GCL.is_file():
+                print("ERROR: GCL file", "\""+str(f_switch_GCL)+"\"", "of Switch (ID:", switch.get("unique_id")+")", "not found")
+                return 0
+            loaded_GCL = load_GCL(sim, f_switch_GCL)
+            if loaded_GCL == 0:
+                print("ERROR: In GCL file", "\""+str(f_switch_GCL)+"\"", "of Switch (ID:", switch.get("unique_id")+")")
+                return 0
+            offline_GCL, compiled_GCL = loaded_GCL
+
+        queue_def = Queue(sim, ST_count, emergency_count, sporadic_hard_count, sporadic_soft_count, BE_count, \
+                          ST_schedule, emergency_schedule, sporadic_hard_schedule, sporadic_soft_schedule, BE_schedule, \
+                          offline_GCL, compiled_GCL)
+        sim.node_id_dict[int(switch.get("unique_id"))].set_queue_def(queue_def)
 
 
     return 1  # done
 
 
 
-# function to error check and parse the GCL
-def parse_GCL(f_GCL):
+# function to error check and parse a GCL file. Returns a dict (key is start timestamp, value is the gate state) or 0 on error
+def read_GCL(f_GCL):
 
-    global g_offline_GCL, g_original_GCL
+    gcl = {}
 
     # open gcl file
     f_GCL = Path(f_GCL)  # convert string filename to actual file object
@@ -1467,13 +2528,13 @@ def parse_GCL(f_GCL):
                     return 0
 
 
-            # final error check (for sequential timestamps) AND add data to global GCL list here
+            # final error check (for sequential timestamps) AND add data to the GCL dict here
             timing = line.split(' ')[0]  # split on space, LHS is timing data, RHS is gate state
             if "-" in timing:  # if we are dealing with a group of timestamps
                 if current_timestamp+1 == int(timing.split('-')[0][1:]):  # if current timestamp +1 is the first value in the group in the GCL
                     # then this is sequential so add the range to the timestamp
                     group_size = int(timing.split('-')[1][1:]) - int(timing.split('-')[0][1:])  # get the size of the range
-                    g_offline_GCL[current_timestamp+1] = line.split(' ')[1]  # add gate state to dict for start timestamp
+                    gcl[current_timestamp+1] = line.split(' ')[1]  # add gate state to dict for start timestamp
                     current_timestamp += group_size+1
                 else:
                     print("ERROR: Timestamp value at line", "\""+str(line)+"\"", "is not sequential")
@@ -1483,21 +2544,57 @@ def parse_GCL(f_GCL):
                 if int(timing[1:]) == current_timestamp+1:  # if current timestamp+1 is the next timestamp in the GCL
                     # then this is sequential so increment the timestamp by 1 timestamp
                     current_timestamp += 1
-                    g_offline_GCL[current_timestamp] = line.split(' ')[1]  # add gate state to dictionary for this timestamp
+                    gcl[current_timestamp] = line.split(' ')[1]  # add gate state to dictionary for this timestamp
                 else:
                     print("ERROR: Timestamp value at line", "\""+str(line)+"\"", "is not sequential")
                     return 0
 
-    g_original_GCL = g_offline_GCL  # set original GCL for later if everything is a success
+    if max(gcl) == 0:  # need at least 1 tick of gate states before the REPEAT
+        print("ERROR: GCL must contain at least 1 gate state before the REPEAT")
+        return 0
+
+    return gcl
+
+
+
+# function to get the parsed and compiled GCL of a file as (gcl_dict, Compiled_GCL), or 0 on error
+# each file is only parsed once and GCLs with identical gate states share one Compiled_GCL
+def load_GCL(sim, f_GCL):
+
+    filename = str(Path(f_GCL).resolve())
+    if filename in sim.loaded_GCLs:
+        return sim.loaded_GCLs[filename]
+
+    gcl = read_GCL(f_GCL)
+    if gcl == 0:
+        return 0
+
+    schedule = tuple(sorted(gcl.items()))
+    if schedule not in sim.compiled_GCLs:  # compile once if everything is a success
+        sim.compiled_GCLs[schedule] = Compiled_GCL(gcl)
+
+    sim.loaded_GCLs[filename] = (gcl, sim.compiled_GCLs[schedule])
+    return sim.loaded_GCLs[filename]
+
+
+
+# function to error check and parse the global GCL, used by every switch that does not have its own GCL
+def parse_GCL(sim, f_GCL):
+
+
+    loaded_GCL = load_GCL(sim, f_GCL)
+    if loaded_GCL == 0:
+        return 0
+
+    sim.offline_GCL, sim.compiled_GCL = loaded_GCL
     return 1
 
 
 
 # function to error check and parse the traffic definiton file
-def parse_traffic_definition(f_traffic_def, debug=0):
+def parse_traffic_definition(sim, f_traffic_def, debug=0):
 
-    global g_generic_traffics_list
-    traffic_types = e_queue_type_names  # traffic can be same types as queue types
+    traffic_types = e_queue_type_names.copy()  # traffic can be same types as queue types
 
     # except we cant initialise the Emergency type traffic, ST -> Emergency is infered by the simulator itself
     traffic_types.remove("Emergency")
@@ -1541,12 +2638,12 @@ def parse_traffic_definition(f_traffic_def, debug=0):
                 print("Child ID:", child.get("unique_id"), "has no \"destination_id\" attribute. Defaulting to \"0\"")
             child.set("destination_id", "0")
         if child.get("destination_id") != "0":  # destination id should be the id of one of the end points or 0
-            if int(child.get("destination_id")) not in g_node_id_dict:  # if its missing from all IDs fail
-                print(child.get("destination_id"), "not in", g_node_id_dict)
+            if int(child.get("destination_id")) not in sim.node_id_dict:  # if its missing from all IDs fail
+                print(child.get("destination_id"), "not in", sim.node_id_dict)
                 print("ERROR: Traffic (ID:", child.get("unique_id")+")", "has destination_id: \"" + \
                       str(child.get("destination_id"))+"\"", "which does not match an End Station")
                 return 0
-            if g_node_id_dict[int(child.get("destination_id"))].node_type != "End_Station":  # node must be end station
+            if sim.node_id_dict[int(child.get("destination_id"))].node_type != "End_Station":  # node must be end station
                 print("ERROR: Traffic (ID:", child.get("unique_id")+")", "has destination_id: \"" + \
                       str(child.get("destination_id"))+"\"", "which does not match an End Station")
                 return 0
@@ -1563,6 +2660,7 @@ def parse_traffic_definition(f_traffic_def, debug=0):
 
         # build dict entry
         traffic_type = {}
+        traffic_type["unique_id"] = int(child.get("unique_id"))
         traffic_type["offset"] = float(child.get("offset"))
         traffic_type["name"] = str(child.get("name"))
         traffic_type["destination_id"] = str(child.get("destination_id"))
@@ -1671,14 +2769,14 @@ def parse_traffic_definition(f_traffic_def, debug=0):
 
 
         # continue building the dict and then add it to the global list of generic types
-        g_generic_traffics_dict[child.get("unique_id")] = traffic_type
+        sim.generic_traffics_dict[child.get("unique_id")] = traffic_type
 
     return 1
 
 
 
 # function to error check and parse an optional traffic mapping file
-def parse_traffic_mapping_file(f_traffic_mapping):
+def parse_traffic_mapping_file(sim, f_traffic_mapping):
 
     # open traffic mapping file
     f_traffic_mapping = Path(f_traffic_mapping)  # convert string filename to actual file object
@@ -1688,19 +2786,22 @@ def parse_traffic_mapping_file(f_traffic_mapping):
 
         ## Get lists of valid IDs from already parsed files
         # get list of actual present end stations
-        topo_es_ids = []
-        for node_id in g_node_id_dict:
-            if g_node_id_dict[node_id].node_type == "End_Station":  # get end station from global id list
-                topo_es_ids.append(int(node_id))
+        topo_es_ids = set()
+        for node_id in sim.node_id_dict:
+            if sim.node_id_dict[node_id].node_type == "End_Station":  # get end station from global id list
+                topo_es_ids.add(int(node_id))
 
         # get list of actual traffic rule IDs
-        traffic_rule_ids = []
-        for rule_id in g_generic_traffics_dict:
-            traffic_rule_ids.append(int(rule_id))
+        traffic_rule_ids = set()
+        for rule_id in sim.generic_traffics_dict:
+            traffic_rule_ids.add(int(rule_id))
 
 
-        # error check and parse the file
-        es_ids = []  # store ES IDs to make sure they only appear once
+        # error check every line of the file before any of it is applied, so a bad file leaves no flows behind
+        # each rule is an ES ID followed by one or more traffic rule IDs, each becomes a flow of that ES.
+        # an ES can also appear in more than one rule
+        es_ids = set()  # store ES IDs to make sure every ES gets a flow
+        mappings = []  # (ES ID, traffic rule IDs) of every rule, in file order
         for rule in f_lines:
 
             if "," not in rule:  # must contain comma
@@ -1710,39 +2811,41 @@ def parse_traffic_mapping_file(f_traffic_mapping):
             mapping = rule.replace(" ", "")  # strip spaces if any
             mapping = mapping.split(",")  # split on comma
 
-            if len(mapping) != 2:  # check there are only 2 IDs in the list
-                print("ERROR: Traffic mapping rule", "\""+str(rule)+"\"", "must only contain 2 IDs")
+            if len(mapping) < 2:  # check there is an ES ID and at least 1 traffic rule ID in the list
+                print("ERROR: Traffic mapping rule", "\""+str(rule)+"\"", "must contain an ES ID and at least 1 Traffic Definition ID")
                 return 0
 
             # put into easy to read variables
             es = int(mapping[0])
-            tr = int(mapping[1])
+            traffic_ids = [int(tr) for tr in mapping[1:]]
 
             if es not in topo_es_ids:  # make sure ES ID in rule is valid
                 print("ERROR: ES ID in traffic mapping rule", "\""+str(rule)+"\"", "is invalid and does not match Network Topology")
                 return 0
-            if tr not in traffic_rule_ids:  # make sure traffic rule ID in rule is valid
-                print("ERROR: Traffic Definition ID in traffic mapping rule", "\""+str(rule)+"\"", \
-                      "is invalid and does not match any IDs in the Traffic Definition File")
-                return 0
-            if es in es_ids:  # make sure ES ID not already present in the file
-                print("ERROR: Duplicate ES ID found in rule", "\""+str(rule)+"\"")
-                return 0
 
-            # else it is error free and can be applied to the node
-            if g_node_id_dict[es].set_traffic_rules(g_generic_traffics_dict[str(tr)]) == 0:
-                print("ERROR: Failed to apply traffic rule", "\""+str(tr)+": "+str(g_generic_traffics_dict[str(tr)])+"\"", \
-                      "to ES", "\""+str(es)+"\"")
-                return 0  # if failure within node
+            for tr in traffic_ids:
+                if tr not in traffic_rule_ids:  # make sure traffic rule ID in rule is valid
+                    print("ERROR: Traffic Definition ID in traffic mapping rule", "\""+str(rule)+"\"", \
+                          "is invalid and does not match any IDs in the Traffic Definition File")
+                    return 0
 
-            es_ids.append(es)  # add used ES ID to list to make sure there are no duplicates
+            mappings.append((es, traffic_ids))
+            es_ids.add(es)  # add used ES ID to list to check every ES has traffic
 
 
-        # all rules from file applied - make sure each ES has traffic rule by checking length
+        # all rules from file checked - make sure each ES has traffic rule by checking length
         if len(es_ids) != len(topo_es_ids):
             print("ERROR: Not every end station has an associated traffic rule")
             return 0
 
+        # file is error free and can be applied to the nodes
+        for es, traffic_ids in mappings:
+            for tr in traffic_ids:
+                if sim.node_id_dict[es].add_traffic_rules(sim.generic_traffics_dict[str(tr)]) == 0:
+                    print("ERROR: Failed to apply traffic rule", "\""+str(tr)+": "+str(sim.generic_traffics_dict[str(tr)])+"\"", \
+                          "to ES", "\""+str(es)+"\"")
+                    return 0  # if failure within node
+
         # no errors
         return 1
 
@@ -1750,12 +2853,12 @@ def parse_traffic_mapping_file(f_traffic_mapping):
 
 ## WRAPPERS
 # network topo parser wrapper
-def network_topo_parse_wrapper(network_topo_file):
+def network_topo_parse_wrapper(sim, network_topo_file):
 
     # parse network topo from given file
     f = Path(network_topo_file)
     if f.is_file():
-        if(parse_network_topo(network_topo_file) == 0):  # file syntax error
+        if(parse_network_topo(sim, network_topo_file) == 0):  # file syntax error
             print("ERROR: In file:", "\""+network_topo_file+"\"")
             return 0
         else:
@@ -1768,29 +2871,29 @@ def network_topo_parse_wrapper(network_topo_file):
         if gen_utils.get_YesNo_descision("Would you like to create a Network Topology?"):
             if len(network_topo_file) != 0:
                 if gen_utils.get_YesNo_descision("Would you like to use the same name ("+str(network_topo_file)+")?"):  # keep same filename
-                    network_topo_gen.generate(network_topo_file, MAX_NODE_COUNT)  # call generator
+                    network_topo_gen.generate(network_topo_file, sim.MAX_NODE_COUNT)  # call generator
                     print()
-                    return network_topo_parse_wrapper(network_topo_file)  # re-parse
+                    return network_topo_parse_wrapper(sim, network_topo_file)  # re-parse
 
             else:  # generate new topo with different filename
-                new_filename = files_directory
+                new_filename = sim.files_directory
                 new_filename += gen_utils.get_str_descision("Enter a filename for the Network Topology (do NOT include .xml)", \
                                                             restricted_only=True)
                 new_filename += ".xml"
                 print("Accepted filename:", new_filename)
-                network_topo_gen.generate(new_filename, max_nodes=MAX_NODE_COUNT)  # call generator
+                network_topo_gen.generate(new_filename, max_nodes=sim.MAX_NODE_COUNT)  # call generator
                 print()
-                return (new_filename, network_topo_parse_wrapper(new_filename))  # re-parse and return new filename for routing table parse
+                return (new_filename, network_topo_parse_wrapper(sim, new_filename))  # re-parse and return new filename for routing table parse
 
         # see if the user wants to search for a different filename
         elif gen_utils.get_YesNo_descision("Would you like to look for a different Topology filename?"):
-            new_filename = files_directory
+            new_filename = sim.files_directory
             new_filename += gen_utils.get_str_descision("Enter a filename for the Network Topology (do NOT include .xml)", \
                                                         restricted_only=True)
             new_filename += ".xml"
             print("Trying filename: \""+new_filename+"\"")
             print()
-            return (new_filename, network_topo_parse_wrapper(new_filename))
+            return (new_filename, network_topo_parse_wrapper(sim, new_filename))
 
         # if no new file generated and the user doesnt want to search for one then
         print("ERROR: Cannot run simulator without a valid network topology")
@@ -1799,12 +2902,12 @@ def network_topo_parse_wrapper(network_topo_file):
 
 
 # routing table parser wrapper
-def routing_table_parse_wrapper(network_topo_file):
+def routing_table_parse_wrapper(sim, network_topo_file):
 
     # parse routing table from the network topology file
     f = Path(network_topo_file)
     if f.is_file():
-        if(parse_routing_table(network_topo_file) == 0):  # file syntax error
+        if(parse_routing_table(sim, network_topo_file) == 0):  # file syntax error
             print("ERROR: In file:", "\""+network_topo_file+"\"")
             return 0
         else:
@@ -1818,11 +2921,11 @@ def routing_table_parse_wrapper(network_topo_file):
 
 
 # GCL parser wrapper
-def GCL_parse_wrapper(GCL_file):
+def GCL_parse_wrapper(sim, GCL_file):
 
     f = Path(GCL_file)
     if f.is_file():
-        if parse_GCL(GCL_file) == 0:  # file syntax error
+        if parse_GCL(sim, GCL_file) == 0:  # file syntax error
             print("ERROR: In file:", "\""+GCL_file+"\"")
             return 0
         else:
@@ -1833,12 +2936,12 @@ def GCL_parse_wrapper(GCL_file):
 
         # see if the user wants to search for another file
         if gen_utils.get_YesNo_descision("Would you like to look for a different GCL filename?"):
-            new_filename = files_directory
+            new_filename = sim.files_directory
             new_filename += gen_utils.get_str_descision("Enter a filename for the GCL (DO include file extension)", \
                                                         restricted_only=True)
             print("Trying filename: \""+new_filename+"\"")
             print()
-            return GCL_parse_wrapper(new_filename)
+            return GCL_parse_wrapper(sim, new_filename)
 
         # else
         print("ERROR: Cannot run simulator without a valid GCL file")
@@ -1847,12 +2950,12 @@ def GCL_parse_wrapper(GCL_file):
 
 
 # queue definition parser wrapper
-def queue_def_parse_wrapper(queue_definition_file):
+def queue_def_parse_wrapper(sim, queue_definition_file):
 
     # parse queue definition from its xml file
     f = Path(queue_definition_file)
     if f.is_file():
-        if parse_queue_definition(queue_definition_file) == 0:  # syntax error
+        if parse_queue_definition(sim, queue_definition_file) == 0:  # syntax error
             print("ERROR: In file:", "\""+queue_definition_file+"\"")
             return 0
         else:
@@ -1874,7 +2977,7 @@ def queue_def_parse_wrapper(queue_definition_file):
 
             new_filename = ""
             if new_filename_in_use:  # get new filename
-                new_filename = files_directory
+                new_filename = sim.files_directory
                 new_filename += gen_utils.get_str_descision("Enter a filename for the Queue Definition file (do NOT include .xml)", \
                                                             restricted_only=True)
                 new_filename += ".xml"
@@ -1886,40 +2989,40 @@ def queue_def_parse_wrapper(queue_definition_file):
 
                 # get list of controller and switch IDs into a list()
                 id_list_to_send = []
-                for key in g_node_id_dict:
-                    if g_node_id_dict[key].node_type != "End_Station":
+                for key in sim.node_id_dict:
+                    if sim.node_id_dict[key].node_type != "End_Station":
                         id_list_to_send.append(key)
 
                 if new_filename_in_use:  # call queue def generator with new filename and current IDs and try to reparse
-                    queue_def_gen.generate(new_filename, MAX_NODE_COUNT, id_list_to_send, e_queue_schedules)
+                    queue_def_gen.generate(new_filename, sim.MAX_NODE_COUNT, id_list_to_send, e_queue_schedules)
                     print()
-                    return queue_def_parse_wrapper(new_filename)
+                    return queue_def_parse_wrapper(sim, new_filename)
                 else:  # call queue def generator with old filename and current IDs and try to reparse
-                    queue_def_gen.generate(queue_definition_file, MAX_NODE_COUNT, id_list_to_send, e_queue_schedules)
+                    queue_def_gen.generate(queue_definition_file, sim.MAX_NODE_COUNT, id_list_to_send, e_queue_schedules)
                     print()
-                    return queue_def_parse_wrapper(queue_definition_file)
+                    return queue_def_parse_wrapper(sim, queue_definition_file)
 
 
             else:
                 if new_filename_in_use:  # call queue def generator with new filename and no IDs and try to reparse
-                    queue_def_gen.generate(new_filename, MAX_NODE_COUNT, allowed_schedules=e_queue_schedules)
+                    queue_def_gen.generate(new_filename, sim.MAX_NODE_COUNT, allowed_schedules=e_queue_schedules)
                     print()
-                    return queue_def_parse_wrapper(new_filename)
+                    return queue_def_parse_wrapper(sim, new_filename)
                 else:  # call queue def generator with old filename and no IDs and try to reparse
-                    queue_def_gen.generate(queue_definition_file, MAX_NODE_COUNT, allowed_schedules=e_queue_schedules)
+                    queue_def_gen.generate(queue_definition_file, sim.MAX_NODE_COUNT, allowed_schedules=e_queue_schedules)
                     print()
-                    return queue_def_parse_wrapper(queue_definition_file)
+                    return queue_def_parse_wrapper(sim, queue_definition_file)
 
 
         # if user doesnt want to create a new one - see if they want to search for a different one
         elif gen_utils.get_YesNo_descision("Would you like to look for a different Queue Definition filename?"):
-            new_filename = files_directory
+            new_filename = sim.files_directory
             new_filename += gen_utils.get_str_descision("Enter a filename for the Queue Definition (do NOT include .xml)", \
                                                         restricted_only=True)
             new_filename += ".xml"
             print("Trying filename: \""+new_filename+"\"")
             print()
-            return queue_def_parse_wrapper(new_filename)  # dont need to return the new filename as nothing else needs it
+            return queue_def_parse_wrapper(sim, new_filename)  # dont need to return the new filename as nothing else needs it
 
         # if no new definition generated and the user doesnt want to search for one then:
         print("ERROR: Cannot run simulator without a valid Queue Definition file")
@@ -1928,12 +3031,12 @@ def queue_def_parse_wrapper(queue_definition_file):
 
 
 # traffic definition parser wrapper
-def traffic_parse_wrapper(traffic_definition_file):
+def traffic_parse_wrapper(sim, traffic_definition_file):
 
     # parse the generic types of traffic our simulator will be able to send
     f = Path(traffic_definition_file)
     if f.is_file():
-        if parse_traffic_definition(traffic_definition_file) == 0:  # syntax error
+        if parse_traffic_definition(sim, traffic_definition_file) == 0:  # syntax error
             print("ERROR: In file:", "\""+traffic_definition_file+"\"")
             return 0
         else:
@@ -1950,10 +3053,10 @@ def traffic_parse_wrapper(traffic_definition_file):
                 if gen_utils.get_YesNo_descision("Would you like to use the current filename ("+traffic_definition_file+")?"):
                     traffic_def_gen.generate(traffic_definition_file)  # generate
                     print()
-                    return traffic_parse_wrapper(traffic_definition_file)  # attempt to re-parse
+                    return traffic_parse_wrapper(sim, traffic_definition_file)  # attempt to re-parse
 
             # else get new filename
-            new_filename = files_directory
+            new_filename = sim.files_directory
             new_filename += gen_utils.get_str_descision("Enter a filename for the Traffic Definition file (do NOT include .xml)", \
                                                         restricted_only=True)
             new_filename += ".xml"
@@ -1961,18 +3064,18 @@ def traffic_parse_wrapper(traffic_definition_file):
 
             traffic_def_gen.generate(new_filename)  # generate
             print()
-            return traffic_parse_wrapper(new_filename)  # attempt to re-parse
+            return traffic_parse_wrapper(sim, new_filename)  # attempt to re-parse
 
 
         # if user doesnt want to create a new one - see if they want to search for a different one
         elif gen_utils.get_YesNo_descision("Would you like to look for a different Traffic Definition filename?"):
-            new_filename = files_directory
+            new_filename = sim.files_directory
             new_filename += gen_utils.get_str_descision("Enter a filename for the Traffic Definition (do NOT include .xml)", \
                                                         restricted_only=True)
             new_filename += ".xml"
             print("Trying filename: \""+new_filename+"\"")
             print()
-            return traffic_parse_wrapper(new_filename)  # dont need to return the new filename as nothing else needs it
+            return traffic_parse_wrapper(sim, new_filename)  # dont need to return the new filename as nothing else needs it
 
 
         # else
@@ -1982,12 +3085,12 @@ def traffic_parse_wrapper(traffic_definition_file):
 
 
 # traffic mapping parser wrapper
-def traffic_mapping_parse_wrapper(traffic_mapping_file):
+def traffic_mapping_parse_wrapper(sim, traffic_mapping_file):
 
     # check if the file is present
     f = Path(traffic_mapping_file)
     if f.is_file():
-        if parse_traffic_mapping_file(traffic_mapping_file) == 0:
+        if parse_traffic_mapping_file(sim, traffic_mapping_file) == 0:
             print("ERROR: In file:", "\""+traffic_mapping_file+"\"")
             # don't return here so it goes on to specify manually
         else:
@@ -1999,30 +3102,34 @@ def traffic_mapping_parse_wrapper(traffic_mapping_file):
 
         # else user doesnt want to make a new file
         if gen_utils.get_YesNo_descision("Would you like to look for a different Traffic Mapping file filename?"):
-            new_filename = files_directory
+            new_filename = sim.files_directory
             new_filename += gen_utils.get_str_descision("Enter a filename for the Traffic Mapping file (DO include file extension)", \
                                                         restricted_only=True)
             print("Trying filename: \""+new_filename+"\"")
             print()
-            return traffic_mapping_parse_wrapper(new_filename)  # dont need to return the new filename as nothing else needs it
+            return traffic_mapping_parse_wrapper(sim, new_filename)  # dont need to return the new filename as nothing else needs it
 
 
-    # else
+    # else, dropping any flows a failed mapping file applied before it stopped
+    for node_id in sim.node_id_dict:
+        if sim.node_id_dict[node_id].node_type == "End_Station":
+            sim.node_id_dict[node_id].clear_traffic_rules()
+
     print()
     print("WARNING: Traffic Mapping required. User must manually specify mapping.")
     print("Available Traffic types from the Traffic Definition File and their ID:")
-    print([("ID: "+str(key_id), "Type: "+str(g_generic_traffics_dict[key_id]["type"]), \
-            "Dest: "+str(g_generic_traffics_dict[key_id]["destination_id"])) \
-           for key_id in g_generic_traffics_dict])
+    print([("ID: "+str(key_id), "Type: "+str(sim.generic_traffics_dict[key_id]["type"]), \
+            "Dest: "+str(sim.generic_traffics_dict[key_id]["destination_id"])) \
+           for key_id in sim.generic_traffics_dict])
 
     # ask user which end station gets which traffic ruleset
-    traffic_ids = [id for id in g_generic_traffics_dict]  # get list of just the ID
-    for node_id in g_node_id_dict:
-        if g_node_id_dict[node_id].node_type == "End_Station":  # get end station from global id list
+    traffic_ids = [id for id in sim.generic_traffics_dict]  # get list of just the ID
+    for node_id in sim.node_id_dict:
+        if sim.node_id_dict[node_id].node_type == "End_Station":  # get end station from global id list
             t_id = gen_utils.get_restricted_descision("What generic Traffic ID should End_Station " + \
                                                       "(ID: "+str(node_id)+")"+" get?", traffic_ids)
-            if g_node_id_dict[node_id].set_traffic_rules(g_generic_traffics_dict[t_id])  == 0:
-                print("ERROR: Failed to apply traffic rule", "\""+str(t_id)+": "+str(g_generic_traffics_dict[t_id])+"\"", \
+            if sim.node_id_dict[node_id].add_traffic_rules(sim.generic_traffics_dict[t_id])  == 0:
+                print("ERROR: Failed to apply traffic rule", "\""+str(t_id)+": "+str(sim.generic_traffics_dict[t_id])+"\"", \
                       "to ES", "\""+str(node_id)+"\"")
                 return 0  # if failure
 
@@ -2034,7 +3141,8 @@ def traffic_mapping_parse_wrapper(traffic_mapping_file):
 ##################################################
 ############## SCHEDULER  FUNCTIONS ##############
 ##################################################
-# These functions should take in a list representing the queue, and return 1 packet to signify it is at the front of the queue
+# These functions should take in a queue (made by create_queue()), and return the packet at the front of the queue
+# egress_packets() pops the front of the queue once the packet is sent
 
 # FIFO
 def FIFO_schedule(queue):
@@ -2043,32 +3151,22 @@ def FIFO_schedule(queue):
 
 # EDF
 def EDF_schedule(queue):
-    packet_to_send = -1
-    earliest_deadline = 9999999999  # big number to compare against
-
-    # check each packet for shortest relative deadline
-    for packet in queue:
-        if( (packet.__class__.__name__ == "ST") or (packet.__class__.__name__ == "Sporadic_Hard") ):  # ST, Emergency, and SH use hard_deadline
-            deadline = packet.hard_deadline
-            transmission = packet.transmission_time
-            difference = (transmission+deadline) - g_timestamp
-            if difference < earliest_deadline:
-                packet_to_send = packet
-                earliest_deadline = difference
-
-        elif packet.__class__.__name__ == "Sporadic_Soft":  # SS use soft_deadline
-            deadline = packet.soft_deadline
-            transmission = packet.transmission_time
-            difference = (transmission+deadline) - g_timestamp
-            if difference < earliest_deadline:
-                packet_to_send = packet
-                earliest_deadline = difference
-
-        else:  # BE -> no deadline
-            if packet_to_send == -1:  # if we havent got a packet yet, use first BE packet - acts as a FIFO for the BE queue
-                packet_to_send = packet
-
-    return packet_to_send
+    return queue.peek()  # EDF queues are kept in order of earliest absolute deadline so the front is the packet to send
+
+
+# function to get the absolute deadline a packet is ordered by in an EDF queue
+def get_EDF_deadline(packet):
+    if packet.traffic_class != 3:  # ST, Emergency, SH and SS all have a deadline fixed when the packet was created
+        return packet.transmission_time + packet.deadline
+    else:  # BE -> no deadline, all the same so acts as a FIFO for the BE queue
+        return 0
+
+
+# function to create an empty inner queue suited to the given schedule
+def create_queue(schedule):
+    if schedule == e_queue_schedules[1]:  # EDF
+        return EDF_Queue()
+    return deque()  # FIFO
 
 
 # NOTE : can add more schedules here
@@ -2077,135 +3175,1812 @@ def EDF_schedule(queue):
 
 
 ##################################################
-################# SIMULATOR CODE #################
+################ ENGINE FUNCTIONS ################
+##################################################
+
+# function to sort a set of node IDs into the order the simulator visits them in
+def in_sim_order(sim, node_id_set):
+    return sorted(node_id_set, key=lambda node_id: sim.node_id_dict[node_id].index)
+
+
+# function to simulate every phase of the simulator for the current timestamp of the simulation
+# only the ES in generating_es_ids check to generate, and only nodes in the active sets are visited for the other phases
+def simulate_tick(sim, generating_es_ids):
+
+    # check each ES for traffic to send based on its traffic sending rules
+    for es in generating_es_ids:
+        sim.node_id_dict[es].check_to_generate()
+
+    # ingress packets from every switch with packets arriving
+    for switch in in_sim_order(sim, sim.active_switch_ingress):
+        sim.node_id_dict[switch].ingress_packets()
+        if sim.node_id_dict[switch].has_queued_packets():
+            sim.active_switch_queues.add(switch)
+        if len(sim.node_id_dict[switch].ingress_traffic) == 0:
+            sim.active_switch_ingress.discard(switch)
+
+    # cycle the inner queues of every switch with packets queued
+    active_switches = in_sim_order(sim, sim.active_switch_queues)
+    for switch in active_switches:
+        sim.node_id_dict[switch].cycle_queues()
+
+    # send packets from egress section of every switch with packets queued
+    for switch in active_switches:
+        sim.node_id_dict[switch].egress_packets()
+        if( (sim.node_id_dict[switch].busy == 0) and (not sim.node_id_dict[switch].has_queued_packets()) ):
+            sim.active_switch_queues.discard(switch)
+
+    # send packets in end station egress queues and digest any packets that are in the ingress queue
+    for es in in_sim_order(sim, sim.active_es_egress | sim.active_es_ingress):
+        sim.node_id_dict[es].flush_egress()
+        sim.node_id_dict[es].digest_packets()
+        if( (sim.node_id_dict[es].busy == 0) and (len(sim.node_id_dict[es].egress_traffic) == 0) ):
+            sim.active_es_egress.discard(es)
+        if len(sim.node_id_dict[es].ingress_traffic) == 0:
+            sim.active_es_ingress.discard(es)
+
+    return 1
+
+
+# function to count down the busy counter of every busy node over ticks where nothing else happens
+def skip_ticks(sim, tick_count):
+    if tick_count < 1:
+        return 0
+
+    for node_id in sim.active_switch_queues | sim.active_es_egress:  # busy nodes are always in one of these
+        if sim.node_id_dict[node_id].busy != 0:
+            sim.node_id_dict[node_id].busy = max(sim.node_id_dict[node_id].busy - tick_count, 0)
+
+    return 1
+
+
+# function to put the given (timestamp, event_type) for a node into the event queue
+# events are never removed from the queue, any that no longer match the nodes next_event_timestamp are ignored when popped
+def schedule_event(sim, node, event):
+    if event == -1:  # nothing to do
+        node.next_event_timestamp = -1
+        return 0
+
+    if event[0] != node.next_event_timestamp:
+        node.next_event_timestamp = event[0]
+        heapq.heappush(sim.event_queue, (event[0], node.id, event[1]))
+
+    return 1
+
+
+# EVENT engine: gives the same results as the TICK engine but only simulates ticks where an event is due
+# idle ticks between events only count down busy nodes. Runs until sim.timestamp reaches max_timestamp-1 like the TICK engine
+# a simulation that has been run before (or resumed from a checkpoint) carries on with every event already queued
+# returns 0 if it was stopped early by Ctrl+C
+def run_event_engine(sim, max_timestamp):
+
+    final_timestamp = max(max_timestamp-1, sim.timestamp)
+    last_timestamp = sim.timestamp-1  # last tick that was simulated
+    checkpoint_interval = max(int(sim.CHECKPOINT_INTERVAL), 1)
+    next_checkpoint = (sim.timestamp // checkpoint_interval + 1) * checkpoint_interval
+
+    # every ES is due at its first release
+    if not sim.events_scheduled:
+        for es in sim.es_ids:
+            schedule_event(sim, sim.node_id_dict[es], (sim.node_id_dict[es].get_next_release(), e_event_types[0]))
+        sim.events_scheduled = True
+
+    while( (len(sim.event_queue) != 0) and (sim.event_queue[0][0] < final_timestamp) ):
+
+        # pop every event due at the next timestamp
+        timestamp = sim.event_queue[0][0]
+        due_node_ids = set()
+        while( (len(sim.event_queue) != 0) and (sim.event_queue[0][0] == timestamp) ):
+            event = heapq.heappop(sim.event_queue)
+            if sim.node_id_dict[event[1]].next_event_timestamp != event[0]:  # stale event
+                continue
+            due_node_ids.add(event[1])
+
+            if sim.SIM_DEBUG:  # debug
+                print("[T", str(timestamp).zfill(3)+"]", str(event[2]), "event for", \
+                      sim.node_id_dict[event[1]].node_type, "\""+str(event[1])+"\"")
+
+        if len(due_node_ids) == 0:
+            continue
+
+        # jump to the event and simulate it. Only ES with a due event can have a release to generate
+        skip_ticks(sim, timestamp - last_timestamp - 1)
+        sim.timestamp = timestamp
+        touched_node_ids = due_node_ids | sim.active_es_egress | sim.active_es_ingress | sim.active_switch_ingress | \
+                           sim.active_switch_queues
+        simulate_tick(sim, in_sim_order(sim, [node_id for node_id in due_node_ids \
+                                              if sim.node_id_dict[node_id].node_type == "End_Station"]))
+        last_timestamp = timestamp
+
+        # reschedule every node that was or is now active from its new state, the rest have nothing new to do
+        touched_node_ids |= sim.active_es_egress | sim.active_es_ingress | sim.active_switch_ingress | sim.active_switch_queues
+        for node_id in touched_node_ids:
+            schedule_event(sim, sim.node_id_dict[node_id], sim.node_id_dict[node_id].next_event())
+
+        # save a checkpoint every CHECKPOINT_INTERVAL ticks, or stop here if asked to
+        if( sim.checkpoint_requested or (sim.WRITE_CHECKPOINTS and (timestamp >= next_checkpoint)) ):
+            sim.timestamp = timestamp+1  # checkpoints hold the next tick to simulate like the TICK engine
+            save_checkpoint(sim, sim.get_checkpoint_filename())
+            next_checkpoint = (timestamp // checkpoint_interval + 1) * checkpoint_interval
+            if sim.checkpoint_requested:
+                return 0
+
+    # nothing left to simulate, idle until the end
+    skip_ticks(sim, final_timestamp - last_timestamp - 1)
+    sim.timestamp = final_timestamp
+
+    return 1
+
+
+# TICK engine: simulates every tick until sim.timestamp reaches max_timestamp-1. Returns 0 if it was stopped early by Ctrl+C
+def run_tick_engine(sim, max_timestamp):
+
+    release_calendar = Release_Calendar(sim, sim.RELEASE_CALENDAR_CHUNK)  # built from the state of each ES so it can start at any tick
+    checkpoint_interval = max(int(sim.CHECKPOINT_INTERVAL), 1)
+
+    while sim.timestamp < max_timestamp-1:
+
+        simulate_tick(sim, release_calendar.get_generating_es_ids(sim.timestamp))
+        sim.timestamp += 1
+
+        # save a checkpoint every CHECKPOINT_INTERVAL ticks, or stop here if asked to
+        if( sim.checkpoint_requested or (sim.WRITE_CHECKPOINTS and (sim.timestamp % checkpoint_interval == 0)) ):
+            save_checkpoint(sim, sim.get_checkpoint_filename())
+            if sim.checkpoint_requested:
+                return 0
+
+    return 1
+
+
+# LOCKSTEP engine: simulates every tick of several simulations of the same network side by side until they reach
+#  max_timestamp-1, like the TICK engine. Only the first simulation works out which flows release a packet (and rolls
+#  their random numbers), the others create the same packets, so every simulation sees the same traffic
+# switches only draw common random numbers as well when each node has its own stream (see split_random_streams)
+def run_lockstep_engine(sims, max_timestamp):
+
+    leader = sims[0]
+    g_current.simulation = leader
+    release_calendar = Release_Calendar(leader, leader.RELEASE_CALENDAR_CHUNK)
+
+    while leader.timestamp < max_timestamp-1:
+
+        g_current.simulation = leader
+        generated_flows = [(es, leader.node_id_dict[es].check_to_generate()) \
+                           for es in release_calendar.get_generating_es_ids(leader.timestamp)]
+
+        for sim in sims:
+            g_current.simulation = sim  # stored packets are read from this simulation
+            if sim is not leader:
+                for es, flow_indexes in generated_flows:
+                    sim.node_id_dict[es].generate_flows(flow_indexes)
+            simulate_tick(sim, [])  # packets are already generated
+            sim.timestamp += 1
+
+    return 1
+
+
+# function to run the chosen engine until sim.timestamp reaches max_timestamp-1. Returns 0 if it was stopped early by Ctrl+C
+# stored packets read their fields from the simulation running on this thread
+def run_engine(sim, max_timestamp):
+    g_current.simulation = sim
+    if sim.SIM_ENGINE == e_sim_engines[1]:  # EVENT engine jumps between ticks where something happens
+        return run_event_engine(sim, max_timestamp)
+    return run_tick_engine(sim, max_timestamp)  # TICK engine simulates every tick
+
+
+
+
+##################################################
+################ OUTPUT FUNCTIONS ################
+##################################################
+
+# function to start writing the packet trace of a run, continuing from the given trace state of a checkpoint if there is one
+def open_packet_trace(sim, resume=-1):
+    sim.packet_trace = Packet_Trace(sim.files_directory+sim.prefix+"_out_packet_trace", sim.PACKET_TRACE_CHUNK, \
+                                    sim.PACKET_TRACE_FORMAT, sim.PACKET_TRACE_COMPRESSION, sim.PACKET_TRACE_THREAD, \
+                                    sim.PACKET_TRACE_QUEUE_SIZE, resume, sim.timestamp)
+    return 1
+
+
+# function to print the results of a run and export them to the _out files
+def output_results(sim):
+
+    # write out the rest of the packet trace
+    if sim.packet_trace != -1:
+        sim.packet_trace.close()
+
+    # formatting
+    print()
+    print()
+
+    # display some useful metrics
+    print("ES Count:", len(sim.es_ids))
+    print("SW Count:", len(sim.switch_ids))
+    print()
+
+    # print actual output values
+    print("OUTPUTS:")
+    print()
+
+    # print packets transmitted per switch
+    print("Packets transmitted per Switch:")
+    for sw in sim.switch_ids:
+        print("SW ID:", sw, "packets transmitted:", sim.node_id_dict[sw].packets_transmitted)
+    print()
+
+    # print packet latencies
+    if sim.SIM_DEBUG and sim.KEEP_RAW_DELAYS:
+        print("Packet Latencies:\n ", sim.packet_latencies)  # if in debug, print individual latencies
+    print("Average Packet Latencies = "+str(sim.latency_stats.mean))
+    print("Packet Latency statistics (Ticks):")
+    print(sim.latency_stats.to_string())
+    print()
+
+    # print latency and deadline slack per traffic definition, class and destination
+    print("Packet Latency breakdown (Ticks):")
+    for row in sim.latency_breakdown.get_rows():
+        print(row[0]+":", row[1], "count:", row[2], "mean:", round(row[3], 3), "p99:", row[8], "max:", row[6], \
+              "min slack:", row[10] if row[10] != "" else "none")
+    print()
+
+    # print how much of the packet store was used
+    if sim.USE_PACKET_STORE:
+        print("Packet store peak packets in flight:", sim.packet_store.peak_in_use, "of", sim.packet_store.capacity, "rows")
+        print()
+
+    # print where the packet trace was written
+    if sim.packet_trace != -1:
+        print("Packet trace:", sim.packet_trace.count, "records written to", "\""+sim.packet_trace.filename+"\"")
+        if sim.packet_trace.stalls:
+            print("Packet trace: simulation waited for the writer thread", sim.packet_trace.stalls, "times")
+        print()
+
+    # print packet queueing delays
+    if sim.SIM_DEBUG and sim.KEEP_RAW_DELAYS:
+        print("Global packet queueing delays:\n ", sim.queueing_delays)  # if in debug, print individual queueing delays
+    print("Packet Queueing Delay statistics (Ticks):")
+    print(sim.queueing_stats.to_string())
+    print()
+    print("Average Queue Delays per Switch:")
+    for sw in sim.switch_ids:
+        print("SW ID:", sw, "average packet queueing delay:", sim.node_id_dict[sw].average_queue_delay)
+
+
+
+    ## export to file
+    # latency and queueing delay statistics
+    statistics_file = open(sim.files_directory+sim.prefix+"_out_delay_statistics.csv", "w", newline='')
+    writer_s = csv.writer(statistics_file)
+    writer_s.writerow(["Statistic", "Packet_Latency_(Ticks)", "Queueing_Delay_(Ticks)"])  # headings
+    writer_s.writerow(["Count", sim.latency_stats.count, sim.queueing_stats.count])
+    writer_s.writerow(["Mean", sim.latency_stats.mean, sim.queueing_stats.mean])
+    writer_s.writerow(["Standard_Deviation", sim.latency_stats.get_stdev(), sim.queueing_stats.get_stdev()])
+    writer_s.writerow(["Min", sim.latency_stats.min, sim.queueing_stats.min])
+    writer_s.writerow(["Max", sim.latency_stats.max, sim.queueing_stats.max])
+    writer_s.writerow(["p50", sim.latency_stats.get_quantile(0.5), sim.queueing_stats.get_quantile(0.5)])
+    writer_s.writerow(["p99", sim.latency_stats.get_quantile(0.99), sim.queueing_stats.get_quantile(0.99)])
+    writer_s.writerow(["p99.9", sim.latency_stats.get_quantile(0.999), sim.queueing_stats.get_quantile(0.999)])
+    statistics_file.close()
+
+    # latency and deadline slack per traffic definition, class and destination
+    breakdown_file = open(sim.files_directory+sim.prefix+"_out_latency_breakdown.csv", "w", newline='')
+    writer_b = csv.writer(breakdown_file)
+    writer_b.writerow(["Group", "Key", "Count", "Mean_Latency", "Standard_Deviation", "Min_Latency", "Max_Latency", \
+                       "p50_Latency", "p99_Latency", "p99.9_Latency", "Min_Slack", "p1_Slack", "Mean_Slack"])  # headings
+    for row in sim.latency_breakdown.get_rows():
+        writer_b.writerow(row)
+    breakdown_file.close()
+
+    # every latency and queueing delay, only if they were kept
+    if sim.KEEP_RAW_DELAYS:
+
+        # latencies
+        latencies_file = open(sim.files_directory+sim.prefix+"_out_packet_latencies.csv", "w", newline='')
+        writer_l = csv.writer(latencies_file)
+        writer_l.writerow(["Packet_Latency_(Ticks)"])  # heading
+        for latency in sim.packet_latencies:
+            writer_l.writerow([latency])
+        latencies_file.close()
+
+        # queueing delays
+        queueing_file = open(sim.files_directory+sim.prefix+"_out_queueing_delays.csv", "w", newline='')
+        writer_q = csv.writer(queueing_file)
+        writer_q.writerow(["Queueing_Delay_(Ticks)"])  # heading
+        for queue_delay in sim.queueing_delays:
+            writer_q.writerow([queue_delay])
+        queueing_file.close()
+
+    # average delays per switch
+    avg_queueing_file = open(sim.files_directory+sim.prefix+"_out_average_queueing_delays.csv", "w", newline='')
+    writer_aq = csv.writer(avg_queueing_file)
+    writer_aq.writerow(["Switch_(ID)", "Average_Queueing_Delay_(Ticks)"])  # headings
+    for sw in sim.switch_ids:
+        writer_aq.writerow([sw, sim.node_id_dict[sw].average_queue_delay])
+    avg_queueing_file.close()
+
+    return 1
+
+
+
+
+##################################################
+############## CHECKPOINT FUNCTIONS ##############
+##################################################
+
+# settings that change the results of a run. A simulation loaded from a checkpoint keeps the ones it was saved with so
+#  it continues exactly as the original would have, every other setting comes from the settings it is loaded with
+CHECKPOINT_SETTINGS = ("SIM_ENGINE", "USE_PACKET_STORE", "KEEP_RAW_DELAYS", "GEOMETRIC_RELEASES", "SENDING_SIZE_CAPCITY", \
+                       "BE_FIRE_CHANCE", "SPORADIC_FIRE_CHANCE", "EMERGENCY_QUEUE_CHANCE")
+
+
+# function to save the complete state of a simulation to a compressed checkpoint file, with its timestamp as the next tick
+#  to simulate. The whole simulation is pickled together so objects shared inside it (like compiled GCLs) stay shared
+# the file is written next to the old one and then swapped in, so a crash while saving keeps the previous checkpoint
+def save_checkpoint(sim, filename):
+    with gzip.open(str(filename)+".tmp", "wb", compresslevel=1) as f:
+        pickle.dump(sim, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(str(filename)+".tmp", filename)
+
+    if sim.SIM_DEBUG:  # debug
+        print("[T", str(sim.timestamp).zfill(3)+"]", "Checkpoint saved to", "\""+str(filename)+"\"")
+    return 1
+
+
+# function to load a simulation from a checkpoint file saved by save_checkpoint(), with the given settings (a dict like
+#  Simulation takes) for everything but CHECKPOINT_SETTINGS. Returns the Simulation, or 0 if the file could not be loaded
+# its trace_checkpoint is the state of the packet trace to continue from, -1 if there was none
+def load_checkpoint(filename, settings=None):
+    try:
+        with gzip.open(filename, "rb") as f:
+            sim = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError) as error:
+        print("ERROR: Could not load checkpoint", "\""+str(filename)+"\"", "-", error)
+        return 0
+
+    current = Simulation(settings)
+    for name in Simulation.setting_names:
+        if name not in CHECKPOINT_SETTINGS:
+            setattr(sim, name, getattr(current, name))
+        elif getattr(sim, name) != getattr(current, name):
+            print("Checkpoint setting", name, "=", getattr(sim, name), "replaces", getattr(current, name))
+
+    return sim
+
+
+# function to finish a run stopped by Ctrl+C, its checkpoint has everything needed to carry on
+def finish_stopped_run(sim):
+    if sim.packet_trace != -1:
+        sim.packet_trace.close()
+    print("Checkpoint saved to", "\""+sim.get_checkpoint_filename()+"\"", "at tick", sim.timestamp, \
+          "- set RESUME_CHECKPOINT to this file to continue")
+    return 1
+
+
+
+
+##################################################
+############### VARIANT  FUNCTIONS ###############
 ##################################################
 
-# parse files
-if bullk_parse(network_topo_file, queue_definition_file, GCL_file, traffic_definition_file) == 0:
-    print("CRITICAL ERROR: Failed to parse files")
-    exit()
-print()
+# function to clear every statistic so far, so a variant only measures the ticks after its warm-up
+def reset_statistics(sim):
+
+    sim.latency_stats = Streaming_Stats()
+    sim.queueing_stats = Streaming_Stats()
+    sim.latency_breakdown = Latency_Breakdown()
+    sim.packet_latencies = []
+    sim.queueing_delays = []
+    for switch in sim.switch_ids:
+        sim.node_id_dict[switch].packets_transmitted = 0
+        sim.node_id_dict[switch].total_queue_delay = 0
+        sim.node_id_dict[switch].average_queue_delay = 0.0
+
+    return 1
 
 
-## Get list of ES and Switch IDs
-es_ids = []
-switch_ids = []
-for node_id in g_node_id_dict:
-    if g_node_id_dict[node_id].node_type == "End_Station":  # get end station from global id list
-        es_ids.append(node_id)
+# function to switch the running network over to another queue definition and/or global GCL (blank keeps the current one)
+#  and QUEUE_SCHEDULES (-1 keeps the current ones)
+# packets in the inner queues of each switch move to the new queues of their type in the order they entered the switch
+def apply_variant(sim, variant_queue_definition, variant_GCL, variant_schedules=-1):
+
+    g_current.simulation = sim  # stored packets are read from this simulation
+    for filename in (variant_queue_definition, variant_GCL):
+        if( (filename != "") and not Path(filename).is_file() ):
+            print("ERROR: Variant file not found:", "\""+str(filename)+"\"")
+            return 0
+    if variant_schedules != -1:
+        sim.QUEUE_SCHEDULES = variant_schedules
+
+    if variant_GCL != "":
+        if parse_GCL(sim, variant_GCL) == 0:
+            print("ERROR: In file:", "\""+variant_GCL+"\"")
+            return 0
+
+    # take every packet out of the inner queues
+    queued_packets = {}
+    for switch_id in sim.switch_ids:
+        switch = sim.node_id_dict[switch_id]
+        queued_packets[switch_id] = []
+        for queue_list in (switch.ST_queue, switch.EM_queue, switch.SH_queue, switch.SS_queue, switch.BE_queue):
+            packets = [packet for queue in queue_list for packet in queue]
+            queued_packets[switch_id].append(sorted(packets, key=lambda packet: packet.queue_enter))
+        switch.ST_queue, switch.EM_queue, switch.SH_queue, switch.SS_queue, switch.BE_queue = [], [], [], [], []
+
+    # build the new queues, switches without their own GCL pick up the new global one here too
+    variant_queue_definition = sim.queue_definition_file if variant_queue_definition == "" else variant_queue_definition
+    if parse_queue_definition(sim, variant_queue_definition) == 0:
+        print("ERROR: In file:", "\""+variant_queue_definition+"\"")
+        return 0
+
+    # put the packets back
+    for switch_id in sim.switch_ids:
+        switch = sim.node_id_dict[switch_id]
+        for queue_list, packets in zip((switch.ST_queue, switch.EM_queue, switch.SH_queue, switch.SS_queue, switch.BE_queue), \
+                                       queued_packets[switch_id]):
+            for packet in packets:
+                switch.q_load_balance(queue_list, packet)
+
+    # the EVENT engine has events queued from the old gates, work them out again as of the last tick simulated
+    if sim.SIM_ENGINE == e_sim_engines[1]:
+        sim.timestamp -= 1
+        for switch_id in sim.active_switch_queues:
+            schedule_event(sim, sim.node_id_dict[switch_id], sim.node_id_dict[switch_id].next_event())
+        sim.timestamp += 1
+
+    return 1
+
+
+# function to run one (name, queue_definition_file, GCL_file[, QUEUE_SCHEDULES]) variant on from the current state of the
+#  simulation up to max_timestamp. Its outputs and checkpoints get the variant name added to their prefix
+def run_variant(sim, variant, max_timestamp):
+
+    sim.prefix = sim.prefix + "_" + str(variant[0])
+    print("Running variant", "\""+str(variant[0])+"\"", "from tick", sim.timestamp)
+
+    if apply_variant(sim, variant[1], variant[2], variant[3] if len(variant) > 3 else -1) == 0:
+        print("ERROR: Could not apply variant", "\""+str(variant[0])+"\"")
+        return 0
+
+    if sim.WRITE_PACKET_TRACE:
+        open_packet_trace(sim)
+    if run_engine(sim, max_timestamp) == 0:
+        finish_stopped_run(sim)
+        return 0
+
+    output_results(sim)
+    return 1
+
+
+# function to run every variant on from the current (warmed up) state of the simulation
+# lockstep variants run side by side on the same traffic, see run_lockstep_variants
+# forked variants run in parallel child processes that share the warmed up state copy on write, at most one per CPU
+# otherwise the simulation is snapshot in memory once and each variant runs on its own copy, one after another
+# returns 0 if any variant failed (could not be applied, was stopped or missed a deadline)
+def run_variants(sim, variants, max_timestamp):
+
+    reset_statistics(sim)
+    if sim.LOCKSTEP_VARIANTS:
+        return run_lockstep_variants(sim, variants, max_timestamp)
+
+    failed = False
+    if sim.FORK_VARIANTS and hasattr(os, "fork"):
+        running = set()  # process IDs of the running variants
+        for variant in variants:
+            if len(running) >= (os.cpu_count() or 1):
+                pid, wait_status = os.wait()
+                running.discard(pid)
+                failed = failed or (wait_status != 0)
+
+            sys.stdout.flush()  # or the child prints whatever the parent has buffered again
+            pid = os.fork()
+            if pid == 0:  # child runs its variant and leaves, whatever happens in it
+                status = 0
+                try:
+                    status = run_variant(sim, variant, max_timestamp)
+                except SystemExit:  # missed a deadline
+                    pass
+                sys.stdout.flush()
+                os._exit(0 if status else 1)
+            running.add(pid)
+
+        while len(running) != 0:
+            pid, wait_status = os.wait()
+            running.discard(pid)
+            failed = failed or (wait_status != 0)
+        return 0 if failed else 1
+
+    snapshot = pickle.dumps(sim, protocol=pickle.HIGHEST_PROTOCOL)
+    for variant in variants:
+        try:
+            if run_variant(pickle.loads(snapshot), variant, max_timestamp) == 0:
+                failed = True
+        except SystemExit:  # missed a deadline, the other variants still run
+            failed = True
+    return 0 if failed else 1
+
+
+# function to run every variant on its own copy of the simulation in one process with the LOCKSTEP engine, so all of them
+#  get the traffic generated once by the first variant (common random numbers). Differences between the variants then
+#  come from the switch configurations rather than from different random traffic
+# a simulation without a REPLICA shares one random stream between its nodes, which the first variant would draw ahead
+#  of the others, so every copy switches to per node streams of replica 0 (from a drawn RANDOM_SEED if there is none)
+# every variant writes its usual outputs, and the SWEEP_STATISTICS of each variant with their differences from the first
+#  variant are written to the _out_comparison.csv file. Returns 0 if a variant could not be applied, or if variants with
+#  the same files and schedules got different results
+def run_lockstep_variants(sim, variants, max_timestamp):
+
+    if( (sim.REPLICA == -1) and (sim.RANDOM_SEED is None) ):
+        sim.RANDOM_SEED = random.SystemRandom().getrandbits(128)
+        print("Lockstep variant random streams spawned from RANDOM_SEED", sim.RANDOM_SEED)
+    snapshot = pickle.dumps(sim, protocol=pickle.HIGHEST_PROTOCOL)
+    comparison_filename = sim.files_directory+sim.prefix+"_out_comparison.csv"
+    sims = []
+    for variant in variants:
+        variant_sim = pickle.loads(snapshot)
+        variant_sim.prefix = variant_sim.prefix + "_" + str(variant[0])
+        if variant_sim.REPLICA == -1:
+            variant_sim.split_random_streams(0)
+        if apply_variant(variant_sim, variant[1], variant[2], variant[3] if len(variant) > 3 else -1) == 0:
+            print("ERROR: Could not apply variant", "\""+str(variant[0])+"\"")
+            return 0
+        if variant_sim.WRITE_PACKET_TRACE:
+            open_packet_trace(variant_sim)
+        sims.append(variant_sim)
+
+    print("Running", len(sims), "variants in lockstep from tick", sim.timestamp)
+    run_lockstep_engine(sims, max_timestamp)
+
+    summaries = []
+    for variant, variant_sim in zip(variants, sims):
+        print()
+        print("Variant", "\""+str(variant[0])+"\"")
+        output_results(variant_sim)
+        summaries.append(get_sweep_summary(variant_sim, "done"))
+
+    comparison_file = open(comparison_filename, "w", newline='')
+    writer_c = csv.writer(comparison_file)
+    writer_c.writerow(["Variant"] + list(SWEEP_STATISTICS))  # headings
+    for variant, summary in zip(variants, summaries):
+        writer_c.writerow([variant[0]] + summary)
+    for variant, summary in zip(variants[1:], summaries[1:]):
+        differences = [value - first if "" not in (value, first) else "" for value, first in zip(summary[1:], summaries[0][1:])]
+        writer_c.writerow([str(variant[0])+" - "+str(variants[0][0]), "difference"] + differences)
+    comparison_file.close()
+
+    # variants with the same switch configuration see the same traffic and random numbers, so must match exactly
+    identical = True
+    configurations = {}  # key is (queue definition, GCL, schedules) of a variant, value is its position in variants
+    for position, variant in enumerate(variants):
+        configuration = repr((variant[1] if variant[1] != "" else sim.queue_definition_file, \
+                              variant[2] if variant[2] != "" else sim.GCL_file, \
+                              variant[3] if len(variant) > 3 else sim.QUEUE_SCHEDULES))
+        first = configurations.setdefault(configuration, position)
+        if summaries[first] != summaries[position]:
+            print("ERROR: Variants", "\""+str(variants[first][0])+"\"", "and", "\""+str(variant[0])+"\"", \
+                  "have the same configuration but different results")
+            identical = False
+
+    return 1 if identical else 0
+
+
+
+
+##################################################
+################ SWEEP  FUNCTIONS ################
+##################################################
+
+# statistics of each sweep point, the columns of the sweep result table after the settings of the point
+SWEEP_STATISTICS = ("Status", "Packets", "Latency_Mean", "Latency_Stdev", "Latency_Min", "Latency_Max", "Latency_p50", \
+                    "Latency_p99", "Latency_p99.9", "Queueing_Delay_Mean", "Queueing_Delay_p99", "Queueing_Delay_Max", \
+                    "Packets_Transmitted", "Min_Deadline_Slack")
+
+
+# function to list the settings dict of every sweep point, every combination of the grid values then the explicit points
+# returns 0 if a point has a setting a simulation does not have
+def get_sweep_points(grid, points):
+
+    names = list(grid)
+    sweep_points = [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])] if names else []
+    sweep_points += [dict(point) for point in points]
+
+    for point in sweep_points:
+        for name in point:
+            if name not in Simulation.setting_names:
+                print("ERROR: Unrecognised sweep setting", "\""+str(name)+"\"")
+                return 0
+
+    return sweep_points
+
+
+# function to get the SWEEP_STATISTICS from latency and queueing delay Streaming_Stats, in order
+# min_slack is an empty string if no packet had a deadline
+def get_summary(status, latency_stats, queueing_stats, packets_transmitted, min_slack):
+    return [status, latency_stats.count, latency_stats.mean, latency_stats.get_stdev(), latency_stats.min, latency_stats.max, \
+            latency_stats.get_quantile(0.5), latency_stats.get_quantile(0.99), latency_stats.get_quantile(0.999), \
+            queueing_stats.mean, queueing_stats.get_quantile(0.99), queueing_stats.max, packets_transmitted, min_slack]
+
+
+# function to get the SWEEP_STATISTICS of a finished simulation, in order
+def get_sweep_summary(sim, status):
+    slack_mins = [slack.min for latency, slack in sim.latency_breakdown.by_class.values() if slack.count != 0]
+    return get_summary(status, sim.latency_stats, sim.queueing_stats, \
+                       sum([sim.node_id_dict[sw].packets_transmitted for sw in sim.switch_ids]), \
+                       min(slack_mins) if slack_mins else "")
+
+
+# sweep worker processes have no console to answer prompts, so a prompt fails the point rather than waiting forever
+def init_sweep_worker():
+    sys.stdin = open(os.devnull)
+    return 1
+
+
+# function to simulate one sweep point from its full settings up to the tick before max_timestamp, run in a worker process
+# statistics before warmup_timestamp are discarded. Returns (index, summary, output) where summary is the
+#  SWEEP_STATISTICS (only the status if it failed) and output is everything the simulation printed
+def run_sweep_point(index, settings, max_timestamp, warmup_timestamp=0):
+
+    output = io.StringIO()
+    summary = ["failed"]
+    with contextlib.redirect_stdout(output):
+        try:
+            sim = Simulation(settings)
+            if sim.load() == 0:
+                print("ERROR: Failed to parse files")
+            elif( (warmup_timestamp > 0) and (sim.run(warmup_timestamp) == 0) ):
+                finish_stopped_run(sim)
+            else:
+                if warmup_timestamp > 0:
+                    reset_statistics(sim)
+                if sim.WRITE_PACKET_TRACE:
+                    open_packet_trace(sim)
+                if sim.run(max_timestamp-1 - sim.timestamp) == 0:
+                    finish_stopped_run(sim)
+                else:
+                    if sim.packet_trace != -1:
+                        sim.packet_trace.close()
+                    summary = get_sweep_summary(sim, "done")
+        except (SystemExit, EOFError):  # stopped on a deadline miss or a prompt
+            pass
+
+    return index, summary, output.getvalue()
+
+
+# function to simulate a list of full settings dicts in parallel worker processes (one per CPU if workers is 0)
+# returns the summary of each, in order. The output of any that failed is printed
+def run_sweep_points(settings_list, max_timestamp, workers=0, warmup_timestamp=0, label="Sweep point"):
+
+    summaries = [-1] * len(settings_list)
+    workers = workers if workers > 0 else (os.cpu_count() or 1)
+    print("Running", len(settings_list), label.lower()+"s", "on", workers, "worker processes")
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_sweep_worker) as executor:
+        futures = [executor.submit(run_sweep_point, index, settings, max_timestamp, warmup_timestamp) \
+                   for index, settings in enumerate(settings_list)]
+
+        for finished, future in enumerate(as_completed(futures)):
+            index, summary, output = future.result()
+            summaries[index] = summary
+            print(label, index, summary[0], "("+str(finished+1)+"/"+str(len(settings_list))+")")
+            if summary[0] != "done":
+                print(output)
+
+    return summaries
+
+
+# function to simulate every sweep point in parallel and write one result table with a row per point to the
+#  _out_sweep.csv file. Returns 0 if any point did not finish (its Status is not "done")
+# each point runs with the USER SETTINGS plus its own settings, and unless it sets its own prefix, outputs such as
+#  packet traces and checkpoints get "_sweep_" and the point number added to the prefix
+def run_sweep(sweep_points, max_timestamp, workers=0):
+
+    base_settings = dict([(name, globals()[name]) for name in Simulation.setting_names])
+    columns = sorted(set([name for point in sweep_points for name in point]))
+
+    settings_list = []
+    for index, point in enumerate(sweep_points):
+        settings = base_settings.copy()
+        settings["prefix"] = base_settings["prefix"] + "_sweep_" + str(index)
+        settings.update(point)
+        settings_list.append(settings)
+    summaries = run_sweep_points(settings_list, max_timestamp, workers)
+
+    rows = []
+    for index, summary in enumerate(summaries):
+        rows.append([index] + [sweep_points[index].get(name, base_settings[name]) for name in columns] + summary)
+        rows[index] += [""] * (1 + len(columns) + len(SWEEP_STATISTICS) - len(rows[index]))
+
+    sweep_file = open(files_directory+prefix+"_out_sweep.csv", "w", newline='')
+    writer_s = csv.writer(sweep_file)
+    writer_s.writerow(["Point"] + columns + list(SWEEP_STATISTICS))  # headings
+    for row in rows:
+        writer_s.writerow(row)
+    sweep_file.close()
+
+    failed = len([summary for summary in summaries if summary[0] != "done"])
+    if failed != 0:
+        print("WARNING:", failed, "of", len(summaries), "sweep points did not finish")
+        return 0
+    return 1
+
+
+
+
+##################################################
+############# REPLICATION FUNCTIONS ##############
+##################################################
+
+# function to get the seed of an independent random stream, spawned from a root seed by a key (replica, node ID)
+# the key is hashed with the root seed so every stream starts from an unrelated 512 bit seed, which makes two
+#  streams overlapping as unlikely as with NumPy's SeedSequence.spawn
+def get_stream_seed(root_seed, *key):
+    return int.from_bytes(hashlib.sha512(repr((root_seed,) + key).encode()).digest(), "little")
+
+
+# function to get the quantile of Student's t distribution with the given degrees of freedom
+# exact for 1 and 2 degrees of freedom, otherwise Hill's expansion around the normal quantile (within 1% from 3 degrees of freedom)
+def get_t_quantile(fraction, degrees):
+    if degrees == 1:
+        return math.tan(math.pi * (fraction - 0.5))
+    if degrees == 2:
+        return (2*fraction - 1) / math.sqrt(2 * fraction * (1 - fraction))
+
+    z = statistics.NormalDist().inv_cdf(fraction)
+    return z + ((z**3 + z) / (4 * degrees)) \
+             + ((5*z**5 + 16*z**3 + 3*z) / (96 * degrees**2)) \
+             + ((3*z**7 + 19*z**5 + 17*z**3 - 15*z) / (384 * degrees**3)) \
+             + ((79*z**9 + 776*z**7 + 1482*z**5 - 1920*z**3 - 945*z) / (92160 * degrees**4))
+
+
+# function to get (mean, half width) of the confidence interval of the mean of independent values
+# half width is -1 if there are less than 2 values
+def get_confidence_interval(values, confidence):
+    if len(values) < 2:
+        return statistics.fmean(values), -1
+    half_width = get_t_quantile(0.5 + confidence/2, len(values)-1) * statistics.stdev(values) / math.sqrt(len(values))
+    return statistics.fmean(values), half_width
+
+
+# function to simulate independent replicas of the USER SETTINGS in parallel, each with its own random streams spawned
+#  from RANDOM_SEED (or a new seed if it is None), statistics from after WARMUP_TIMESTAMP up to the tick before max_timestamp
+# every statistic gets a confidence interval across the replicas, from the t distribution of their estimates. The
+#  replica rows and the intervals are written to the _out_replications.csv file. Returns 0 if any replica did not finish
+#  (the intervals then only cover the finished ones)
+def run_replications(replications, max_timestamp, workers=0):
+
+    root_seed = RANDOM_SEED if RANDOM_SEED is not None else random.SystemRandom().getrandbits(128)
+    print("Replica random streams spawned from RANDOM_SEED", root_seed)
+
+    settings_list = []
+    for replica in range(replications):
+        settings = dict([(name, globals()[name]) for name in Simulation.setting_names])
+        settings.update({"RANDOM_SEED": root_seed, "REPLICA": replica, "prefix": prefix + "_replica_" + str(replica)})
+        settings_list.append(settings)
+    summaries = run_sweep_points(settings_list, max_timestamp, workers, WARMUP_TIMESTAMP, "Replica")
+    done = [summary for summary in summaries if summary[0] == "done"]
+    print(len(done), "of", replications, "replicas finished")
+
+    # interval of every statistic all finished replicas have a value for
+    interval_rows = []
+    for column in range(1, len(SWEEP_STATISTICS)):
+        values = [summary[column] for summary in done if summary[column] != ""]
+        if( (len(values) == 0) or (len(values) != len(done)) ):
+            continue
+        mean, half_width = get_confidence_interval(values, CONFIDENCE_LEVEL)
+        if half_width == -1:
+            interval_rows.append([SWEEP_STATISTICS[column], mean, "", "", ""])
+        else:
+            interval_rows.append([SWEEP_STATISTICS[column], mean, half_width, mean-half_width, mean+half_width])
+
+    # formatting
+    print()
+    print("Replica estimates with", str(CONFIDENCE_LEVEL*100)+"%", "confidence intervals:")
+    for row in interval_rows:
+        print(row[0]+":", row[1], "+/-", row[2] if row[2] != "" else "(needs 2 replicas)")
+
+    replications_file = open(files_directory+prefix+"_out_replications.csv", "w", newline='')
+    writer_r = csv.writer(replications_file)
+    writer_r.writerow(["Replica"] + list(SWEEP_STATISTICS))  # headings
+    for replica, summary in enumerate(summaries):
+        writer_r.writerow([replica] + summary + [""] * (len(SWEEP_STATISTICS) - len(summary)))
+    writer_r.writerow([])
+    writer_r.writerow(["Statistic", "Mean", "Half_Width", "Lower", "Upper"])  # headings
+    for row in interval_rows:
+        writer_r.writerow(row)
+    replications_file.close()
+
+    return 1 if len(done) == replications else 0
+
+
+
+
+##################################################
+################ SCENARIO  ENGINE ################
+##################################################
+
+# settings that can differ between the scenarios of a Scenario_Engine, everything else is the same for all of them
+SCENARIO_SETTINGS = ("SENDING_SIZE_CAPCITY", "BE_FIRE_CHANCE", "SPORADIC_FIRE_CHANCE", "EMERGENCY_QUEUE_CHANCE", \
+                     "queue_definition_file", "GCL_file", "QUEUE_SCHEDULES")
+
+
+# SCENARIO engine: advances K scenarios of one network (topology, flows and routes) together, a tick at a time, with the
+#  state of every scenario in NumPy arrays along a first scenario axis. Every phase of a tick is a few array operations
+#  across all scenarios and switches, instead of a pass over every node of every simulation
+# switch state is shaped (scenarios, switches, queues): queue lengths, gate masks and the keys the queues are served
+#  by (arrival order for FIFO, absolute deadline for EDF), and busy counters per switch. Packets are rows of integer
+#  arrays like the Packet_Store and only carry what the statistics need, so there are no per-packet outputs
+# scenarios follow the same rules as the TICK engine, but draw their random numbers from one NumPy generator and carry
+#  on past missed deadlines (counted in their status) instead of stopping
+# every tick costs a fixed ~100us of NumPy calls however few packets move, so the engine only pays off with many
+#  scenarios. On the example network against about 22us per tick of one TICK run, it breaks even at around 16 scenarios
+#  (SCENARIO_MIN_BATCH) and is about 2x faster per scenario at 32, 6x at 256 and 11x from 1024 on
+class Scenario_Engine():
+
+    # queue type each packet type goes to (ST can be diverted to Emergency), in order of e_traffic_classes
+    class_queue_types = [0, 2, 3, 4]
+    empty_key = 2**63 - 1  # key of an empty position in a queue, larger than any deadline or arrival
+
+    # sim is a loaded simulation that has not been run, scenarios is a settings dict for each scenario
+    def __init__(self, sim, scenarios):
+        self.sim = sim
+        self.scenarios = scenarios
+        self.timestamp = sim.timestamp
+        self.rng = np.random.default_rng(sim.RANDOM_SEED)
+        self.K = len(scenarios)
+        self.S = len(sim.switch_ids)
+        self.E = len(sim.es_ids)
+        self.valid = self.build_scenarios()
+
+
+    # function to set up the static arrays of the network and every scenario. Returns 0 if a scenario is not valid
+    def build_scenarios(self):
+
+        # flows of every ES, in simulation order
+        flows = [flow for es in self.sim.es_ids for flow in self.sim.node_id_dict[es].flows]
+        self.F = len(flows)
+        self.flow_es = np.array([self.sim.node_id_dict[flow.source].index for flow in flows], dtype=np.int64)
+        self.flow_dest = np.array([self.sim.node_id_dict[flow.t_dest].index for flow in flows], dtype=np.int64)
+        self.flow_class = np.array([e_traffic_classes.index(flow.t_type) for flow in flows], dtype=np.int64)
+        self.flow_offset = np.array([float(flow.t_offset) for flow in flows])
+        self.flow_period = np.array([float(flow.t_period) if flow.t_type == "ST" else 1.0 for flow in flows])
+        self.flow_min_release = np.array([float(flow.t_min_release) if flow.t_type in ("Sporadic_Hard", "Sporadic_Soft") \
+                                          else 0.0 for flow in flows])
+        self.flow_deadline = np.array([int(flow.t_deadline) if flow.t_type != "BE" else -1 for flow in flows], dtype=np.int64)
+        self.st_flows = np.flatnonzero(self.flow_class == 0)
+        self.random_flows = np.flatnonzero(self.flow_class != 0)  # BE and sporadic roll a fire chance every tick
+        self.sporadic_flows = np.isin(self.flow_class[self.random_flows], (1, 2))
+
+        # next node of every switch for every destination ES, switches by index and ES by S + index (-1 for no route)
+        self.next_hop = np.full((self.S, self.E), -1, dtype=np.int64)
+        for s, switch_id in enumerate(self.sim.switch_ids):
+            switch = self.sim.node_id_dict[switch_id]
+            for e, es_id in enumerate(self.sim.es_ids):
+                next_node_id = switch.next_hop_table.get(es_id, switch.default_hop)
+                if next_node_id != -1:
+                    node = self.sim.node_id_dict[next_node_id]
+                    self.next_hop[s, e] = node.index if node.node_type != "End_Station" else self.S + node.index
+        self.es_parent = np.array([self.sim.node_id_dict[self.sim.node_id_dict[es].parent_id].index for es in self.sim.es_ids], \
+                                  dtype=np.int64)
+
+        # switch configuration of every scenario, from a copy of the simulation with the scenario settings applied
+        snapshot = pickle.dumps(self.sim, protocol=pickle.HIGHEST_PROTOCOL)
+        scenario_queues = []
+        scenario_gcls = []
+        self.flow_ticks = np.zeros((self.K, self.F), dtype=np.int64)
+        self.fire_chance = np.zeros((self.K, len(self.random_flows)))
+        self.emergency_chance = np.zeros(self.K)
+        for k, scenario in enumerate(self.scenarios):
+            scenario_sim = pickle.loads(snapshot)
+            if apply_scenario(scenario_sim, scenario) == 0:
+                print("ERROR: Could not apply scenario", k)
+                return 0
+
+            self.flow_ticks[k] = [math.ceil(int(flow.t_size) / scenario_sim.SENDING_SIZE_CAPCITY) for flow in flows]
+            self.fire_chance[k] = np.where(self.sporadic_flows, scenario_sim.SPORADIC_FIRE_CHANCE, scenario_sim.BE_FIRE_CHANCE)
+            self.emergency_chance[k] = scenario_sim.EMERGENCY_QUEUE_CHANCE
+
+            queues = []
+            gcls = []
+            for switch_id in scenario_sim.switch_ids:
+                queue_def = scenario_sim.node_id_dict[switch_id].queue_definition
+                queues.append([(0, queue_def.ST_count, queue_def.ST_schedule), \
+                               (1, queue_def.emergency_count, queue_def.emergency_schedule), \
+                               (2, queue_def.sporadic_hard_count, queue_def.sporadic_hard_schedule), \
+                               (3, queue_def.sporadic_soft_count, queue_def.sporadic_soft_schedule), \
+                               (4, queue_def.BE_count, queue_def.BE_schedule)])
+                gcls.append(queue_def.compiled_GCL)
+            scenario_queues.append(queues)
+            scenario_gcls.append(gcls)
+
+        # queues in the order cycle_queues() goes through them, which is also the order of their gates and of their priority
+        self.Q = max([sum([int(count) for queue_type, count, schedule in queues]) for scenario in scenario_queues \
+                      for queues in scenario] + [1])
+        self.queue_type = np.full((self.K, self.S, self.Q), -1, dtype=np.int64)
+        self.queue_edf = np.zeros((self.K, self.S, self.Q), dtype=bool)
+        for k in range(self.K):
+            for s in range(self.S):
+                q = 0
+                for queue_type, count, schedule in scenario_queues[k][s]:
+                    self.queue_type[k, s, q:q+int(count)] = queue_type
+                    self.queue_edf[k, s, q:q+int(count)] = (schedule == e_queue_schedules[1])
+                    q += int(count)
+
+        # gate bitmask of each switch on every tick of its GCL cycle
+        cycle_length = max([gcl.cycle_length for gcls in scenario_gcls for gcl in gcls] + [1])
+        self.gcl_states = np.zeros((self.K, self.S, cycle_length), dtype=np.int64)
+        self.gcl_cycles = np.ones((self.K, self.S), dtype=np.int64)
+        for k in range(self.K):
+            for s in range(self.S):
+                self.gcl_states[k, s, :scenario_gcls[k][s].cycle_length] = scenario_gcls[k][s].gate_states
+                self.gcl_cycles[k, s] = scenario_gcls[k][s].cycle_length
+        self.gate_bits = np.left_shift(1, np.arange(self.Q, dtype=np.int64))
+        self.class_queue_array = np.array(self.class_queue_types, dtype=np.int64)
+        self.scenario_index = np.arange(self.K)[:, None]
+
+        # packets. Rows of every scenario are handed out from its own stack of free rows
+        P = 1024
+        self.packet_flow = np.zeros((self.K, P), dtype=np.int64)
+        self.packet_created = np.zeros((self.K, P), dtype=np.int64)
+        self.packet_enter = np.zeros((self.K, P), dtype=np.int64)
+        self.free_rows = np.tile(np.arange(P-1, -1, -1, dtype=np.int64), (self.K, 1))
+        self.free_count = np.full(self.K, P, dtype=np.int64)
+
+        # ES egress queues (ring buffers) and busy counters
+        self.egress_rows = np.full((self.K, self.E, 8), -1, dtype=np.int64)
+        self.egress_head = np.zeros((self.K, self.E), dtype=np.int64)
+        self.egress_length = np.zeros((self.K, self.E), dtype=np.int64)
+        self.es_busy = np.zeros((self.K, self.E), dtype=np.int64)
+        self.previous_fire = np.zeros((self.K, len(self.random_flows)))  # 0 until a sporadic flow first fires
+
+        # switch ingress, packets wait here until the tick they are fully received
+        self.ingress_rows = np.full((self.K, self.S, 8), -1, dtype=np.int64)
+        # (scenario, switch, position) of the packets fully received on each tick, in a ring of buckets one per tick up to
+        #  the longest transmission time ahead
+        buckets = int(self.flow_ticks.max(initial=1)) + 1
+        self.calendar_k = np.zeros((buckets, 64), dtype=np.int64)
+        self.calendar_s = np.zeros((buckets, 64), dtype=np.int64)
+        self.calendar_slots = np.zeros((buckets, 64), dtype=np.int64)
+        self.calendar_count = np.zeros(buckets, dtype=np.int64)
+
+        # inner queues. A queue sends the packet with the smallest (deadline, arrival) key, the deadline is 0 for FIFO
+        self.queue_rows = np.full((self.K, self.S, self.Q, 8), -1, dtype=np.int64)
+        self.queue_deadlines = np.full((self.K, self.S, self.Q, 8), self.empty_key, dtype=np.int64)
+        self.queue_arrivals = np.full((self.K, self.S, self.Q, 8), self.empty_key, dtype=np.int64)
+        self.queue_lengths = np.zeros((self.K, self.S, self.Q), dtype=np.int64)
+        self.switch_queued = np.zeros((self.K, self.S), dtype=np.int64)  # packets in all inner queues of each switch
+        self.switch_busy = np.zeros((self.K, self.S), dtype=np.int64)
+        self.arrival_count = 0  # arrival order of packets into inner queues
+
+        # statistics, latency and queueing delay are counted per value
+        self.latency_counts = np.zeros((self.K, 256), dtype=np.int64)
+        self.queueing_counts = np.zeros((self.K, 256), dtype=np.int64)
+        self.packets_transmitted = np.zeros((self.K, self.S), dtype=np.int64)
+        self.total_queue_delay = np.zeros((self.K, self.S), dtype=np.int64)
+        self.min_slack = np.full(self.K, self.empty_key, dtype=np.int64)
+        self.deadline_misses = np.zeros(self.K, dtype=np.int64)
+        self.dropped = np.zeros(self.K, dtype=np.int64)
+
+        return 1
+
+
+    # function to make the last axis of the named array attributes at least the given size, filling new positions with fill
+    def grow(self, names, size, fill):
+        for name in names:
+            array = getattr(self, name)
+            if array.shape[-1] < size:
+                extra = np.full(array.shape[:-1] + (max(size, 2*array.shape[-1]) - array.shape[-1],), fill, dtype=array.dtype)
+                setattr(self, name, np.concatenate((array, extra), axis=-1))
+        return 1
+
+
+    # function to get the position of each item in its group, for a sorted array of group numbers
+    def get_group_ranks(self, groups):
+        positions = np.arange(len(groups))
+        starts = np.zeros(len(groups), dtype=np.int64)  # position of the first item of the group of each item
+        starts[1:] = np.where(groups[1:] != groups[:-1], positions[1:], 0)
+        return positions - np.maximum.accumulate(starts) if len(groups) != 0 else positions
+
+
+    # function to take a free packet row for each of the given (sorted) scenarios
+    def allocate_rows(self, k):
+        counts = np.bincount(k, minlength=self.K)
+        if (counts > self.free_count).any():  # more rows for every scenario
+            P = self.packet_flow.shape[1]
+            extra = max(P, int((counts - self.free_count).max()))
+            self.grow(("packet_flow", "packet_created", "packet_enter"), P+extra, 0)
+            self.grow(("free_rows",), P+extra, -1)
+            self.free_rows[self.scenario_index, self.free_count[:, None] + np.arange(extra)] = np.arange(P, P+extra)
+            self.free_count += extra
+
+        ranks = self.get_group_ranks(k)
+        rows = self.free_rows[k, self.free_count[k] - 1 - ranks]
+        self.free_count -= counts
+        return rows
+
+
+    # function to give packet rows back to their scenarios
+    def free_packet_rows(self, k, rows):
+        order = np.argsort(k, kind="stable")
+        k = k[order]
+        self.free_rows[k, self.free_count[k] + self.get_group_ranks(k)] = rows[order]
+        self.free_count += np.bincount(k, minlength=self.K)
+        return 1
+
+
+    # function to add each value to the counts of its scenario
+    def count_values(self, name, k, values):
+        counts = getattr(self, name)
+        if values.max() >= counts.shape[1]:
+            self.grow((name,), int(values.max())+1, 0)
+            counts = getattr(self, name)
+        np.add.at(counts, (k, values), 1)
+        return 1
+
+
+    # function to put packets sent this tick into the ingress of switch s of scenario k, they are fully received ticks later
+    def receive(self, k, s, rows, ticks):
+        if len(k) == 0:
+            return 0
+
+        self.packet_enter[k, rows] = self.timestamp+1  # seen by the switch next tick
+        order = np.argsort(k*self.S + s, kind="stable")
+        k, s, rows, ticks = k[order], s[order], rows[order], ticks[order]
+        ranks = self.get_group_ranks(k*self.S + s)
+
+        free = self.ingress_rows[k, s] == -1
+        if (ranks >= free.sum(axis=1)).any():
+            self.grow(("ingress_rows",), self.ingress_rows.shape[2] + int(ranks.max()) + 1, -1)
+            free = self.ingress_rows[k, s] == -1
+        slots = np.argsort(~free, axis=1, kind="stable")[np.arange(len(k)), ranks]
+        self.ingress_rows[k, s, slots] = rows
+
+        # add them to the calendar bucket of the tick they are fully received on
+        buckets = (self.timestamp + ticks) % len(self.calendar_count)
+        order = np.argsort(buckets, kind="stable")
+        buckets = buckets[order]
+        positions = self.calendar_count[buckets] + self.get_group_ranks(buckets)
+        if positions.max() >= self.calendar_k.shape[1]:
+            self.grow(("calendar_k", "calendar_s", "calendar_slots"), int(positions.max())+1, 0)
+        self.calendar_k[buckets, positions] = k[order]
+        self.calendar_s[buckets, positions] = s[order]
+        self.calendar_slots[buckets, positions] = slots[order]
+        self.calendar_count += np.bincount(buckets, minlength=len(self.calendar_count))
+        return 1
+
+
+    # function to generate the packets of every flow that fires this tick into the egress of its ES
+    def generate(self):
+        t = self.timestamp
+        fire = np.zeros((self.K, self.F), dtype=bool)
+
+        st_fire = (t >= self.flow_offset[self.st_flows]) & \
+                  (np.mod(t - self.flow_offset[self.st_flows], self.flow_period[self.st_flows]) == 0)
+        fire[:, self.st_flows[st_fire]] = True
+
+        if len(self.random_flows) != 0:
+            allowed = (t >= self.flow_offset[self.random_flows]) & \
+                      ( (~self.sporadic_flows) | (self.previous_fire == 0) | \
+                        (t - self.previous_fire >= self.flow_min_release[self.random_flows]) )
+            random_fire = allowed & (self.rng.random(allowed.shape) < self.fire_chance)
+            self.previous_fire[random_fire & self.sporadic_flows] = t
+            fire[:, self.random_flows] = random_fire
+
+        k, f = np.nonzero(fire)  # sorted by scenario then flow, so by ES then flow within each scenario
+        if len(k) == 0:
+            return 0
+        rows = self.allocate_rows(k)
+        self.packet_flow[k, rows] = f
+        self.packet_created[k, rows] = t
+
+        # add them to the end of their ES egress ring, unrolling the rings into larger ones if any would overflow
+        e = self.flow_es[f]
+        ranks = self.get_group_ranks(k*self.E + e)
+        size = self.egress_rows.shape[2]
+        needed = int((self.egress_length[k, e] + ranks).max()) + 1
+        if needed > size:
+            unrolled = np.take_along_axis(self.egress_rows, (self.egress_head[:, :, None] + np.arange(size)) % size, axis=2)
+            self.egress_rows = np.full((self.K, self.E, max(needed, 2*size)), -1, dtype=np.int64)
+            self.egress_rows[:, :, :size] = unrolled
+            self.egress_head[:] = 0
+            size = self.egress_rows.shape[2]
+        self.egress_rows[k, e, (self.egress_head[k, e] + self.egress_length[k, e] + ranks) % size] = rows
+        self.egress_length += np.bincount(k*self.E + e, minlength=self.K*self.E).reshape(self.K, self.E)
+        return 1
+
+
+    # function to move every packet fully received this tick from switch ingress into an inner queue
+    # packets arriving at a switch on the same tick are taken in a random order, each into the smallest queue of its type
+    #  at that point (the first on ties). So the n-th packet of a type takes the n-th smallest (length, queue) place over
+    #  the queues of that type, which places every packet of every scenario at once
+    def ingress(self):
+        bucket = self.timestamp % len(self.calendar_count)
+        count = self.calendar_count[bucket]
+        if count == 0:
+            return 0
+        k, s, slots = self.calendar_k[bucket, :count], self.calendar_s[bucket, :count], self.calendar_slots[bucket, :count]
+        self.calendar_count[bucket] = 0
+
+        order = np.lexsort((self.rng.random(count), k*self.S + s))
+        k, s, slots = k[order], s[order], slots[order]
+        rows = self.ingress_rows[k, s, slots]
+        self.ingress_rows[k, s, slots] = -1
+
+        # queue type of each packet, ST has a chance to go to the Emergency queue instead
+        classes = self.flow_class[self.packet_flow[k, rows]]
+        queue_types = self.class_queue_array[classes]
+        st = np.flatnonzero(classes == 0)
+        queue_types[st] = np.where(self.rng.random(len(st)) < self.emergency_chance[k[st]], 1, 0)
+
+        # position of each packet among the packets of its type into its switch, then its place over those queues
+        groups = (k*self.S + s)*len(e_queue_type_names) + queue_types
+        by_group = np.argsort(groups, kind="stable")
+        ranks = np.empty(count, dtype=np.int64)
+        ranks[by_group] = self.get_group_ranks(groups[by_group])
+        levels = self.queue_lengths[k, s][:, :, None] + np.arange(int(ranks.max())+1)
+        places = np.where((self.queue_type[k, s] == queue_types[:, None])[:, :, None], \
+                          levels*self.Q + np.arange(self.Q)[:, None], self.empty_key).reshape(count, -1)
+        places.sort(axis=1)
+        places = places[np.arange(count), ranks]
+        q = places % self.Q
+        missing = places == self.empty_key
+        if missing.any():  # no queue of its type
+            np.add.at(self.dropped, k[missing], 1)
+            self.free_packet_rows(k[missing], rows[missing])
+            k, s, q, rows = k[~missing], s[~missing], q[~missing], rows[~missing]
+
+        # a free position in the queue for each packet, the n-th packet into a queue takes its n-th free position
+        groups = (k*self.S + s)*self.Q + q
+        by_group = np.argsort(groups, kind="stable")
+        ranks = np.empty(len(k), dtype=np.int64)
+        ranks[by_group] = self.get_group_ranks(groups[by_group])
+        if (self.queue_lengths[k, s, q] + ranks >= self.queue_rows.shape[3]).any():
+            size = int((self.queue_lengths[k, s, q] + ranks).max()) + 1
+            self.grow(("queue_rows",), size, -1)
+            self.grow(("queue_deadlines", "queue_arrivals"), size, self.empty_key)
+        slots = np.argsort(self.queue_rows[k, s, q] != -1, axis=1, kind="stable")[np.arange(len(k)), ranks]
+
+        flows = self.packet_flow[k, rows]
+        deadlines = np.where(self.flow_class[flows] != 3, self.packet_created[k, rows] + self.flow_deadline[flows], 0)
+        self.queue_rows[k, s, q, slots] = rows
+        self.queue_deadlines[k, s, q, slots] = np.where(self.queue_edf[k, s, q], deadlines, 0)
+        self.queue_arrivals[k, s, q, slots] = self.arrival_count + np.arange(len(k))
+        self.arrival_count += len(k)
+        np.add.at(self.queue_lengths, (k, s, q), 1)
+        np.add.at(self.switch_queued, (k, s), 1)
+
+        return 1
+
+
+    # function to send a packet from every switch that is free and has a packet in a queue with an open gate
+    # queues are picked in the order of their gates, which is also strict priority order
+    def egress(self):
+        t = self.timestamp
+        np.maximum(self.switch_busy - 1, 0, out=self.switch_busy)
+
+        # only free switches with packets queued need their gates checked
+        k, s = np.nonzero((self.switch_busy == 0) & (self.switch_queued > 0))
+        gate_states = self.gcl_states[k, s, t % self.gcl_cycles[k, s]]
+        eligible = ((gate_states[:, None] & self.gate_bits) != 0) & (self.queue_lengths[k, s] > 0)
+        sending = eligible.any(axis=1)
+        k, s, eligible = k[sending], s[sending], eligible[sending]
+        if len(k) == 0:
+            return 0
+        q = np.argmax(eligible, axis=1)
+
+        # packet with the smallest (deadline, arrival) key in each queue
+        deadlines = self.queue_deadlines[k, s, q]
+        arrivals = np.where(deadlines == deadlines.min(axis=1)[:, None], self.queue_arrivals[k, s, q], self.empty_key)
+        slots = np.argmin(arrivals, axis=1)
+        rows = self.queue_rows[k, s, q, slots]
+        self.queue_rows[k, s, q, slots] = -1
+        self.queue_deadlines[k, s, q, slots] = self.empty_key
+        self.queue_arrivals[k, s, q, slots] = self.empty_key
+        self.queue_lengths[k, s, q] -= 1
+        self.switch_queued[k, s] -= 1
+
+        queue_delays = t - self.packet_enter[k, rows]
+        self.count_values("queueing_counts", k, queue_delays)
+        self.packets_transmitted[k, s] += 1
+        self.total_queue_delay[k, s] += queue_delays
+
+        flows = self.packet_flow[k, rows]
+        ticks = self.flow_ticks[k, flows]
+        self.switch_busy[k, s] = ticks
+        next_nodes = self.next_hop[s, self.flow_dest[flows]]
+
+        to_switch = (next_nodes >= 0) & (next_nodes < self.S)
+        self.receive(k[to_switch], next_nodes[to_switch], rows[to_switch], ticks[to_switch])
+        to_es = next_nodes >= self.S
+        self.deliver(k[to_es], rows[to_es], flows[to_es], ticks[to_es])
+        no_route = next_nodes == -1
+        if no_route.any():
+            np.add.at(self.dropped, k[no_route], 1)
+            self.free_packet_rows(k[no_route], rows[no_route])
+
+        return 1
+
+
+    # function to record the latency of packets reaching their destination ES this tick and free their rows
+    def deliver(self, k, rows, flows, ticks):
+        if len(k) == 0:
+            return 0
+
+        latencies = self.timestamp - self.packet_created[k, rows] + ticks
+        self.count_values("latency_counts", k, latencies)
+        has_deadline = self.flow_class[flows] != 3
+        slack = self.flow_deadline[flows[has_deadline]] - latencies[has_deadline]
+        np.minimum.at(self.min_slack, k[has_deadline], slack)
+        np.add.at(self.deadline_misses, k[has_deadline], (slack < 0).astype(np.int64))
+        self.free_packet_rows(k, rows)
+        return 1
+
+
+    # function to send the first packet in the egress of every ES that is free to its parent switch
+    def flush_egress(self):
+        np.maximum(self.es_busy - 1, 0, out=self.es_busy)
+        k, e = np.nonzero((self.es_busy == 0) & (self.egress_length > 0))
+        if len(k) == 0:
+            return 0
+
+        rows = self.egress_rows[k, e, self.egress_head[k, e]]
+        self.egress_head[k, e] = (self.egress_head[k, e] + 1) % self.egress_rows.shape[2]
+        self.egress_length[k, e] -= 1
+        ticks = self.flow_ticks[k, self.packet_flow[k, rows]]
+        self.es_busy[k, e] = ticks
+        self.receive(k, self.es_parent[e], rows, ticks)
+        return 1
+
+
+    # function to simulate every scenario until the timestamp reaches max_timestamp-1, like the TICK engine
+    def run(self, max_timestamp):
+        while self.timestamp < max_timestamp-1:
+            self.generate()
+            self.ingress()
+            self.egress()
+            self.flush_egress()
+            self.timestamp += 1
+        return 1
+
+
+    # returns the SWEEP_STATISTICS of every scenario, in order
+    def get_summaries(self):
+        summaries = []
+        for k in range(self.K):
+            latency_stats = Streaming_Stats()
+            for value in np.flatnonzero(self.latency_counts[k]):
+                latency_stats.add_count(value, self.latency_counts[k, value])
+            queueing_stats = Streaming_Stats()
+            for value in np.flatnonzero(self.queueing_counts[k]):
+                queueing_stats.add_count(value, self.queueing_counts[k, value])
+
+            status = "done" if self.deadline_misses[k] == 0 else "missed "+str(self.deadline_misses[k])+" deadlines"
+            min_slack = int(self.min_slack[k]) if self.min_slack[k] != self.empty_key else ""
+            summaries.append(get_summary(status, latency_stats, queueing_stats, int(self.packets_transmitted[k].sum()), min_slack))
+        return summaries
+
+
+# function to give a copy of a loaded simulation the settings of a scenario (a dict of SCENARIO_SETTINGS)
+# returns 0 if the scenario has other settings or its files could not be applied
+def apply_scenario(scenario_sim, scenario):
+
+    for name in scenario:
+        if name not in SCENARIO_SETTINGS:
+            print("ERROR: Setting", "\""+str(name)+"\"", "can not differ between scenarios")
+            return 0
+        setattr(scenario_sim, name, scenario[name])
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        applied = apply_variant(scenario_sim, scenario_sim.queue_definition_file, scenario.get("GCL_file", ""), \
+                                scenario_sim.QUEUE_SCHEDULES)
+    if applied == 0:
+        print(output.getvalue())
+    return applied
+
+
+# function to simulate each scenario on its own copy of the loaded simulation with its SIM_ENGINE, one after another
+# every copy gets the random streams of the replica numbered after its scenario, so scenarios draw independent numbers
+#  as they do in the SCENARIO engine. Returns the SWEEP_STATISTICS of every scenario, or 0 if one could not be set up
+def run_separate_scenarios(sim, scenarios, max_timestamp):
+
+    if sim.RANDOM_SEED is None:
+        sim.RANDOM_SEED = random.SystemRandom().getrandbits(128)
+    snapshot = pickle.dumps(sim, protocol=pickle.HIGHEST_PROTOCOL)
+
+    summaries = []
+    for k, scenario in enumerate(scenarios):
+        scenario_sim = pickle.loads(snapshot)
+        scenario_sim.split_random_streams(k)
+        if apply_scenario(scenario_sim, scenario) == 0:
+            print("ERROR: Could not apply scenario", k)
+            return 0
+
+        # the run stops at the first missed deadline, where the SCENARIO engine counts them and carries on
+        status = "done"
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            try:
+                if scenario_sim.run(max_timestamp-1 - scenario_sim.timestamp) == 0:
+                    status = "stopped"
+            except SystemExit:
+                status = "missed a deadline"
+        summaries.append(get_sweep_summary(scenario_sim, status))
+
+    return summaries
+
+
+# function to simulate every scenario (a dict of SCENARIO_SETTINGS) of the loaded simulation up to the tick before
+#  max_timestamp, and write a row of SWEEP_STATISTICS per scenario to the _out_scenarios.csv file. Returns 0 if the
+#  scenarios could not be set up or any scenario did not finish (its Status is not "done")
+# at least SCENARIO_MIN_BATCH scenarios run together in the SCENARIO engine, fewer run one after another
+def run_scenarios(sim, scenarios, max_timestamp):
+
+    if len(scenarios) < SCENARIO_MIN_BATCH:
+        print("Running", len(scenarios), "scenarios one after another from tick", sim.timestamp)
+        summaries = run_separate_scenarios(sim, scenarios, max_timestamp)
+        if summaries == 0:
+            return 0
+
     else:
-        switch_ids.append(node_id)  # if not ES then node is Switch
+        if np is None:
+            print("ERROR: The SCENARIO engine needs NumPy")
+            return 0
 
+        engine = Scenario_Engine(sim, scenarios)
+        if engine.valid == 0:
+            return 0
+        print("Running", engine.K, "scenarios from tick", engine.timestamp)
+        engine.run(max_timestamp)
+        summaries = engine.get_summaries()
+        for k in range(engine.K):
+            if engine.dropped[k] != 0:
+                print("WARNING: Scenario", k, "dropped", engine.dropped[k], "packets with no queue or route")
+
+    columns = sorted(set([name for scenario in scenarios for name in scenario]))
+    rows = []
+    for k, summary in enumerate(summaries):
+        rows.append([k] + [scenarios[k].get(name, getattr(sim, name)) for name in columns] + summary)
+
+    scenarios_file = open(sim.files_directory+sim.prefix+"_out_scenarios.csv", "w", newline='')
+    writer_s = csv.writer(scenarios_file)
+    writer_s.writerow(["Scenario"] + columns + list(SWEEP_STATISTICS))  # headings
+    for row in rows:
+        writer_s.writerow(row)
+    scenarios_file.close()
+
+    failed = len([summary for summary in summaries if summary[0] != "done"])
+    if failed != 0:
+        print("WARNING:", failed, "of", len(summaries), "scenarios did not finish")
+        return 0
+    return 1
 
-## Begin Simulator
-# timestamp initialised at top of file
-if MAX_TIMESTAMP == 0:
-    MAX_TIMESTAMP = gen_utils.get_int_descision("How many ticks should the simulator run for?", 0)
 
-for tick in range(1, MAX_TIMESTAMP):
 
-    # first set GCL to timestamp
-    if g_timestamp in g_offline_GCL:  # if time is present, update state, else we are in a range so leave it
-        # TODO : somehow incorperate active GCL into this unless that is just for emergency queue
-        g_current_GCL_state = g_offline_GCL[g_timestamp]  # change state
 
-        # if we have reached the bottom of the GCL, start again from the top
-        if g_current_GCL_state == "REPEAT":
-            new_gcl = {}
-            for timestamp in g_original_GCL:  # create new keys of now + original_GCL_entry, to simulate restart of list
-                new_gcl[int(timestamp)+int(g_timestamp)] = g_original_GCL[timestamp]
+##################################################
+################ SIMULATION CLASS ################
+##################################################
 
-            # make this new gcl the official g_offline_GCL to preserve the g_timestamp
-            g_offline_GCL = new_gcl
-            g_current_GCL_state = g_offline_GCL[g_timestamp]  # change state
+# a single simulation of a network: its nodes, clock, GCLs, engine state and statistics, and the settings it runs with
+# settings default to the USER SETTINGS and can be changed per simulation, so a driver can import this file and load,
+#  run and compare any number of simulations in one process
+class Simulation():
+
+    # USER SETTINGS every simulation has its own copy of
+    setting_names = ("MAX_NODE_COUNT", "SIM_DEBUG", "SIM_ENGINE", "USE_PACKET_STORE", "PACKET_STORE_CAPACITY", \
+                     "RELEASE_CALENDAR_CHUNK", "WRITE_PACKET_TRACE", "PACKET_TRACE_FORMAT", "PACKET_TRACE_COMPRESSION", \
+                     "PACKET_TRACE_CHUNK", "PACKET_TRACE_THREAD", "PACKET_TRACE_QUEUE_SIZE", "KEEP_RAW_DELAYS", \
+                     "GEOMETRIC_RELEASES", "FORK_VARIANTS", "LOCKSTEP_VARIANTS", "QUEUE_SCHEDULES", "WRITE_CHECKPOINTS", "CHECKPOINT_INTERVAL", \
+                     "RANDOM_SEED", "REPLICA", \
+                     "SENDING_SIZE_CAPCITY", "BE_FIRE_CHANCE", "SPORADIC_FIRE_CHANCE", "EMERGENCY_QUEUE_CHANCE", \
+                     "files_directory", "prefix", "network_topo_file", "queue_definition_file", "GCL_file", \
+                     "traffic_definition_file", "traffic_mapping_file")
+
+    # settings is a dict of setting name to value for any settings that differ from the USER SETTINGS
+    def __init__(self, settings=None):
+        for name in self.setting_names:
+            setattr(self, name, globals()[name])
+        if settings is not None:
+            for name in settings:
+                if name not in self.setting_names:
+                    print("ERROR: Unrecognised simulation setting", "\""+str(name)+"\"")
+                    continue
+                setattr(self, name, settings[name])
+        if( (self.REPLICA != -1) and (self.RANDOM_SEED is None) ):  # replica streams are spawned from a seed so need one
+            self.RANDOM_SEED = random.SystemRandom().getrandbits(128)
+        self.random = self.get_random_stream(-1)  # random numbers of the simulation that do not belong to a node
+
+        # network
+        self.timestamp = 0
+        self.generic_traffics_dict = {}  # dictionary of generic traffic rules from file - key is ID
+        self.node_id_dict = {}  # key is node id, value is node object
+        self.es_ids = []  # ES IDs in the order they are simulated
+        self.switch_ids = []  # switch IDs (including the controller) in the order they are simulated
+        self.offline_GCL = {}  # global GCL, key is timestamp, value is the gate state at that timestamp
+        self.compiled_GCL = -1  # Compiled_GCL built from offline_GCL, used by every switch without its own GCL
+        self.loaded_GCLs = {}  # key is GCL filename, value is (gcl_dict, Compiled_GCL) so each file is only parsed once
+        self.compiled_GCLs = {}  # key is tuple of GCL entries, value is its Compiled_GCL so switches with identical GCLs share one
+
+        # engine
+        self.event_queue = []  # heap of (timestamp, node_id, event_type) used by the EVENT engine
+        self.events_scheduled = False  # set once the EVENT engine has queued the first release of every ES
+        self.active_es_egress = set()  # IDs of ES with packets in egress or still busy sending, only these get flushed
+        self.active_es_ingress = set()  # IDs of ES with packets in ingress, only these get digested
+        self.active_switch_ingress = set()  # IDs of switches with packets in ingress, only these get ingressed
+        self.active_switch_queues = set()  # IDs of switches with packets queued or still busy sending, only these get cycled and egressed
+        self.packet_store = -1  # Packet_Store holding every packet in flight when USE_PACKET_STORE is set
+
+        # statistics and outputs
+        self.latency_stats = Streaming_Stats()  # every packet latency
+        self.queueing_stats = Streaming_Stats()  # every queueing delay
+        self.latency_breakdown = Latency_Breakdown()  # every packet latency and deadline slack
+        self.packet_latencies = []  # every packet latency, only used with KEEP_RAW_DELAYS
+        self.queueing_delays = []  # every queueing delay, only used with KEEP_RAW_DELAYS
+        self.packet_trace = -1  # Packet_Trace every delivered packet is written to when WRITE_PACKET_TRACE is set (not during a warm-up)
+        self.trace_checkpoint = -1  # state of the packet trace when the simulation was checkpointed, to continue it from
+        self.checkpoint_requested = False  # set by Ctrl+C when WRITE_CHECKPOINTS is set, the engine saves a checkpoint and stops
+
+
+    # parses the input files into the simulation and gets it ready to run. Files left as -1 are taken from the settings
+    # returns 0 if the files could not be parsed
+    def load(self, network_topo_file=-1, queue_definition_file=-1, GCL_file=-1, traffic_definition_file=-1, \
+             traffic_mapping_file=-1):
+
+        if network_topo_file != -1:
+            self.network_topo_file = network_topo_file
+        if queue_definition_file != -1:
+            self.queue_definition_file = queue_definition_file
+        if GCL_file != -1:
+            self.GCL_file = GCL_file
+        if traffic_definition_file != -1:
+            self.traffic_definition_file = traffic_definition_file
+        if traffic_mapping_file != -1:
+            self.traffic_mapping_file = traffic_mapping_file
+
+        # parse files
+        if bullk_parse(self, self.network_topo_file, self.queue_definition_file, self.GCL_file, self.traffic_definition_file, \
+                       self.traffic_mapping_file) == 0:
+            return 0
 
+        ## Get list of ES and Switch IDs
+        for node_id in self.node_id_dict:
+            if self.node_id_dict[node_id].node_type == "End_Station":
+                self.node_id_dict[node_id].index = len(self.es_ids)
+                self.es_ids.append(node_id)
+            else:
+                self.node_id_dict[node_id].index = len(self.switch_ids)
+                self.switch_ids.append(node_id)  # if not ES then node is Switch
 
-    # check each ES for traffic to send based on its traffic sending rules
-    for es in es_ids:
-        g_node_id_dict[es].check_to_generate()
+        if self.USE_PACKET_STORE:
+            self.packet_store = Packet_Store(self, self.PACKET_STORE_CAPACITY)
 
-    # ingress packets from every queue
-    for switch in switch_ids:
-        g_node_id_dict[switch].ingress_packets()
+        return 1
 
-    # cycle the inner queues of every switch
-    for switch in switch_ids:
-        g_node_id_dict[switch].cycle_queues()
 
-    # send packets from egress section of every queue
-    for switch in switch_ids:
-        g_node_id_dict[switch].egress_packets()
+    # simulates the given number of ticks on from the current timestamp. Returns 0 if it was stopped early by Ctrl+C
+    def run(self, ticks):
+        return run_engine(self, self.timestamp+ticks+1)
+
+
+    # returns the results so far as a dict of plain values and Streaming_Stats, without printing or writing any files
+    def results(self):
+        return {"timestamp": self.timestamp, \
+                "es_count": len(self.es_ids), \
+                "switch_count": len(self.switch_ids), \
+                "latency": self.latency_stats, \
+                "queueing_delay": self.queueing_stats, \
+                "latency_breakdown": self.latency_breakdown.get_rows(), \
+                "packets_transmitted": dict([(sw, self.node_id_dict[sw].packets_transmitted) for sw in self.switch_ids]), \
+                "average_queue_delay": dict([(sw, self.node_id_dict[sw].average_queue_delay) for sw in self.switch_ids])}
+
+
+    # returns the random stream of the given node ID (-1 for the simulation itself). Without a REPLICA every stream is
+    #  the same one. A replica spawns an independent stream for each key from RANDOM_SEED, REPLICA and the key
+    def get_random_stream(self, key):
+        if self.REPLICA == -1:
+            return self.random if key != -1 else random.Random(self.RANDOM_SEED)
+        return random.Random(get_stream_seed(self.RANDOM_SEED, self.REPLICA, key))
+
+
+    # gives every node its own random stream of the given replica from the current state on, as a simulation made with
+    #  that REPLICA has. Copies of a simulation split with the same RANDOM_SEED and replica draw the same numbers
+    def split_random_streams(self, replica):
+        self.REPLICA = replica
+        self.random = self.get_random_stream(-1)
+        for node_id in self.node_id_dict:
+            self.node_id_dict[node_id].random = self.get_random_stream(node_id)
+        for es_id in self.es_ids:
+            for flow in self.node_id_dict[es_id].flows:
+                flow.random = self.node_id_dict[es_id].random
+        return 1
 
-    # send packets in end station egress queues and digest any packets that are in the ingress queue
-    for es in es_ids:
-        g_node_id_dict[es].flush_egress()
-        g_node_id_dict[es].digest_packets()
 
+    def get_checkpoint_filename(self):
+        return self.files_directory+self.prefix+"_checkpoint.pkl.gz"
 
-    g_timestamp += 1
 
+    # SIGINT handler, asks the engine to save a checkpoint and stop once the current tick is done
+    # a second Ctrl+C stops straight away
+    def request_checkpoint(self, signal_number, frame):
+        self.checkpoint_requested = True
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        print("\nStopping after this tick to save a checkpoint. Press Ctrl+C again to stop without one")
+        return 1
 
 
-## Output
+    # pickled for checkpoints and variant snapshots. The open packet trace is written out and only its state is kept
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["trace_checkpoint"] = self.packet_trace.checkpoint() if self.packet_trace != -1 else -1
+        state["packet_trace"] = -1
+        state["checkpoint_requested"] = False
+        return state
 
-# formatting
-print()
-print()
 
-# display some useful metrics
-print("ES Count:", len(es_ids))
-print("SW Count:", len(switch_ids))
-print()
 
-# print actual output values
-print("OUTPUTS:")
-print()
 
-# print packets transmitted per switch
-print("Packets transmitted per Switch:")
-for sw in switch_ids:
-    print("SW ID:", sw, "packets transmitted:", g_node_id_dict[sw].packets_transmitted)
-print()
+##################################################
+################# SIMULATOR CODE #################
+##################################################
 
-# print packet latencies
-if SIM_DEBUG:
-    print("Packet Latencies:\n ", g_packet_latencies)  # if in debug, print individual latencies
-print("Average Packet Latencies = "+str(sum(g_packet_latencies)/len(g_packet_latencies)))
-print()
+# function to run the simulator from the USER SETTINGS, as when this file is run directly. Returns the Simulation
+#  (or 1 after a sweep, replications or scenarios, which exit with 1 if any of their runs did not finish)
+def main():
+
+    # simulate every sweep point in parallel instead of a single run
+    if( (len(SWEEP_GRID) != 0) or (len(SWEEP_POINTS) != 0) ):
+        sweep_points = get_sweep_points(SWEEP_GRID, SWEEP_POINTS)
+        if sweep_points == 0:
+            print("CRITICAL ERROR: Failed to set up sweep")
+            exit(1)
+        max_timestamp = MAX_TIMESTAMP
+        if max_timestamp == 0:
+            max_timestamp = gen_utils.get_int_descision("How many ticks should the simulator run for?", 0)
+        if run_sweep(sweep_points, max_timestamp, SWEEP_WORKERS) == 0:
+            print("CRITICAL ERROR: Not every sweep point finished")
+            exit(1)
+        return 1
 
-# print packet queueing delays
-if SIM_DEBUG:
-    print("Global packet queueing delays:\n ", g_queueing_delays)  # if in debug, print individual queueing delays
-print("Average Queue Delays per Switch:")
-for sw in switch_ids:
-    print("SW ID:", sw, "average packet queueing delay:", g_node_id_dict[sw].average_queue_delay)
+    # or simulate independent replicas in parallel
+    if REPLICATIONS > 0:
+        max_timestamp = MAX_TIMESTAMP
+        if max_timestamp == 0:
+            max_timestamp = gen_utils.get_int_descision("How many ticks should the simulator run for?", 0)
+        if run_replications(REPLICATIONS, max_timestamp, SWEEP_WORKERS) == 0:
+            print("CRITICAL ERROR: Not every replica finished")
+            exit(1)
+        return 1
 
+    # continue from a checkpoint instead of parsing the files. Its settings that change results replace the USER SETTINGS
+    if RESUME_CHECKPOINT != "":
+        sim = load_checkpoint(RESUME_CHECKPOINT)
+        if sim == 0:
+            print("CRITICAL ERROR: Failed to load checkpoint")
+            exit(1)
+        print("Resuming from checkpoint", "\""+str(RESUME_CHECKPOINT)+"\"", "at tick", sim.timestamp)
 
+    else:
+        sim = Simulation()
+        if sim.load() == 0:
+            print("CRITICAL ERROR: Failed to parse files")
+            exit(1)
+    print()
 
-## export to file
-# latencies
-latencies_file = open(files_directory+prefix+"_out_packet_latencies.csv", "w", newline='')
-writer_l = csv.writer(latencies_file)
-writer_l.writerow(["Packet_Latency_(Ticks)"])  # heading
-for latency in g_packet_latencies:
-    writer_l.writerow([latency])
-latencies_file.close()
 
-# queueing delays
-queueing_file = open(files_directory+prefix+"_out_queueing_delays.csv", "w", newline='')
-writer_q = csv.writer(queueing_file)
-writer_q.writerow(["Queueing_Delay_(Ticks)"])  # heading
-for latency in g_packet_latencies:
-    writer_q.writerow([latency])
-queueing_file.close()
+    ## Begin Simulator
+    max_timestamp = MAX_TIMESTAMP
+    if max_timestamp == 0:
+        max_timestamp = gen_utils.get_int_descision("How many ticks should the simulator run for?", 0)
 
-# average delays per switch
-avg_queueing_file = open(files_directory+prefix+"_out_average_queueing_delays.csv", "w", newline='')
-writer_aq = csv.writer(avg_queueing_file)
-writer_aq.writerow(["Switch_(ID)", "Average_Queueing_Delay_(Ticks)"])  # headings
-for sw in switch_ids:
-    writer_aq.writerow([sw, g_node_id_dict[sw].average_queue_delay])
-avg_queueing_file.close()
+    # simulate every scenario of the network together
+    if len(SCENARIOS) != 0:
+        if run_scenarios(sim, SCENARIOS, max_timestamp) == 0:
+            print("CRITICAL ERROR: Not every scenario finished")
+            exit(1)
+        return 1
+
+    if sim.WRITE_CHECKPOINTS:
+        signal.signal(signal.SIGINT, sim.request_checkpoint)
+
+    # warm up once then run every variant on from the end of the warm-up
+    if( (len(VARIANTS) != 0) and (sim.timestamp <= WARMUP_TIMESTAMP) ):
+        if sim.run(WARMUP_TIMESTAMP - sim.timestamp) == 0:
+            finish_stopped_run(sim)
+            exit(1)
+        if run_variants(sim, VARIANTS, max_timestamp) == 0:
+            print("CRITICAL ERROR: Not every variant finished")
+            exit(1)
+
+    # or simulate a single run, up to the tick before max_timestamp
+    else:
+        if sim.WRITE_PACKET_TRACE:
+            open_packet_trace(sim, sim.trace_checkpoint)
+        if sim.run(max_timestamp-1 - sim.timestamp) == 0:
+            finish_stopped_run(sim)
+            exit(1)
+
+        output_results(sim)
+
+    if 0:
+        print_demo(sim)
+
+    return sim
+
+
+
+
+##################################################
+################## COMMAND LINE ##################
+##################################################
+
+# USER SETTINGS only main() reads, every other one belongs to Simulation.setting_names
+main_setting_names = ("MAX_TIMESTAMP", "WARMUP_TIMESTAMP", "VARIANTS", "SWEEP_GRID", "SWEEP_POINTS", "SWEEP_WORKERS", \
+                      "REPLICATIONS", "CONFIDENCE_LEVEL", "SCENARIOS", "SCENARIO_MIN_BATCH", "RESUME_CHECKPOINT")
+
+# (flag, USER SETTING it sets, argparse options) of the named flags. Any USER SETTING can be given with --set
+cli_flags = (("--files-directory", "files_directory", {"help": "directory outputs and generated files are written to"}), \
+             ("--prefix", "prefix", {"help": "prefix of every output file name"}), \
+             ("--topology", "network_topo_file", {"help": "network topology file"}), \
+             ("--queue-definition", "queue_definition_file", {"help": "queue definition file"}), \
+             ("--gcl", "GCL_file", {"help": "global GCL file"}), \
+             ("--traffic-definition", "traffic_definition_file", {"help": "traffic definition file"}), \
+             ("--traffic-mapping", "traffic_mapping_file", {"help": "traffic mapping file"}), \
+             ("--ticks", "MAX_TIMESTAMP", {"type": int, "help": "number of ticks to simulate"}), \
+             ("--seed", "RANDOM_SEED", {"type": int, "help": "seed of the random numbers"}), \
+             ("--engine", "SIM_ENGINE", {"choices": e_sim_engines, "help": "simulator engine"}), \
+             ("--resume", "RESUME_CHECKPOINT", {"help": "checkpoint file to continue from"}))
+
+
+# USER SETTINGS naming an input file every simulation reads, a missing one prompts to make or look for another
+input_file_settings = ("network_topo_file", "queue_definition_file", "GCL_file", "traffic_definition_file", "traffic_mapping_file")
+
+
+# function to list the (setting name, filename) of every input file main() would read with the USER SETTINGS: those of
+#  each sweep point, or the checkpoint to resume from, and the files of any VARIANTS and SCENARIOS
+def get_input_files():
+
+    files = []
+    if( (len(SWEEP_GRID) != 0) or (len(SWEEP_POINTS) != 0) ):
+        with contextlib.redirect_stdout(io.StringIO()):  # invalid points are reported when the sweep is set up
+            runs = get_sweep_points(SWEEP_GRID, SWEEP_POINTS)
+        runs = runs if runs != 0 else []
+    elif( (REPLICATIONS > 0) or (RESUME_CHECKPOINT == "") ):
+        runs = [{}]
+    else:
+        files.append(("RESUME_CHECKPOINT", RESUME_CHECKPOINT))
+        runs = []
+
+    for settings in runs:
+        for name in input_file_settings:
+            files.append((name, settings.get(name, globals()[name])))
+    for variant in VARIANTS:
+        files += [("VARIANTS", filename) for filename in variant[1:3] if filename != ""]
+    for scenario in SCENARIOS:
+        files += [(name, scenario[name]) for name in ("queue_definition_file", "GCL_file") if name in scenario]
+
+    return files
+
+
+def get_cli_parser():
+    parser = argparse.ArgumentParser(description="Simulate a TSN network from the USER SETTINGS, with any of them replaced " \
+                                                 "by these arguments. Exits with 0 when the simulation finished, 1 when it " \
+                                                 "failed and 2 for bad or missing input")
+    parser.add_argument("--config", help="JSON file of USER SETTING name -> value, applied before every other argument")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE", \
+                        help="set any USER SETTING, VALUE is JSON (plain strings need no quotes). Can be repeated")
+    for flag, name, options in cli_flags:
+        parser.add_argument(flag, dest=name, **options)
+    parser.add_argument("--interactive", action="store_true", \
+                        help="prompt for anything missing as a run without arguments does, instead of failing")
+    return parser
+
+
+# function to replace USER SETTINGS with the given dict of setting name -> value
+# values must have the type of the setting, any number for a number and any value where the setting is None
+# returns 0 without changing anything if a name or value is not valid
+def set_user_settings(settings):
+
+    valid = 1
+    for name, value in settings.items():
+        if( (name not in Simulation.setting_names) and (name not in main_setting_names) ):
+            print("ERROR: Unrecognised USER SETTING", "\""+str(name)+"\"")
+            valid = 0
+            continue
+
+        current = globals()[name]
+        if current is None:
+            continue
+        if isinstance(current, bool) or isinstance(value, bool):
+            matches = isinstance(current, bool) and isinstance(value, bool)
+        elif isinstance(current, (int, float)):
+            matches = isinstance(value, (int, float))
+        else:
+            matches = isinstance(value, type(current))
+        if not matches:
+            print("ERROR: USER SETTING", "\""+name+"\"", "needs a", type(current).__name__, "not", "\""+str(value)+"\"")
+            valid = 0
+
+    if valid == 0:
+        return 0
+    globals().update(settings)
+    return 1
+
+
+# function to run the simulator from command line arguments (default sys.argv), for batch jobs that launch it many times
+# unless --interactive is given (or there are no arguments), anything that would prompt stops the run instead
+# returns the exit code: 0 when the simulation finished, 1 when it failed and 2 for bad or missing input
+def cli_main(argv=None):
+
+    if argv is None:
+        argv = sys.argv[1:]
+    args = get_cli_parser().parse_args(argv)
+    interactive = args.interactive or (len(argv) == 0)
+
+    # the config file first, then --set, then the named flags
+    settings = {}
+    if args.config is not None:
+        try:
+            with open(args.config) as f:
+                config = json.load(f)
+        except (OSError, ValueError) as error:
+            print("CRITICAL ERROR: Could not read config file", "\""+args.config+"\"", "-", error)
+            return 2
+        if not isinstance(config, dict):
+            print("CRITICAL ERROR: Config file", "\""+args.config+"\"", "must hold a JSON object of USER SETTINGS")
+            return 2
+        settings.update(config)
+
+    for assignment in args.set:
+        name, separator, value = assignment.partition("=")
+        if separator == "":
+            print("CRITICAL ERROR: --set", "\""+assignment+"\"", "is not NAME=VALUE")
+            return 2
+        try:
+            settings[name] = json.loads(value)
+        except ValueError:
+            settings[name] = value
+
+    for flag, name, options in cli_flags:
+        if getattr(args, name) is not None:
+            settings[name] = getattr(args, name)
+
+    if set_user_settings(settings) == 0:
+        print("CRITICAL ERROR: Invalid USER SETTINGS")
+        return 2
+
+    if not interactive:
+        if MAX_TIMESTAMP <= 0:
+            print("CRITICAL ERROR: No tick count, give --ticks or set MAX_TIMESTAMP")
+            return 2
+
+        missing = []
+        for name, filename in get_input_files():
+            if( (str(filename) == "") or not Path(filename).is_file() ):
+                if (name, filename) not in missing:
+                    missing.append((name, filename))
+        for name, filename in missing:
+            if str(filename) == "":
+                print("ERROR: No", name, "given")
+            else:
+                print("ERROR:", name, "file not found:", "\""+str(filename)+"\"")
+        if len(missing) != 0:
+            print("CRITICAL ERROR: Missing input files, give them as arguments or use --interactive")
+            return 2
+
+        sys.stdin = open(os.devnull)  # any other prompt reads the end of the input and stops the run instead of waiting
+
+    try:
+        status = main()
+    except EOFError:
+        print()
+        if interactive:
+            print("CRITICAL ERROR: The input ended while the simulator was asking for it")
+        else:
+            print("CRITICAL ERROR: The simulator asked for input. Give the missing setting as an argument, or use --interactive")
+        return 2
+    except SystemExit as stop:  # main() stops with exit(1) on critical errors and runs that did not finish
+        return stop.code if isinstance(stop.code, int) else 1
+
+    return 0 if status != 0 else 1
 
 
 
@@ -2223,7 +4998,7 @@ avg_queueing_file.close()
 ################### DEMO  CODE ###################
 ##################################################
 
-if 0:
+def print_demo(sim):
     print()
     print()
     print("DEMO CODE AS FOLLOWS:")
@@ -2231,30 +5006,38 @@ if 0:
 
     # print traffic types
     print("Defined Traffic types from XML (differentiated by \"unique_id\"):")
-    for traffic in g_generic_traffics_dict:
-        print(traffic, g_generic_traffics_dict[traffic])
+    for traffic in sim.generic_traffics_dict:
+        print(traffic, sim.generic_traffics_dict[traffic])
     print()
 
     # print nodes
     print("Nodes from XML:")
-    for node in g_node_id_dict:
-        print(g_node_id_dict[node].to_string())
+    for node in sim.node_id_dict:
+        print(sim.node_id_dict[node].to_string())
     print()
 
 
     # # print GCL
     # print("GCL from file:")
-    # for timestamp in g_offline_GCL:
-    #    print(timestamp, g_offline_GCL[timestamp])
+    # for timestamp in sim.offline_GCL:
+    #    print(timestamp, sim.offline_GCL[timestamp])
     # print()
 
     # print an example queue type
     print("Queue definition example for Switch ID 0:")
-    print(g_node_id_dict[0].queue_definition.to_string())
+    print(sim.node_id_dict[0].queue_definition.to_string())
     print()
 
     # print routing table
     print("Routing table parsed from network topology:")
-    for switch_node in g_node_id_dict[0].routing_table:
-        print(switch_node, g_node_id_dict[0].routing_table[switch_node])
+    for switch_node in sim.node_id_dict[0].routing_table:
+        print(switch_node, sim.node_id_dict[0].routing_table[switch_node])
     print()
+
+    return 1
+
+
+
+
+if __name__ == "__main__":
+    sys.exit(cli_main())